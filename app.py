@@ -1,6 +1,27 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from src.agent.tokens import load_tokenizer
+from src.agent.transport import aclose_http_client
+from src.agent.utils import aclose_llm_clients
 from src.endpoints import api_prediction_router
+from src.services.jobs import job_manager
+from src.services.prediction_service import prediction_service
+from src.settings import settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.LLM_TOKEN_METRICS:
+        await load_tokenizer()
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await prediction_service.aclose()
+    await aclose_llm_clients()
+    await aclose_http_client()
+
 
-app = FastAPI(title="ML Service", version="1.0")
+app = FastAPI(title="ML Service", version="1.0", lifespan=lifespan)
 
 app.include_router(api_prediction_router, prefix="/api/v1", tags=["prediction"])
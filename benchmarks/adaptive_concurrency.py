@@ -0,0 +1,82 @@
+"""Бенчмарк адаптивного лимита одновременных вызовов LLM.
+
+Запускает локальную замену сервера llama.cpp (см. standin_server.py), который
+вычисляет параллельно --parallel запросов, и отправляет --calls вызовов сразу.
+Сравнивает фиксированные лимиты (семафор перед LLM) с адаптивным
+(LLM_ADAPTIVE_CONCURRENCY): пропускную способность, p95 длительности вызова
+на бэкенде и итоговый лимит. Флаг --no-slots скрывает GET /slots, и лимит подбирается
+только по задержке.
+
+Запуск:
+    python -m benchmarks.adaptive_concurrency [--parallel 4] [--calls 200] [--no-slots]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent.transport import aclose_http_client  # noqa: E402
+from src.agent.utils import LLM  # noqa: E402
+from src.metrics import metrics  # noqa: E402
+from src.settings import settings  # noqa: E402
+
+PROMPT = "Классифицируй отзыв: автобус 55 постоянно опаздывает. " * 20
+
+
+async def run(server: StandInServer, calls: int, fixed_limit: int | None) -> dict:
+    settings.LLM_ADAPTIVE_CONCURRENCY = fixed_limit is None
+    server.reset()
+    llm = LLM(base_url=server.base_url)
+    semaphore = asyncio.Semaphore(fixed_limit or calls)
+
+    async def call() -> None:
+        async with semaphore:
+            await llm.ainvoke(PROMPT)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    await llm.aclose()
+    return {
+        "throughput": calls / elapsed,
+        # Длительность вызова на бэкенде, без ожидания в очереди клиента
+        "p95": llm.latency.percentile(95) * 1000,
+        "limit": int(llm.concurrency.limit) if llm.concurrency else fixed_limit,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Adaptive LLM concurrency benchmark")
+    parser.add_argument("--parallel", type=int, default=4, help="Requests the server computes at once")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--ms-per-token", type=float, default=0.1)
+    parser.add_argument("--no-slots", action="store_true", help="Do not expose GET /slots")
+    args = parser.parse_args()
+
+    server = StandInServer(
+        slots=args.parallel, parallel=args.parallel, prompt_ms_per_token=args.ms_per_token
+    )
+    if args.no_slots:
+        server.app.router.routes = [
+            route for route in server.app.router.routes if getattr(route, "path", "") != "/slots"
+        ]
+    server.start()
+    settings.LLM_CONCURRENCY_INITIAL = 1
+    try:
+        print(f"{'limit':<10}{'calls/s':>9}{'p95 ms':>9}{'final':>7}")
+        for fixed_limit in (1, args.parallel, args.parallel * 8, None):
+            metrics.reset()
+            stats = await run(server, args.calls, fixed_limit)
+            name = "adaptive" if fixed_limit is None else f"fixed {fixed_limit}"
+            print(f"{name:<10}{stats['throughput']:>9.1f}{stats['p95']:>9.1f}{stats['limit']:>7}")
+    finally:
+        await aclose_http_client()
+        server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
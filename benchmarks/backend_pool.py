@@ -0,0 +1,81 @@
+"""Бенчмарк масштабирования пула бэкендов LLM.
+
+Запускает до --max-backends локальных замен сервера llama.cpp (см.
+standin_server.py; каждый обрабатывает запросы последовательно, как один
+CPU-узел) и отправляет --calls вызовов с параллелизмом --concurrency через
+LLM(backends=[...]). Для каждого числа бэкендов печатает пропускную
+способность и распределение вызовов.
+
+Запуск:
+    python -m benchmarks.backend_pool [--max-backends 3] [--calls 60] [--routing least_loaded]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent.transport import aclose_http_client  # noqa: E402
+from src.agent.utils import LLM  # noqa: E402
+from src.settings import settings  # noqa: E402
+
+PROMPT = "Классифицируй отзыв: автобус 55 постоянно опаздывает, приходится ждать по 20 минут. " * 20
+
+
+async def run(servers: list[StandInServer], calls: int, concurrency: int, routing: str) -> float:
+    settings.LLM_ROUTING = routing
+    for server in servers:
+        server.reset()
+    llm = LLM(backends=[server.base_url for server in servers])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call() -> None:
+        async with semaphore:
+            await llm.ainvoke(PROMPT)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    await llm.aclose()
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="LLM backend pool benchmark")
+    parser.add_argument("--max-backends", type=int, default=3)
+    parser.add_argument("--calls", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--ms-per-token", type=float, default=0.1, help="Simulated prompt eval cost")
+    parser.add_argument("--routing", choices=["least_loaded", "round_robin"], default="least_loaded")
+    args = parser.parse_args()
+
+    servers = [
+        StandInServer(slots=1, prompt_ms_per_token=args.ms_per_token)
+        for _ in range(args.max_backends)
+    ]
+    for server in servers:
+        server.start()
+    try:
+        print(f"{'backends':>8}{'seconds':>10}{'calls/s':>10}{'speedup':>10}  distribution")
+        baseline = None
+        for n in range(1, args.max_backends + 1):
+            elapsed = await run(servers[:n], args.calls, args.concurrency, args.routing)
+            throughput = args.calls / elapsed
+            baseline = baseline or throughput
+            distribution = Counter({i: len(server.requests) for i, server in enumerate(servers[:n])})
+            print(
+                f"{n:>8}{elapsed:>10.2f}{throughput:>10.1f}{throughput / baseline:>9.2f}x"
+                f"  {dict(distribution)}"
+            )
+    finally:
+        await aclose_http_client()
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""Бенчмарк hedged-вызовов LLM.
+
+Запускает два локальных заменителя сервера llama.cpp (см. standin_server.py),
+у которых часть ответов задерживается в tail-factor раз, и сравнивает
+перцентили длительности вызова и число отправленных запросов без hedging
+и с ним (LLM_HEDGING).
+
+Запуск:
+    python -m benchmarks.hedging [--calls 300] [--tail-probability 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent.transport import aclose_http_client  # noqa: E402
+from src.agent.utils import LLM  # noqa: E402
+from src.settings import settings  # noqa: E402
+
+PROMPT = "Классифицируй отзыв: автобус 55 постоянно опаздывает. " * 20
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def run(servers: list[StandInServer], calls: int, concurrency: int, hedging: bool) -> dict:
+    settings.LLM_HEDGING = hedging
+    for server in servers:
+        server.reset()
+    llm = LLM(backends=[server.base_url for server in servers])
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def call() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await llm.ainvoke(PROMPT)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(call() for _ in range(calls)))
+    await llm.aclose()
+    return {
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies),
+        "requests": sum(len(server.requests) for server in servers),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Hedged LLM calls benchmark")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tail-probability", type=float, default=0.05)
+    parser.add_argument("--tail-factor", type=float, default=10.0)
+    parser.add_argument("--percentile", type=float, default=95.0)
+    args = parser.parse_args()
+
+    random.seed(0)
+    settings.LLM_HEDGE_PERCENTILE = args.percentile
+    ms_per_token = 0.05
+    base_ms = 200 * ms_per_token
+    servers = [
+        StandInServer(
+            slots=4,
+            prompt_ms_per_token=ms_per_token,
+            tail_probability=args.tail_probability,
+            tail_delay_ms=base_ms * (args.tail_factor - 1),
+        )
+        for _ in range(2)
+    ]
+    for server in servers:
+        server.start()
+    try:
+        print(f"{'mode':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'requests':>10}")
+        for name, hedging in (("plain", False), ("hedged", True)):
+            stats = await run(servers, args.calls, args.concurrency, hedging)
+            print(
+                f"{name:<10}{stats['p50']:>9.1f}{stats['p95']:>9.1f}{stats['p99']:>9.1f}"
+                f"{stats['mean']:>9.1f}{stats['requests']:>10}"
+            )
+    finally:
+        await aclose_http_client()
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""Бенчмарк переиспользования префикса промпта (cache_prompt) в llama.cpp.
+
+Отправляет промпты трех этапов графа для набора батчей на локальную замену
+сервера llama.cpp (см. standin_server.py) и сравнивает, сколько токенов
+промпта сервер вычисляет заново и сколько времени это занимает:
+
+- legacy — прежняя раскладка: одно сообщение пользователя, в котором
+  переменная часть (категории и отзывы) стоит между инструкциями и форматом
+  ответа, cache_prompt не передается;
+- legacy+cache — прежняя раскладка с cache_prompt;
+- system+cache — текущая раскладка: неизменяемое системное сообщение и
+  переменное сообщение пользователя, cache_prompt передается.
+
+Запуск:
+    python -m benchmarks.prompt_cache [reviews.json] [--batches 20] [--few-shot]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent.prompts import (  # noqa: E402
+    CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT,
+    CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT,
+    MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT,
+)
+from src.agent.utils import (  # noqa: E402
+    LLM,
+    format_reviews,
+    format_reviews_with_categories,
+    format_reviews_with_categories_and_sentiments,
+)
+from src.services.prediction_service import PredictionService  # noqa: E402
+
+SAMPLE_REVIEWS = [
+    "Автобус 55 постоянно опаздывает, приходится ждать по 20 минут.",
+    "В поликлинике №10 отличные врачи, но в регистратуре хамят.",
+    "Парк Горького стал очень чистым и красивым, спасибо!",
+    "Невозможно записаться к стоматологу через госуслуги, постоянно ошибка.",
+    "Во дворе дома 5 по улице Ленина не вывозят мусор уже неделю.",
+    "В школе №3 протекает крыша в спортзале.",
+    "Интернет в районе пропадает каждый вечер.",
+    "В МФЦ быстро оформили документы, персонал вежливый.",
+]
+
+FORMAT_SECTION_MARKER = "Верни результат"
+
+
+def load_reviews(path: str | None, count: int) -> List[Dict[str, Any]]:
+    if path:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+        reviews = [
+            item if isinstance(item, dict) else {"id": i + 1, "text": item}
+            for i, item in enumerate(raw)
+        ]
+        return reviews[:count]
+    return [
+        {"id": i + 1, "text": f"{SAMPLE_REVIEWS[i % len(SAMPLE_REVIEWS)]} (#{i + 1})"}
+        for i in range(count)
+    ]
+
+
+def stage_messages(batch: List[Dict[str, Any]], categories: List[str], few_shot: bool) -> List[list]:
+    """Сообщения трех этапов графа для батча (как в src/agent/graph.py)."""
+    batch_categories = [["Прочее"] for _ in batch]
+    batch_sentiments = [{"Прочее": "нейтрально", "overall": "нейтрально"} for _ in batch]
+    if few_shot:
+        templates = (
+            CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+            CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+            MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+        )
+    else:
+        templates = (
+            CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT,
+            CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT,
+            MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT,
+        )
+    return [
+        templates[0].format_messages(
+            reviews=format_reviews(batch), available_categories=", ".join(categories)
+        ),
+        templates[1].format_messages(
+            reviews_with_categories=format_reviews_with_categories(batch, batch_categories)
+        ),
+        templates[2].format_messages(
+            reviews_with_categories_and_sentiments=format_reviews_with_categories_and_sentiments(
+                batch, batch_categories, batch_sentiments
+            )
+        ),
+    ]
+
+
+def legacy_layout(messages: list) -> list:
+    """Прежняя раскладка: переменная часть вставлена перед разделом формата ответа."""
+    system, user = messages[0].content, messages[1].content
+    head, marker, tail = system.partition(FORMAT_SECTION_MARKER)
+    return [HumanMessage(content=head + user + "\n" + marker + tail)]
+
+
+async def run_scenario(
+    server: StandInServer,
+    batches: List[List[Dict[str, Any]]],
+    categories: List[str],
+    few_shot: bool,
+    legacy: bool,
+    cache_prompt: bool,
+) -> Dict[str, float]:
+    server.reset()
+    llm = LLM(base_url=server.base_url, cache_prompt=cache_prompt)
+
+    started = time.perf_counter()
+    for batch in batches:
+        for messages in stage_messages(batch, categories, few_shot):
+            await llm.ainvoke(legacy_layout(messages) if legacy else messages)
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    prompt_n = sum(r.prompt_n for r in server.requests)
+    cache_n = sum(r.cache_n for r in server.requests)
+    return {
+        "requests": len(server.requests),
+        "prompt_tokens": prompt_n,
+        "evaluated_tokens": prompt_n - cache_n,
+        "cached_share": cache_n / prompt_n if prompt_n else 0.0,
+        "prompt_eval_ms": sum(r.prompt_ms for r in server.requests),
+        "wall_ms": wall_ms,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Prompt cache reuse benchmark")
+    parser.add_argument("file_path", nargs="?", default=None, help="JSON file with reviews")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--slots", type=int, default=3, help="Number of llama.cpp slots")
+    parser.add_argument("--ms-per-token", type=float, default=0.05, help="Simulated prompt eval cost")
+    parser.add_argument("--few-shot", action="store_true")
+    args = parser.parse_args()
+
+    reviews = load_reviews(args.file_path, args.batches * args.batch_size)
+    batches = [
+        reviews[i : i + args.batch_size] for i in range(0, len(reviews), args.batch_size)
+    ]
+    categories = PredictionService(agent=object(), cache=None).available_categories
+
+    server = StandInServer(slots=args.slots, prompt_ms_per_token=args.ms_per_token)
+    server.start()
+    try:
+        scenarios = {
+            "legacy": (True, False),
+            "legacy+cache": (True, True),
+            "system+cache": (False, True),
+        }
+        print(
+            f"{'layout':<14}{'requests':>10}{'prompt tok':>12}{'evaluated':>12}"
+            f"{'cached':>9}{'eval ms':>10}{'wall ms':>10}"
+        )
+        for name, (legacy, cache_prompt) in scenarios.items():
+            stats = await run_scenario(server, batches, categories, args.few_shot, legacy, cache_prompt)
+            print(
+                f"{name:<14}{stats['requests']:>10}{stats['prompt_tokens']:>12}"
+                f"{stats['evaluated_tokens']:>12}{stats['cached_share']:>9.1%}"
+                f"{stats['prompt_eval_ms']:>10.0f}{stats['wall_ms']:>10.0f}"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
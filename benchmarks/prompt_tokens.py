@@ -0,0 +1,120 @@
+"""Бенчмарк компактной записи отзывов в промпте (PROMPT_COMPACT).
+
+Считает токены промптов трех этапов графа и ожидаемых JSON-ответов модели
+для набора батчей в двух вариантах:
+
+- legacy — прежняя запись: заголовок "N. Отзыв (ID=...)", разделитель из
+  100 дефисов, id отзывов из базы в промпте и в ответе;
+- compact — одна строка на отзыв, локальные номера 1..n (LocalIdAgent).
+
+Сервер не нужен: промпты собираются так же, как в src/agent/graph.py, а
+токены считаются src.agent.tokens.count_tokens (tiktoken, без него — оценка
+по длине). Отзывы берутся из JSON-массива или из JSONL в формате тела
+запроса /predict (строка — {"reviews": [...]}) либо по отзыву на строку.
+
+Запуск:
+    python -m benchmarks.prompt_tokens [reviews.json|requests.jsonl] [--batch-size 10] [--few-shot]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.prompt_cache import SAMPLE_REVIEWS, stage_messages  # noqa: E402
+from src.agent.tokens import count_prompt_tokens, count_tokens, load_tokenizer  # noqa: E402
+from src.services.prediction_service import PredictionService  # noqa: E402
+from src.settings import settings  # noqa: E402
+
+STAGES = ("category", "sentiment", "ideas")
+
+
+def load_reviews(path: str | None, count: int) -> List[Dict[str, Any]]:
+    if not path:
+        # id из базы: многозначные, как у реальных записей
+        return [
+            {"id": 48213077 + 37 * i, "text": f"{SAMPLE_REVIEWS[i % len(SAMPLE_REVIEWS)]} (#{i + 1})"}
+            for i in range(count)
+        ]
+    content = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".jsonl"):
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        items = json.loads(content)
+    reviews: List[Dict[str, Any]] = []
+    for item in items:
+        if isinstance(item, dict) and "reviews" in item:
+            reviews.extend(item["reviews"])
+        elif isinstance(item, dict):
+            reviews.append(item)
+        else:
+            reviews.append({"id": len(reviews) + 1, "text": str(item)})
+    return reviews[:count]
+
+
+def stage_answers(ids: List[Any]) -> List[str]:
+    """Ответы трех этапов на батч в формате JSON-схем (src/agent/schemas.py)."""
+    dump = lambda data: json.dumps(data, ensure_ascii=False)  # noqa: E731
+    return [
+        dump({"reviews": [{"review_id": i, "categories": ["Прочее"]} for i in ids]}),
+        dump({"reviews": [
+            {"review_id": i, "sentiments": {"Прочее": "нейтрально"}, "overall": "нейтрально"} for i in ids
+        ]}),
+        dump({"ideas_by_category": [{"category": "Прочее", "items": [
+            {"description": "Проверить обращение и сообщить заявителю о результате", "source_ids": ids}
+        ]}]}),
+    ]
+
+
+def measure(batches: List[List[Dict[str, Any]]], categories: List[str], few_shot: bool, compact: bool) -> Dict[str, List[int]]:
+    settings.PROMPT_COMPACT = compact
+    totals = {stage: [0, 0] for stage in STAGES}
+    for batch in batches:
+        if compact:
+            batch = [{**review, "id": i} for i, review in enumerate(batch, 1)]
+        prompts = stage_messages(batch, categories, few_shot)
+        answers = stage_answers([review["id"] for review in batch])
+        for stage, prompt, answer in zip(STAGES, prompts, answers):
+            totals[stage][0] += count_prompt_tokens(prompt)
+            totals[stage][1] += count_tokens(answer)
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("reviews", nargs="?", help="JSON или JSONL с отзывами")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=settings.BATCH_SIZE)
+    parser.add_argument("--few-shot", action="store_true")
+    args = parser.parse_args()
+
+    reviews = load_reviews(args.reviews, args.count)
+    batches = [reviews[i : i + args.batch_size] for i in range(0, len(reviews), args.batch_size)]
+    categories = PredictionService(agent=object()).available_categories
+
+    tokenizer = settings.TOKENIZER_ENCODING if asyncio.run(load_tokenizer()) else (
+        f"оценка по длине ({settings.CHARS_PER_TOKEN} символа на токен)"
+    )
+    print(f"{len(reviews)} отзывов, {len(batches)} батчей, токенизатор: {tokenizer}")
+
+    legacy = measure(batches, categories, args.few_shot, compact=False)
+    compact = measure(batches, categories, args.few_shot, compact=True)
+
+    print(f"{'этап':<10} {'промпт legacy':>14} {'compact':>9} {'ответ legacy':>13} {'compact':>9}")
+    for stage in STAGES:
+        print(
+            f"{stage:<10} {legacy[stage][0]:>14} {compact[stage][0]:>9}"
+            f" {legacy[stage][1]:>13} {compact[stage][1]:>9}"
+        )
+    for index, name in ((0, "промпт"), (1, "ответ")):
+        before = sum(value[index] for value in legacy.values())
+        after = sum(value[index] for value in compact.values())
+        print(f"{name}: {before} -> {after} токенов ({(before - after) / before:.1%} меньше)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Бенчмарк классификации тривиальных отзывов правилами (RULES_ENABLED).
+
+Показывает, какая доля отзывов получает ответ без LLM (по правилам
+empty, emoji, thanks, keywords) и сколько времени занимает проверка
+одного отзыва. Отзывы берутся из JSON или JSONL (как в prompt_tokens.py),
+по умолчанию — смесь примеров жалоб с пустыми отзывами и благодарностями.
+
+Запуск:
+    python -m benchmarks.rules [reviews.json|requests.jsonl] [--count 10000]
+"""
+
+import argparse
+import os
+import time
+from collections import Counter
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.prompt_cache import SAMPLE_REVIEWS  # noqa: E402
+from benchmarks.prompt_tokens import load_reviews  # noqa: E402
+from src.services.prediction_service import PredictionService  # noqa: E402
+from src.services.rules import RuleClassifier  # noqa: E402
+
+TRIVIAL_REVIEWS = ["Спасибо!", "", "👍", "Благодарю за работу", "Автобус опять опаздывает", "..."]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("reviews", nargs="?", help="JSON или JSONL с отзывами")
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.reviews:
+        texts = [review.get("text", "") for review in load_reviews(args.reviews, args.count)]
+    else:
+        pool = SAMPLE_REVIEWS + TRIVIAL_REVIEWS
+        texts = [pool[i % len(pool)] for i in range(args.count)]
+
+    classifier = RuleClassifier(PredictionService(agent=object()).available_categories)
+    rules: Counter = Counter()
+    started = time.perf_counter()
+    for text in texts:
+        result = classifier.classify(text)
+        rules[result[1] if result else "llm"] += 1
+    elapsed = time.perf_counter() - started
+
+    answered = len(texts) - rules["llm"]
+    print(f"{len(texts)} отзывов: {answered} ({answered / len(texts):.0%}) без LLM, {elapsed / len(texts) * 1e6:.1f} мкс на отзыв")
+    for rule, count in rules.most_common():
+        print(f"  {rule:<10} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Бенчмарк общего диалога этапов графа (STAGE_SESSION).
+
+Прогоняет граф классификации на наборе батчей через локальную замену сервера
+llama.cpp (см. standin_server.py) с cache_prompt и сравнивает, сколько
+токенов промпта отправляется и сколько сервер вычисляет заново:
+
+- separate — текущая раскладка: каждый этап передает текст отзывов заново;
+- session — этапы продолжают один диалог, отзывы передаются один раз,
+  последующие этапы добавляют короткое указание.
+
+Запуск:
+    python -m benchmarks.stage_session [reviews.json] [--batches 20] [--few-shot] [--fused]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.prompt_cache import load_reviews  # noqa: E402
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent import graph  # noqa: E402
+from src.agent.transport import aclose_http_client  # noqa: E402
+from src.agent.utils import LLM  # noqa: E402
+from src.services.prediction_service import PredictionService  # noqa: E402
+
+_ID_RE = re.compile(r"ID=(\d+)")
+
+
+def respond(messages: List[Dict[str, Any]]) -> str:
+    """Ответ модели в формате этапа, на который указывает последнее сообщение."""
+    ids = [int(review_id) for review_id in _ID_RE.findall(messages[-1]["content"])]
+    text = messages[0]["content"] + messages[-1]["content"]
+    if "ideas_by_category" in text:
+        payload = {"ideas_by_category": [
+            {"category": "Транспорт", "items": [{"description": "Пустить больше автобусов", "source_ids": ids}]}
+        ]}
+    elif "overall" in text:
+        payload = {"reviews": [
+            {"review_id": i, "sentiments": {"Транспорт": "отрицательно"}, "overall": "отрицательно"}
+            for i in ids
+        ]}
+    else:
+        payload = {"reviews": [{"review_id": i, "categories": ["Транспорт"]} for i in ids]}
+    return json.dumps(payload, ensure_ascii=False)
+
+
+async def run(
+    server: StandInServer,
+    batches: List[List[Dict[str, Any]]],
+    categories: List[str],
+    few_shot: bool,
+    fused: bool,
+    session: bool,
+) -> Dict[str, float]:
+    server.reset()
+    started = time.perf_counter()
+    for batch in batches:
+        await graph.classification_agent.ainvoke({
+            "reviews": batch,
+            "available_categories": categories,
+            "categories": [],
+            "sentiments": [],
+            "ideas": [],
+            "use_few_shot": few_shot,
+            "use_fused_stage": fused,
+            "use_session": session,
+            "messages": [],
+        })
+    wall_ms = (time.perf_counter() - started) * 1000
+    prompt_n = sum(r.prompt_n for r in server.requests)
+    cache_n = sum(r.cache_n for r in server.requests)
+    return {
+        "requests": len(server.requests),
+        "prompt_tokens": prompt_n,
+        "evaluated_tokens": prompt_n - cache_n,
+        "prompt_eval_ms": sum(r.prompt_ms for r in server.requests),
+        "wall_ms": wall_ms,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Stage session benchmark")
+    parser.add_argument("file_path", nargs="?", default=None, help="JSON file with reviews")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--slots", type=int, default=3, help="Number of llama.cpp slots")
+    parser.add_argument("--ms-per-token", type=float, default=0.05, help="Simulated prompt eval cost")
+    parser.add_argument("--few-shot", action="store_true")
+    parser.add_argument("--fused", action="store_true")
+    args = parser.parse_args()
+
+    reviews = load_reviews(args.file_path, args.batches * args.batch_size)
+    batches = [reviews[i : i + args.batch_size] for i in range(0, len(reviews), args.batch_size)]
+    categories = PredictionService(agent=object(), cache=None).available_categories
+
+    server = StandInServer(slots=args.slots, prompt_ms_per_token=args.ms_per_token, responder=respond)
+    server.start()
+    graph.llm_client = LLM(base_url=server.base_url, cache_prompt=True)
+    try:
+        print(
+            f"{'layout':<10}{'requests':>10}{'prompt tok':>12}{'evaluated':>12}"
+            f"{'eval ms':>10}{'wall ms':>10}"
+        )
+        for name, session in (("separate", False), ("session", True)):
+            stats = await run(server, batches, categories, args.few_shot, args.fused, session)
+            print(
+                f"{name:<10}{stats['requests']:>10}{stats['prompt_tokens']:>12}"
+                f"{stats['evaluated_tokens']:>12}{stats['prompt_eval_ms']:>10.0f}{stats['wall_ms']:>10.0f}"
+            )
+    finally:
+        await graph.llm_client.aclose()
+        await aclose_http_client()
+        server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+"""Локальная замена сервера llama.cpp для бенчмарков.
+
+Эмулирует OpenAI-совместимый эндпоинт /v1/chat/completions сервера llama.cpp
+с несколькими слотами и KV-кэшем промпта:
+
+- промпт разбивается на "токены" (слова и знаки препинания);
+- запрос попадает в слот, закэшированный промпт которого имеет самый длинный
+  общий префикс с новым, если доля общего префикса больше slot_similarity
+  (как --slot-prompt-similarity в llama.cpp), иначе — в давно не
+  использовавшийся слот;
+- при cache_prompt=true общий префикс не вычисляется заново, иначе
+  вычисляется весь промпт;
+- время вычисления промпта эмулируется задержкой prompt_ms_per_token на токен;
+  одновременно вычисляется не больше parallel запросов (1 — последовательно,
+  как один CPU-узел), остальные ждут в очереди;
+- генерация ответа эмулируется задержкой decode_ms_per_token на токен и
+  обрезается по max_tokens; при stream=true ответ отдается SSE-потоком,
+  а при разрыве соединения генерация прекращается, как в llama.cpp;
+- сгенерированный ответ остается в кэше слота после промпта, поэтому
+  следующий ход того же диалога вычисляет только новые сообщения;
+- GET /slots возвращает список слотов, как llama.cpp;
+- с вероятностью tail_probability ответ задерживается еще на tail_delay_ms
+  (медленные вызовы на общем бэкенде).
+
+Статистика по запросам доступна в StandInServer.requests.
+"""
+
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Токены ответа вместе с предшествующими пробелами (для посимвольно точной склейки)
+_PIECE_RE = re.compile(r"\s*(?:\w+|[^\w\s])|\s+$")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text)
+
+
+def render_chat(messages: List[Dict[str, Any]]) -> str:
+    """Упрощенный chat template: роль и содержимое каждого сообщения."""
+    return "".join(f"<|{m.get('role')}|>\n{m.get('content')}\n" for m in messages)
+
+
+@dataclass
+class RequestStats:
+    slot: int
+    prompt_n: int
+    cache_n: int
+    prompt_ms: float
+    completion_n: int = 0
+
+
+@dataclass
+class StandInServer:
+    slots: int = 3
+    prompt_ms_per_token: float = 0.05
+    slot_similarity: float = 0.5
+    parallel: int = 1
+    decode_ms_per_token: float = 0.0
+    tail_probability: float = 0.0
+    tail_delay_ms: float = 0.0
+    # Функция, формирующая ответ модели по списку сообщений
+    responder: Optional[Callable[[List[Dict[str, Any]]], str]] = None
+    requests: List[RequestStats] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self._slot_tokens: List[List[str]] = [[] for _ in range(self.slots)]
+        self._slot_used: List[int] = [0] * self.slots
+        self._lock = asyncio.Lock()
+        self._compute = asyncio.Semaphore(self.parallel)
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self._chat_completions)
+        self.app.get("/health")(self._health)
+        self.app.get("/slots")(self._slots)
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def reset(self) -> None:
+        self._slot_tokens = [[] for _ in range(self.slots)]
+        self._slot_used = [0] * self.slots
+        self.requests = []
+
+    async def _health(self) -> Dict[str, str]:
+        return {"status": "ok"}
+
+    async def _slots(self) -> List[Dict[str, Any]]:
+        return [{"id": i, "n_ctx": 0} for i in range(self.slots)]
+
+    async def _prefill(self, tokens: List[str], cache_prompt: bool) -> RequestStats:
+        """Выбор слота и эмуляция вычисления промпта (вызывается внутри _compute)."""
+        async with self._lock:
+            slot, common = max(
+                (
+                    (i, _common_prefix(cached, tokens))
+                    for i, cached in enumerate(self._slot_tokens)
+                ),
+                key=lambda item: item[1],
+            )
+            if common <= self.slot_similarity * len(tokens):
+                slot = min(range(self.slots), key=lambda i: self._slot_used[i])
+                common = _common_prefix(self._slot_tokens[slot], tokens)
+            self._slot_used[slot] = len(self.requests) + 1
+            self._slot_tokens[slot] = tokens
+        cache_n = common if cache_prompt else 0
+        prompt_ms = (len(tokens) - cache_n) * self.prompt_ms_per_token
+        await asyncio.sleep(prompt_ms / 1000)
+        return RequestStats(slot=slot, prompt_n=len(tokens), cache_n=cache_n, prompt_ms=prompt_ms)
+
+    def _remember_answer(self, slot: int, tokens: List[str], generated: str) -> None:
+        """Сгенерированные токены остаются в KV-кэше слота вслед за промптом."""
+        if self._slot_tokens[slot] is tokens:
+            self._slot_tokens[slot] = tokens + tokenize(
+                render_chat([{"role": "assistant", "content": generated}])
+            )
+
+    async def _tail_delay(self) -> None:
+        if self.tail_probability and random.random() < self.tail_probability:
+            await asyncio.sleep(self.tail_delay_ms / 1000)
+
+    async def _chat_completions(self, request: Request) -> Any:
+        body = await request.json()
+        messages = body.get("messages", [])
+        tokens = tokenize(render_chat(messages))
+        cache_prompt = bool(body.get("cache_prompt", False))
+        content = self.responder(messages) if self.responder else "{}"
+        pieces = _PIECE_RE.findall(content)
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        finish_reason = "stop"
+        if max_tokens and len(pieces) > max_tokens:
+            pieces, finish_reason = pieces[:max_tokens], "length"
+        model = body.get("model", "stand-in")
+
+        if body.get("stream"):
+            return StreamingResponse(
+                self._stream(tokens, cache_prompt, pieces, finish_reason, model),
+                media_type="text/event-stream",
+            )
+
+        async with self._compute:
+            stats = await self._prefill(tokens, cache_prompt)
+            await asyncio.sleep(len(pieces) * self.decode_ms_per_token / 1000)
+        await self._tail_delay()
+
+        content = "".join(pieces)
+        self._remember_answer(stats.slot, tokens, content)
+        stats.completion_n = len(pieces)
+        self.requests.append(stats)
+
+        return {
+            "id": f"chatcmpl-{len(self.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": stats.prompt_n,
+                "completion_tokens": stats.completion_n,
+                "total_tokens": stats.prompt_n + stats.completion_n,
+            },
+            "timings": {
+                "prompt_n": stats.prompt_n - stats.cache_n,
+                "cache_n": stats.cache_n,
+                "prompt_ms": stats.prompt_ms,
+            },
+        }
+
+    async def _stream(
+        self,
+        tokens: List[str],
+        cache_prompt: bool,
+        pieces: List[str],
+        finish_reason: str,
+        model: str,
+    ) -> AsyncIterator[str]:
+        """SSE-поток ответа; при разрыве соединения генерация прекращается."""
+        stats = None
+        try:
+            async with self._compute:
+                stats = await self._prefill(tokens, cache_prompt)
+                await self._tail_delay()
+                for piece in pieces:
+                    await asyncio.sleep(self.decode_ms_per_token / 1000)
+                    stats.completion_n += 1
+                    yield _sse(model, {"content": piece})
+            yield _sse(model, {}, finish_reason)
+            yield "data: [DONE]\n\n"
+        finally:
+            if stats is not None:
+                self._remember_answer(stats.slot, tokens, "".join(pieces[: stats.completion_n]))
+                self.requests.append(stats)
+
+    def start(self) -> None:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join()
+
+
+def _sse(model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+    chunk = {
+        "id": "chatcmpl-stream",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
@@ -0,0 +1,87 @@
+"""Бенчмарк потоковой генерации с остановкой на конце JSON.
+
+Запускает локальную замену сервера llama.cpp (см. standin_server.py) с
+задержкой --decode-ms на каждый сгенерированный токен. Модель отвечает как
+Qwen3: блок <think> (--think-tokens), JSON-ответ на батч и пояснение после
+него (--trailing-tokens). Сравнивает обычный вызов (ainvoke) и потоковый
+(LLM_STREAMING, astream): время на батч и число декодированных токенов.
+
+Запуск:
+    python -m benchmarks.streaming [--batches 10] [--batch-size 10] [--decode-ms 2]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("OPENROUTER_API_KEY", "sk-not-required")
+
+from benchmarks.standin_server import StandInServer  # noqa: E402
+from src.agent.graph import output_token_budget  # noqa: E402
+from src.agent.transport import aclose_http_client  # noqa: E402
+from src.agent.utils import LLM, parse_review_category_items  # noqa: E402
+
+
+def make_responder(batch_size: int, think_tokens: int, trailing_tokens: int):
+    answer = json.dumps(
+        {"reviews": [{"review_id": i, "categories": ["Транспорт"]} for i in range(1, batch_size + 1)]},
+        ensure_ascii=False,
+    )
+    content = (
+        "<think>" + " думаю" * think_tokens + "</think>\n"
+        + answer
+        + "\n\nПояснение:" + " текст" * trailing_tokens
+    )
+    return lambda messages: content
+
+
+async def run(server: StandInServer, batches: int, batch_size: int, streaming: bool) -> dict:
+    server.reset()
+    llm = LLM(base_url=server.base_url)
+    prompt = "Классифицируй отзывы по категориям. " * 20
+    started = time.perf_counter()
+    for _ in range(batches):
+        if streaming:
+            response = await llm.astream(prompt, max_tokens=output_token_budget(batch_size, "category"))
+        else:
+            response = await llm.ainvoke(prompt)
+        assert len(parse_review_category_items(response)) == batch_size
+    elapsed = time.perf_counter() - started
+    await llm.aclose()
+    # Сервер фиксирует статистику запроса после закрытия потока
+    await asyncio.sleep(0.1)
+    return {
+        "per_batch_ms": elapsed / batches * 1000,
+        "decoded": sum(stats.completion_n for stats in server.requests) / batches,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Streaming early-stop benchmark")
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--decode-ms", type=float, default=2.0, help="Simulated decode cost per token")
+    parser.add_argument("--think-tokens", type=int, default=150)
+    parser.add_argument("--trailing-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    server = StandInServer(
+        slots=1,
+        decode_ms_per_token=args.decode_ms,
+        responder=make_responder(args.batch_size, args.think_tokens, args.trailing_tokens),
+    )
+    server.start()
+    try:
+        print(f"{'mode':<10}{'ms/batch':>10}{'decoded tok/batch':>19}")
+        for name, streaming in (("ainvoke", False), ("streaming", True)):
+            stats = await run(server, args.batches, args.batch_size, streaming)
+            print(f"{name:<10}{stats['per_batch_ms']:>10.1f}{stats['decoded']:>19.0f}")
+    finally:
+        await aclose_http_client()
+        server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
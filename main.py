@@ -17,6 +17,9 @@ async def main():
     parser = argparse.ArgumentParser(description="Sentiment Analysis CLI")
     parser.add_argument("file_path", nargs="?", default="reviews.json", help="Path to the JSON file with reviews")
     parser.add_argument("--few-shot", action="store_true", help="Enable few-shot mode")
+    parser.add_argument(
+        "--fused", action="store_true", help="Classify categories and sentiments in a single LLM call"
+    )
     args_cli = parser.parse_args()
 
     file_path = args_cli.file_path
@@ -64,12 +67,17 @@ async def main():
         logger.error("No valid reviews found.")
         return
 
-    from src.services.prediction_service import prediction_service
+    from src.agent.transport import aclose_http_client
+    from src.agent.utils import aclose_llm_clients
+    from src.services.prediction_service import PredictionReport, prediction_service
     
     logger.info(f"Loaded {len(reviews)} reviews. Starting classification...")
     
     try:
-        reviews_map, ideas_map = await prediction_service.predict(reviews, use_few_shot=use_few_shot)
+        report = PredictionReport()
+        reviews_map, ideas_map = await prediction_service.predict(
+            reviews, use_few_shot=use_few_shot, report=report, use_fused_stage=args_cli.fused or None
+        )
 
         print("\nClassification Results:")
         print("-" * 50)
@@ -95,9 +103,18 @@ async def main():
                 for idea in ideas_list:
                     print(f"  - {idea}")
             print("=" * 50)
+
+        for failure in report.failures:
+            logger.warning(
+                f"Batch {failure.batch_index} failed (review IDs: {failure.review_ids}): {failure.error}"
+            )
             
     except Exception as e:
         logger.error(f"Prediction failed: {e}")
+    finally:
+        await prediction_service.aclose()
+        await aclose_llm_clients()
+        await aclose_http_client()
 
 if __name__ == "__main__":
     asyncio.run(main())
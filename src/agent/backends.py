@@ -0,0 +1,226 @@
+"""Пул бэкендов LLM (несколько серверов llama.cpp) с балансировкой нагрузки.
+
+Каждый вызов направляется на один из исправных бэкендов:
+- "least_loaded" — с наименьшим числом выполняющихся запросов на единицу веса;
+- "round_robin" — взвешенный round-robin (плавный, как в nginx).
+
+Исправность проверяется в фоне запросом GET /health (llama.cpp отвечает 200,
+когда модель загружена) или, если эндпоинта нет, GET {base_url}/models.
+Бэкенд, на котором вызов упал с ошибкой соединения, выводится из ротации до
+следующей успешной проверки. Бэкенды с открытым автоматом (CircuitBreaker)
+не получают вызовов; если открыты все, вызов сразу завершается CircuitOpenError.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import httpx
+import openai
+
+from src.metrics import metrics
+from src.settings import settings
+
+from .rate_limit import is_transient_error
+from .resilience import CircuitBreaker, CircuitOpenError
+from .transport import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# Таймаут проверок /health и /slots (с), не больше интервала проверок:
+# общий таймаут чтения HTTP-клиента рассчитан на генерацию, а не на пробы
+PROBE_TIMEOUT = 5.0
+
+
+def parse_backends(value: str) -> List[Tuple[str, int]]:
+    """Разбор списка бэкендов вида "url1, url2|3" (после | — вес)."""
+    backends = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        backends.append((url.strip(), int(weight) if weight else 1))
+    return backends
+
+
+@dataclass
+class Backend:
+    """Один OpenAI-совместимый сервер и его текущее состояние."""
+    url: str
+    client: Any
+    weight: int = 1
+    in_flight: int = 0
+    healthy: bool = True
+    current_weight: int = field(default=0, repr=False)
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker, repr=False)
+
+    @property
+    def root_url(self) -> str:
+        root = self.url.rstrip("/")
+        if root.endswith("/v1"):
+            root = root[: -len("/v1")]
+        return root
+
+    @property
+    def health_url(self) -> str:
+        return f"{self.root_url}/health"
+
+
+class BackendPool:
+    """Выбор бэкенда для вызова и фоновая проверка исправности."""
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        routing: Optional[str] = None,
+        health_check_interval: Optional[float] = None,
+    ) -> None:
+        if not backends:
+            raise ValueError("Backend pool requires at least one backend")
+        self.backends = backends
+        self.routing = routing or settings.LLM_ROUTING
+        self.health_check_interval = (
+            settings.LLM_HEALTH_CHECK_INTERVAL
+            if health_check_interval is None
+            else health_check_interval
+        )
+        self._next_index = 0
+        self._health_task: Optional[asyncio.Task] = None
+        self._health_loop_owner: Optional[asyncio.AbstractEventLoop] = None
+
+    def _candidates(self, exclude: Optional[Backend] = None) -> List[Backend]:
+        available = [backend for backend in self.backends if backend.breaker.is_available()]
+        if not available:
+            raise CircuitOpenError("All LLM backends are unavailable (circuit open)")
+        candidates = [backend for backend in available if backend.healthy]
+        if not candidates:
+            # Все бэкенды помечены неисправными: пробуем все, а не отказываем сразу
+            logger.warning("No healthy LLM backends, trying all of them")
+            candidates = available
+        # Дублирующий вызов по возможности уходит на другой бэкенд, иначе — в другой слот того же
+        others = [backend for backend in candidates if backend is not exclude]
+        return others or candidates
+
+    def select(self, exclude: Optional[Backend] = None) -> Backend:
+        """Выбор бэкенда для следующего вызова."""
+        candidates = self._candidates(exclude)
+        if self.routing == "round_robin":
+            total = sum(backend.weight for backend in candidates)
+            for backend in candidates:
+                backend.current_weight += backend.weight
+            chosen = max(candidates, key=lambda backend: backend.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+        # При равной загрузке бэкенды перебираются по кругу
+        start = self._next_index % len(candidates)
+        ordered = candidates[start:] + candidates[:start]
+        chosen = min(ordered, key=lambda backend: backend.in_flight / backend.weight)
+        self._next_index = candidates.index(chosen) + 1
+        return chosen
+
+    @asynccontextmanager
+    async def acquire(self, exclude: Optional[Backend] = None) -> AsyncIterator[Backend]:
+        """Бэкенд на время одного вызова; ошибка соединения выводит его из ротации."""
+        self._ensure_health_checks()
+        backend = self.select(exclude)
+        backend.breaker.on_dispatch()
+        backend.in_flight += 1
+        try:
+            yield backend
+        except asyncio.CancelledError:
+            backend.breaker.release()
+            raise
+        except Exception as e:
+            if isinstance(e, (openai.APIConnectionError, httpx.TransportError)):
+                self._set_health(backend, False, reason=str(e))
+            if is_transient_error(e):
+                backend.breaker.record_failure()
+            else:
+                # Ошибка запроса (400, 401) ничего не говорит об исправности бэкенда,
+                # но пробный вызов полуоткрытой цепи должен завершиться
+                backend.breaker.release()
+            raise
+        else:
+            backend.breaker.record_success()
+        finally:
+            backend.in_flight -= 1
+
+    def _set_health(self, backend: Backend, healthy: bool, reason: str = "") -> None:
+        if backend.healthy != healthy:
+            if healthy:
+                logger.info(f"LLM backend {backend.url} is back in rotation")
+            else:
+                logger.warning(f"LLM backend {backend.url} taken out of rotation: {reason}")
+        backend.healthy = healthy
+        metrics.set_gauge("llm_backends_healthy", sum(b.healthy for b in self.backends))
+
+    @property
+    def probe_timeout(self) -> float:
+        """Таймаут запроса проверки: PROBE_TIMEOUT, но не дольше интервала проверок."""
+        if self.health_check_interval > 0:
+            return min(PROBE_TIMEOUT, self.health_check_interval)
+        return PROBE_TIMEOUT
+
+    async def check(self, backend: Backend) -> bool:
+        """Проверка исправности бэкенда."""
+        client = get_http_client()
+        try:
+            response = await client.get(backend.health_url, timeout=self.probe_timeout)
+            if response.status_code == 404:
+                response = await client.get(f"{backend.url.rstrip('/')}/models", timeout=self.probe_timeout)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def slots(self, backend: Backend) -> Optional[int]:
+        """Число слотов сервера llama.cpp (GET /slots) или None, если он их не отдает."""
+        try:
+            response = await get_http_client().get(f"{backend.root_url}/slots", timeout=self.probe_timeout)
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            return None
+        try:
+            slots = response.json()
+        except ValueError:
+            return None
+        return len(slots) if isinstance(slots, list) and slots else None
+
+    async def capacity(self) -> Optional[int]:
+        """Суммарное число слотов исправных бэкендов, если его сообщают все."""
+        backends = [backend for backend in self.backends if backend.healthy] or self.backends
+        results = await asyncio.gather(*(self.slots(backend) for backend in backends))
+        if any(slots is None for slots in results):
+            return None
+        return sum(results)
+
+    async def check_all(self) -> None:
+        results = await asyncio.gather(*(self.check(backend) for backend in self.backends))
+        for backend, healthy in zip(self.backends, results):
+            self._set_health(backend, healthy, reason="health check failed")
+
+    def _ensure_health_checks(self) -> None:
+        if len(self.backends) < 2 or self.health_check_interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._health_task is not None and not self._health_task.done() and self._health_loop_owner is loop:
+            return
+        self._health_task = loop.create_task(self._health_loop())
+        self._health_loop_owner = loop
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.health_check_interval)
+
+    async def aclose(self) -> None:
+        """Остановка фоновых проверок."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+            self._health_loop_owner = None
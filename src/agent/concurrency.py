@@ -0,0 +1,165 @@
+"""Адаптивное ограничение числа одновременных вызовов LLM (AIMD).
+
+Лимит не задается вручную, а подбирается по поведению бэкенда:
+- пока задержка вызова не превышает базовую (минимальную за окно) более чем
+  в LLM_CONCURRENCY_TOLERANCE раз и лимит выбран полностью, он растет на 1
+  за каждые "лимит" успешных вызовов (аддитивный рост);
+- при временной ошибке (429, 5xx, таймаут, сеть) или росте задержки лимит
+  умножается на LLM_CONCURRENCY_BACKOFF (мультипликативное снижение), не чаще
+  раза за время одного вызова. Отмененный вызов (например, проигравший
+  hedged-вызов) снижает лимит, если к моменту отмены он уже шел дольше
+  допустимой задержки.
+
+Верхняя граница — LLM_CONCURRENCY_MAX и, если бэкенды отдают GET /slots
+(llama.cpp), удвоенное суммарное число слотов исправных серверов. Текущий лимит
+публикуется в метрике llm_concurrency_limit.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from src.metrics import metrics
+from src.settings import settings
+
+from .rate_limit import is_transient_error
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Ограничитель одновременных вызовов с лимитом, подбираемым по AIMD."""
+
+    def __init__(
+        self,
+        initial: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        capacity_probe: Optional[Callable[[], Awaitable[Optional[int]]]] = None,
+        window: int = 100,
+    ) -> None:
+        self.min_limit = max(1, settings.LLM_CONCURRENCY_MIN if min_limit is None else min_limit)
+        self.max_limit = max(
+            self.min_limit, settings.LLM_CONCURRENCY_MAX if max_limit is None else max_limit
+        )
+        initial = settings.LLM_CONCURRENCY_INITIAL if initial is None else initial
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.tolerance = settings.LLM_CONCURRENCY_TOLERANCE
+        self.backoff = settings.LLM_CONCURRENCY_BACKOFF
+        self.in_flight = 0
+        self.capacity: Optional[int] = None
+        self._capacity_probe = capacity_probe
+        self._probed = False
+        self._latencies: deque = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._waiters: deque = deque()
+        self._publish()
+
+    @property
+    def ceiling(self) -> int:
+        if self.capacity:
+            # По одному запросу в очереди на слот, чтобы слот не простаивал между вызовами
+            return max(self.min_limit, min(self.max_limit, 2 * self.capacity))
+        return self.max_limit
+
+    def _publish(self) -> None:
+        metrics.set_gauge("llm_concurrency_limit", int(self.limit))
+
+    async def _probe_capacity(self) -> None:
+        self._probed = True
+        try:
+            capacity = await self._capacity_probe()
+        except Exception as e:
+            logger.warning(f"Failed to read LLM backend capacity: {e}")
+            return
+        if capacity:
+            self.capacity = capacity
+            self.limit = min(self.limit, self.ceiling)
+            self._publish()
+            logger.info(f"LLM backends report {capacity} slots")
+
+    async def acquire(self) -> None:
+        """Ожидание свободного места в пределах текущего лимита."""
+        if self._capacity_probe is not None and not self._probed:
+            await self._probe_capacity()
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= int(self.limit):
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        error: Optional[BaseException] = None,
+        cancelled: bool = False,
+    ) -> None:
+        """Освобождение места и поправка лимита по результату вызова."""
+        self.in_flight -= 1
+        if cancelled:
+            if latency is not None and self._is_slow(latency):
+                self._decrease(latency)
+        elif error is not None:
+            if is_transient_error(error):
+                self._decrease(latency)
+        elif latency is not None:
+            self._on_success(latency)
+        self._wake()
+
+    def _is_slow(self, latency: float) -> bool:
+        return bool(self._latencies) and latency > min(self._latencies) * self.tolerance
+
+    def _on_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        if self._is_slow(latency):
+            self._decrease(latency)
+        elif self.in_flight + 1 >= int(self.limit):
+            # Растет только лимит, в который действительно уперлась нагрузка
+            self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            self._publish()
+
+    def _decrease(self, latency: Optional[float]) -> None:
+        now = time.monotonic()
+        # Ответы, отправленные до прошлого снижения, не снижают лимит повторно
+        if latency is not None and now - self._last_decrease < latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._publish()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        for waiter in list(self._waiters):
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Место для одного вызова; длительность и ошибка вызова поправляют лимит."""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.release(time.monotonic() - started, cancelled=True)
+            raise
+        except Exception as e:
+            # Таймаут вызова (LLM_CALL_TIMEOUT) приходит как asyncio.TimeoutError
+            self.release(time.monotonic() - started, e)
+            raise
+        else:
+            self.release(time.monotonic() - started)
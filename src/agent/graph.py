@@ -1,5 +1,13 @@
 """Граф агента для классификации отзывов."""
 
+import logging
+import weakref
+from typing import Any
+
+import openai
+
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 
@@ -10,19 +18,142 @@ from .prompts import (
     CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
     CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
     MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
-
+    CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_PROMPT,
+    CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    SESSION_IDEAS_FOLLOW_UP_PROMPT,
+    SESSION_SENTIMENT_FOLLOW_UP_PROMPT,
 )
+from src.metrics import metrics
+from src.settings import settings
+
+from .schemas import categories_schema, ideas_schema, response_format, sentiments_schema
 from .state import ClassificationState
+from .tokens import record_usage
 from .utils import (
     format_reviews,
     format_reviews_with_categories,
     format_reviews_with_categories_and_sentiments,
+    get_llm_client,
     llm_client,
-    parse_review_categories,
+    stage_config,
+    parse_review_category_items,
     parse_review_sentiments,
+    parse_review_categories_and_sentiments,
     parse_ideas,
 )
 
+logger = logging.getLogger(__name__)
+
+# Клиенты, бэкенд которых отклонил response_format: дальше они вызываются без схемы
+_schema_rejected: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def _constrained(name: str, schema: dict[str, Any]) -> dict[str, Any]:
+    """Аргументы вызова LLM, ограничивающие ответ JSON-схемой (если включено)."""
+    if not settings.LLM_JSON_SCHEMA:
+        return {}
+    return {"response_format": response_format(name, schema)}
+
+
+def _llm(state: ClassificationState, stage: str) -> Any:
+    """Клиент LLM для этапа графа и уровня модели из состояния (см. utils.get_llm_client)."""
+    tier = state.get("llm_tier", "default")
+    if tier == "default" and stage_config(stage).is_default:
+        return llm_client
+    return get_llm_client(stage, tier)
+
+
+def output_token_budget(review_count: int, stage: str) -> int | None:
+    """Предел длины ответа для батча: с запасом от ожидаемого размера ответа.
+
+    Для этапа с рассуждениями предел от размера батча не применяется: токены
+    блока <think> тоже входят в max_tokens, и ответ обрывался бы посередине.
+    """
+    config = stage_config(stage)
+    budget = 0 if config.reasoning else int(
+        review_count * settings.OUTPUT_TOKENS_PER_REVIEW * settings.LLM_OUTPUT_MARGIN
+    )
+    stage_limit = config.max_tokens
+    budgets = [limit for limit in (budget, stage_limit) if limit > 0]
+    return min(budgets) if budgets else None
+
+
+async def _generate(
+    state: ClassificationState,
+    stage: str,
+    prompt: Any,
+    review_count: int,
+    usage_stage: str | None = None,
+    **kwargs: Any,
+) -> Any:
+    """Вызов LLM этапа: потоковый с остановкой на конце JSON (LLM_STREAMING) или обычный.
+
+    Токены промпта и ответа учитываются в метриках этапа usage_stage (по умолчанию stage).
+    """
+    llm = _llm(state, stage)
+    if settings.LLM_STREAMING:
+        max_tokens = output_token_budget(review_count, stage)
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+    call = llm.astream if settings.LLM_STREAMING else llm.ainvoke
+
+    if "response_format" in kwargs and llm in _schema_rejected:
+        kwargs.pop("response_format")
+    try:
+        response = await call(prompt, **kwargs)
+    except openai.BadRequestError as e:
+        if "response_format" not in kwargs:
+            raise
+        # Бэкенд без поддержки json_schema отвечает 400, который не повторяется ретраями
+        logger.warning(f"LLM backend rejected response_format, falling back to plain prompts: {e}")
+        metrics.inc("llm_json_schema_fallbacks")
+        _schema_rejected.add(llm)
+        kwargs.pop("response_format")
+        response = await call(prompt, **kwargs)
+    if settings.LLM_TOKEN_METRICS:
+        record_usage(usage_stage or stage, prompt, response)
+    return response
+
+
+def _in_session(state: ClassificationState) -> bool:
+    """Продолжает ли этап диалог предыдущего этапа (STAGE_SESSION)."""
+    return state.get("use_session", False) and bool(state.get("messages"))
+
+
+def _follow_up(
+    state: ClassificationState, template: ChatPromptTemplate, reviews: list[dict[str, Any]]
+) -> list[Any]:
+    """Диалог предыдущих этапов и короткое указание нового этапа по id отзывов."""
+    review_ids = ", ".join(f"ID={review.get('id', i)}" for i, review in enumerate(reviews, 1))
+    return [*state["messages"], *template.format_messages(review_ids=review_ids)]
+
+
+def _session_update(state: ClassificationState, prompt: list[Any], response: Any) -> ClassificationState:
+    """Сохранение диалога с ответом модели для следующего этапа."""
+    if not state.get("use_session", False):
+        return {}
+    return {"messages": [*prompt, AIMessage(content=response.content)]}
+
+
+def _match_answer(reviews: list[dict[str, Any]], answer_ids: list[Any]) -> list[tuple[int, int]]:
+    """Сопоставление элементов ответа модели с отзывами батча по review_id
+
+    Отзывы, для которых модель не вернула результат (обрезанный или частично
+    испорченный ответ), пропускаются: PredictionService отправит их повторно.
+    Элементы ответа с чужими id отбрасываются. Если ни один id в ответе не
+    совпал с id отзывов, но количество совпадает, сопоставление идет по порядку.
+
+    Returns:
+        Пары (индекс отзыва, индекс элемента ответа) в порядке отзывов
+    """
+    ids = [review.get("id", i) for i, review in enumerate(reviews, 1)]
+    positions = {review_id: j for j, review_id in enumerate(answer_ids)}
+    if set(positions) & set(ids):
+        return [(i, positions[review_id]) for i, review_id in enumerate(ids) if review_id in positions]
+    if len(answer_ids) == len(reviews):
+        return [(i, i) for i in range(len(reviews))]
+    raise ValueError(f"Model answer has {len(answer_ids)} reviews for a batch of {len(reviews)}")
+
 
 async def classify_category(state: ClassificationState) -> ClassificationState:
     """Классификация категорий для каждого отзыва
@@ -43,15 +174,26 @@ async def classify_category(state: ClassificationState) -> ClassificationState:
     else:
         prompt_template = CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT
 
-    prompt = prompt_template.format(
+    prompt = prompt_template.format_messages(
         reviews=formatted_reviews,
         available_categories=formatted_available_categories,
     )
 
-    response = await llm_client.ainvoke(prompt)
-    categories = parse_review_categories(response)
+    response = await _generate(
+        state,
+        "category",
+        prompt,
+        len(reviews),
+        **_constrained("review_categories", categories_schema(reviews, available_categories)),
+    )
+    items = parse_review_category_items(response, available_categories)
+    matched = _match_answer(reviews, [review_id for review_id, _ in items])
 
-    return {"categories": categories}
+    return {
+        "reviews": [reviews[i] for i, _ in matched],
+        "categories": [items[j][1] for _, j in matched],
+        **_session_update(state, prompt, response),
+    }
 
 
 async def classify_sentiments(state: ClassificationState) -> ClassificationState:
@@ -65,66 +207,196 @@ async def classify_sentiments(state: ClassificationState) -> ClassificationState
     """
     reviews = state["reviews"]
     categories = state["categories"]
-    reviews_with_categories = format_reviews_with_categories(reviews, categories)
+
+    if _in_session(state):
+        # Отзывы и категории уже есть в диалоге, повторно передаются только id
+        prompt = _follow_up(state, SESSION_SENTIMENT_FOLLOW_UP_PROMPT, reviews)
+    else:
+        if state.get("use_few_shot", False):
+            prompt_template = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        else:
+            prompt_template = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT
+        reviews_with_categories = format_reviews_with_categories(reviews, categories)
+        prompt = prompt_template.format_messages(reviews_with_categories=reviews_with_categories)
+
+    batch_categories = list(dict.fromkeys(cat for cats in categories for cat in cats))
+    response = await _generate(
+        state,
+        "sentiment",
+        prompt,
+        len(reviews),
+        **_constrained("review_sentiments", sentiments_schema(reviews, batch_categories)),
+    )
+    sentiments = parse_review_sentiments(response)
+    matched = _match_answer(reviews, [item["id"] for item in sentiments])
+
+    return {
+        "reviews": [reviews[i] for i, _ in matched],
+        "categories": [categories[i] for i, _ in matched],
+        # id из отзыва: при сопоставлении по порядку id в ответе модели могут быть чужими
+        "sentiments": [{**sentiments[j], "id": reviews[i].get("id")} for i, j in matched],
+        **_session_update(state, prompt, response),
+    }
+
+
+async def classify_category_and_sentiments(state: ClassificationState) -> ClassificationState:
+    """Классификация категорий и тональностей одним вызовом LLM
+
+    Args:
+        state (ClassificationState): Состояние агента
+
+    Returns:
+        ClassificationState: Обновленное состояние с категориями и тональностями
+    """
+    reviews = state["reviews"]
+    formatted_reviews = format_reviews(reviews)
+    formatted_available_categories = ", ".join(state["available_categories"])
 
     if state.get("use_few_shot", False):
-        prompt_template = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        prompt_template = CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
     else:
-        prompt_template = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT
+        prompt_template = CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_PROMPT
 
-    prompt = prompt_template.format(reviews_with_categories=reviews_with_categories)
+    prompt = prompt_template.format_messages(
+        reviews=formatted_reviews,
+        available_categories=formatted_available_categories,
+    )
 
-    response = await llm_client.ainvoke(prompt)
-    sentiments = parse_review_sentiments(response)
+    response = await _generate(
+        state,
+        "category",
+        prompt,
+        len(reviews),
+        usage_stage="category_and_sentiments",
+        **_constrained(
+            "review_categories_and_sentiments",
+            sentiments_schema(reviews, state["available_categories"]),
+        ),
+    )
+    categories, sentiments = parse_review_categories_and_sentiments(response, state["available_categories"])
+    matched = _match_answer(reviews, [item["id"] for item in sentiments])
+
+    return {
+        "reviews": [reviews[i] for i, _ in matched],
+        "categories": [categories[j] for _, j in matched],
+        # id из отзыва: при сопоставлении по порядку id в ответе модели могут быть чужими
+        "sentiments": [{**sentiments[j], "id": reviews[i].get("id")} for i, j in matched],
+        **_session_update(state, prompt, response),
+    }
+
+
+def _is_positive_only(sentiments: dict[str, str]) -> bool:
+    return bool(sentiments) and all(s == "положительно" for s in sentiments.values())
+
+
+def select_actionable_reviews(
+    state: ClassificationState,
+) -> tuple[list[dict[str, Any]], list[list[str]], list[dict[str, Any]]]:
+    """Отбор отзывов для этапа идей: исключаются отзывы только с положительной тональностью
+
+    Args:
+        state (ClassificationState): Состояние агента
 
-    return {"sentiments": sentiments}
+    Returns:
+        Отзывы, их категории и тональности без положительных отзывов
+    """
+    selected = [
+        (review, cats, sents)
+        for review, cats, sents in zip(
+            state["reviews"], state["categories"], state["sentiments"], strict=True
+        )
+        if not _is_positive_only(sents.get("sentiments", {}))
+    ]
+    if not selected:
+        return [], [], []
+    reviews, categories, sentiments = map(list, zip(*selected))
+    return reviews, categories, sentiments
+
+
+def route_ideas(state: ClassificationState) -> str:
+    """Пропуск этапа идей, если в батче нет отзывов с негативом или нейтральной тональностью."""
+    if state.get("skip_ideas", False):
+        return END
+    reviews, _, _ = select_actionable_reviews(state)
+    if reviews:
+        return "extract_ideas"
+    metrics.inc("ideas_calls_skipped")
+    return END
 
 
 async def extract_ideas(state: ClassificationState) -> ClassificationState:
     """Извлечение идей по улучшению сервисов
 
+    Отзывы только с положительной тональностью в промпт не передаются.
+    В режиме общего диалога (use_session) отзывы не повторяются: диалог
+    предыдущих этапов продолжается указанием с id отобранных отзывов.
+
     Args:
         state (ClassificationState): Состояние агента
 
     Returns:
         ClassificationState: Обновленное состояние с идеями
     """
-    reviews = state["reviews"]
-    categories = state["categories"]
-    sentiments = state["sentiments"]
-    
-    # sentiments is list[dict] with 'id' and 'sentiments' keys
-    # We need to extract just the sentiments dict for formatting
-    formatted_sentiments = [s.get("sentiments", {}) for s in sentiments]
-    
-    reviews_with_cats_sents = format_reviews_with_categories_and_sentiments(
-        reviews, categories, formatted_sentiments
-    )
+    reviews, categories, sentiments = select_actionable_reviews(state)
+    metrics.inc("ideas_calls_total")
+    metrics.inc("ideas_reviews_filtered", len(state["reviews"]) - len(reviews))
 
-    if state.get("use_few_shot", False):
-        prompt_template = MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+    if _in_session(state):
+        prompt = _follow_up(state, SESSION_IDEAS_FOLLOW_UP_PROMPT, reviews)
     else:
-        prompt_template = MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT
-
-    prompt = prompt_template.format(
-        reviews_with_categories_and_sentiments=reviews_with_cats_sents
+        # sentiments is list[dict] with 'id' and 'sentiments' keys
+        # We need to extract just the sentiments dict for formatting
+        formatted_sentiments = [s.get("sentiments", {}) for s in sentiments]
+
+        reviews_with_cats_sents = format_reviews_with_categories_and_sentiments(
+            reviews, categories, formatted_sentiments
+        )
+
+        if state.get("use_few_shot", False):
+            prompt_template = MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        else:
+            prompt_template = MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT
+
+        prompt = prompt_template.format_messages(
+            reviews_with_categories_and_sentiments=reviews_with_cats_sents
+        )
+
+    response = await _generate(
+        state,
+        "ideas",
+        prompt,
+        len(reviews),
+        **_constrained("ideas", ideas_schema(reviews, state["available_categories"])),
     )
-
-    response = await llm_client.ainvoke(prompt)
     ideas = parse_ideas(response)
 
     return {"ideas": ideas}
 
 
+def route_classification(state: ClassificationState) -> str:
+    """Выбор топологии: раздельные этапы категорий и тональностей или объединенный."""
+    if state.get("use_fused_stage", False):
+        return "classify_category_and_sentiments"
+    return "classify_category"
+
+
 workflow = StateGraph(ClassificationState)
 
 workflow.add_node("classify_category", classify_category)
 workflow.add_node("classify_sentiments", classify_sentiments)
+workflow.add_node("classify_category_and_sentiments", classify_category_and_sentiments)
 workflow.add_node("extract_ideas", extract_ideas)
 
-workflow.add_edge(START, "classify_category")
+workflow.add_conditional_edges(
+    START,
+    route_classification,
+    ["classify_category", "classify_category_and_sentiments"],
+)
 workflow.add_edge("classify_category", "classify_sentiments")
-workflow.add_edge("classify_sentiments", "extract_ideas")
+workflow.add_conditional_edges(
+    "classify_category_and_sentiments", route_ideas, ["extract_ideas", END]
+)
+workflow.add_conditional_edges("classify_sentiments", route_ideas, ["extract_ideas", END])
 workflow.add_edge("extract_ideas", END)
 
 classification_agent: CompiledStateGraph = workflow.compile()
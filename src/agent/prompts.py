@@ -1,23 +1,58 @@
-CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT = """
-Ты — эксперт по анализу отзывов горожан на городские цифровые сервисы.
+"""Промпты агента.
+
+Каждый промпт состоит из двух сообщений:
+- системного — неизменяемые инструкции, примеры и формат ответа. Его текст
+  побайтно одинаков во всех вызовах этапа, поэтому llama.cpp может
+  переиспользовать закэшированный префикс (cache_prompt) и не вычислять его заново;
+- пользовательского — переменная часть: список категорий и отзывы батча.
+
+В режиме общего диалога (STAGE_SESSION) этапы тональностей и идей не
+повторяют отзывы, а продолжают диалог первого этапа коротким указанием
+(SESSION_*_FOLLOW_UP_PROMPT).
+"""
+
+from langchain_core.prompts import ChatPromptTemplate
 
-Твоя задача: классифицировать отзывы горожан по категориям предоставляемых государством услуг.
 
+# Переменные части промптов (сообщение пользователя)
+
+REVIEWS_USER_PROMPT = """
 Доступные категории услуг:
 {available_categories}
 
+Отзывы для анализа:
+<reviews>
+{reviews}
+</reviews>
+"""
+
+REVIEWS_WITH_CATEGORIES_USER_PROMPT = """
+Отзывы с уже определенными категориями:
+<reviews_with_categories>
+{reviews_with_categories}
+</reviews_with_categories>
+"""
+
+REVIEWS_WITH_CATEGORIES_AND_SENTIMENTS_USER_PROMPT = """
+Отзывы с категориями и эмоциями:
+<reviews_with_categories_and_sentiments>
+{reviews_with_categories_and_sentiments}
+</reviews_with_categories_and_sentiments>
+"""
+
+
+CLASSIFY_CATEGORY_SYSTEM_PROMPT = """
+Ты — эксперт по анализу отзывов горожан на городские цифровые сервисы.
+
+Твоя задача: классифицировать отзывы горожан по категориям предоставляемых государством услуг.
+
 Правила:
 1. **Атомарность классификации**: Определяй категории для каждого отзыва отдельно, не смешивая контекст.
 2. **Множественная классификация**: Если отзыв касается нескольких услуг, укажи все релевантные категории.
-3. **Строгий словарь**: Используй только категории из списка выше. Выдумывать свои категории запрещено.
+3. **Строгий словарь**: Используй только категории из списка доступных категорий в сообщении пользователя. Выдумывать свои категории запрещено.
 4. **Обработка исключений**: Если отзыв не подходит ни под одну категорию — используй категорию "Прочее".
 5. **Формат ответа**: Ответ должен быть строго в формате JSON без дополнительных комментариев.
 
-Отзывы для анализа:
-<reviews>
-{reviews}
-</reviews>
-
 Верни результат в формате JSON:
 {{
   "reviews": [
@@ -33,7 +68,12 @@ CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT = """
 }}
 """
 
-CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT = """
+CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_CATEGORY_SYSTEM_PROMPT), ("human", REVIEWS_USER_PROMPT)]
+)
+
+
+CLASSIFY_SENTIMENT_SYSTEM_PROMPT = """
 Ты — эксперт по анализу тональности отзывов горожан на городские цифровые сервисы.
 
 Твоя задача: определить тональность отзывов для каждой категории продукта/услуги отдельно.
@@ -56,11 +96,6 @@ CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT = """
 4. **Строгий словарь**: Используй только тональности из списка выше.
 5. **Формат ответа**: Ответ должен быть строго в формате JSON без дополнительных комментариев.
 
-Отзывы с уже определенными категориями:
-<reviews_with_categories>
-{reviews_with_categories}
-</reviews_with_categories>
-
 Верни результат в формате JSON:
 {{
   "reviews": [
@@ -87,7 +122,12 @@ CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT = """
 }}
 """
 
-MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT = """
+CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_SENTIMENT_SYSTEM_PROMPT), ("human", REVIEWS_WITH_CATEGORIES_USER_PROMPT)]
+)
+
+
+MAKE_IDEAS_SYSTEM_PROMPT = """
 Ты — эксперт по анализу отзывов горожан на городские сервисы.
 
 Твоя задача: на основе отзывов горожан сформулировать список конкретных действий (Technical Tasks) для улучшения сервисов и связать каждую идею с конкретными отзывами (ID), из которых она была взята.
@@ -104,11 +144,6 @@ MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT = """
 5. **Формат идей**: Каждая идея — это объект, содержащий само предложение (`description`) и список ID исходных отзывов (`source_ids`).
 6. **Ответ**: Строго в формате JSON.
 
-Отзывы с категориями и эмоциями:
-<reviews_with_categories_and_sentiments>
-{reviews_with_categories_and_sentiments}
-</reviews_with_categories_and_sentiments>
-
 Верни результат в формате JSON:
 {{
   "ideas_by_category": [
@@ -127,20 +162,23 @@ MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT = """
 }}
 """
 
+MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", MAKE_IDEAS_SYSTEM_PROMPT), ("human", REVIEWS_WITH_CATEGORIES_AND_SENTIMENTS_USER_PROMPT)]
+)
+
+
 # Few-shot variants
 
-CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
+
+CLASSIFY_CATEGORY_FEW_SHOT_SYSTEM_PROMPT = """
 Ты — эксперт по анализу отзывов горожан на городские цифровые сервисы.
 
 Твоя задача: классифицировать отзывы горожан по категориям предоставляемых государством услуг.
 
-Доступные категории услуг:
-{available_categories}
-
 Правила:
 1. **Атомарность классификации**: Определяй категории для каждого отзыва отдельно, не смешивая контекст.
 2. **Множественная классификация**: Если отзыв касается нескольких услуг, укажи все релевантные категории.
-3. **Строгий словарь**: Используй только категории из списка выше. Выдумывать свои категории запрещено.
+3. **Строгий словарь**: Используй только категории из списка доступных категорий в сообщении пользователя. Выдумывать свои категории запрещено.
 4. **Обработка исключений**: Если отзыв не подходит ни под одну категорию — используй категорию "Прочее".
 5. **Формат ответа**: Ответ должен быть строго в формате JSON без дополнительных комментариев.
 
@@ -156,11 +194,6 @@ CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
 Категории: ["Прочее"]
 </examples>
 
-Отзывы для анализа:
-<reviews>
-{reviews}
-</reviews>
-
 Верни результат в формате JSON:
 {{
   "reviews": [
@@ -172,7 +205,12 @@ CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
 }}
 """
 
-CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
+CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_CATEGORY_FEW_SHOT_SYSTEM_PROMPT), ("human", REVIEWS_USER_PROMPT)]
+)
+
+
+CLASSIFY_SENTIMENT_FEW_SHOT_SYSTEM_PROMPT = """
 Ты — эксперт по анализу тональности отзывов горожан на городские цифровые сервисы.
 
 Твоя задача: определить тональность отзывов для каждой категории продукта/услуги отдельно.
@@ -217,11 +255,6 @@ Overall: положительно
 Overall: нейтрально
 </examples>
 
-Отзывы с уже определенными категориями:
-<reviews_with_categories>
-{reviews_with_categories}
-</reviews_with_categories>
-
 Верни результат в формате JSON:
 {{
   "reviews": [
@@ -237,7 +270,12 @@ Overall: нейтрально
 }}
 """
 
-MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
+CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_SENTIMENT_FEW_SHOT_SYSTEM_PROMPT), ("human", REVIEWS_WITH_CATEGORIES_USER_PROMPT)]
+)
+
+
+MAKE_IDEAS_FEW_SHOT_SYSTEM_PROMPT = """
 Ты — эксперт по анализу отзывов горожан на городские сервисы.
 
 Твоя задача: на основе отзывов горожан сформулировать список конкретных действий (Technical Tasks) для улучшения сервисов и связать каждую идею с конкретными отзывами (ID), из которых она была взята.
@@ -272,11 +310,6 @@ MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
 - Источники: [4]
 </examples>
 
-Отзывы с категориями и эмоциями:
-<reviews_with_categories_and_sentiments>
-{reviews_with_categories_and_sentiments}
-</reviews_with_categories_and_sentiments>
-
 Верни результат в формате JSON:
 {{
   "ideas_by_category": [
@@ -292,3 +325,167 @@ MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = """
   ]
 }}
 """
+
+MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", MAKE_IDEAS_FEW_SHOT_SYSTEM_PROMPT), ("human", REVIEWS_WITH_CATEGORIES_AND_SENTIMENTS_USER_PROMPT)]
+)
+
+
+# Fused category + sentiment variants (one LLM call instead of two)
+
+
+CLASSIFY_CATEGORY_AND_SENTIMENT_SYSTEM_PROMPT = """
+Ты — эксперт по анализу отзывов горожан на городские цифровые сервисы.
+
+Твоя задача: для каждого отзыва определить категории предоставляемых государством услуг и тональность отзыва по каждой из этих категорий.
+
+Доступные тональности:
+- положительно — клиент доволен, хвалит, выражает благодарность, рекомендует
+- нейтрально — объективное описание без ярко выраженных эмоций, констатация фактов
+- отрицательно — клиент недоволен, жалуется, критикует, выражает разочарование
+
+Правила:
+1. **Изоляция отзывов**: Анализируй каждый отзыв отдельно, независимо от других.
+2. **Множественная классификация**: Если отзыв касается нескольких услуг, укажи все релевантные категории.
+3. **Строгий словарь категорий**: Используй только категории из списка доступных категорий в сообщении пользователя. Если отзыв не подходит ни под одну категорию — используй категорию "Прочее".
+4. **Детализация по категориям**: Для каждой указанной категории определи тональность отдельно. Один отзыв может содержать разную тональность для разных категорий.
+5. **Общая тональность (Overall)**: Оцени общее впечатление от отзыва. Не используй среднее арифметическое: учитывай, чему пользователь уделил больше текста, и насколько критична проблема.
+6. **Строгий словарь тональностей**: Используй только тональности из списка выше.
+7. **Формат ответа**: Ответ должен быть строго в формате JSON без дополнительных комментариев.
+
+Верни результат в формате JSON, где ключи объекта "sentiments" — категории отзыва:
+{{
+  "reviews": [
+    {{
+      "review_id": 1,
+      "sentiments": {{
+        "категория1": "сентимент1",
+        "категория2": "сентимент2"
+      }},
+      "overall": "общий сентимент по отзыву"
+    }}
+  ]
+}}
+"""
+
+CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_CATEGORY_AND_SENTIMENT_SYSTEM_PROMPT), ("human", REVIEWS_USER_PROMPT)]
+)
+
+
+CLASSIFY_CATEGORY_AND_SENTIMENT_FEW_SHOT_SYSTEM_PROMPT = """
+Ты — эксперт по анализу отзывов горожан на городские цифровые сервисы.
+
+Твоя задача: для каждого отзыва определить категории предоставляемых государством услуг и тональность отзыва по каждой из этих категорий.
+
+Доступные тональности:
+- положительно — клиент доволен, хвалит, выражает благодарность, рекомендует
+- нейтрально — объективное описание без ярко выраженных эмоций, констатация фактов
+- отрицательно — клиент недоволен, жалуется, критикует, выражает разочарование
+
+Правила:
+1. **Изоляция отзывов**: Анализируй каждый отзыв отдельно, независимо от других.
+2. **Множественная классификация**: Если отзыв касается нескольких услуг, укажи все релевантные категории.
+3. **Строгий словарь категорий**: Используй только категории из списка доступных категорий в сообщении пользователя. Если отзыв не подходит ни под одну категорию — используй категорию "Прочее".
+4. **Детализация по категориям**: Для каждой указанной категории определи тональность отдельно. Один отзыв может содержать разную тональность для разных категорий.
+5. **Общая тональность (Overall)**: Оцени общее впечатление от отзыва. Не используй среднее арифметическое: учитывай, чему пользователь уделил больше текста, и насколько критична проблема.
+6. **Строгий словарь тональностей**: Используй только тональности из списка выше.
+7. **Формат ответа**: Ответ должен быть строго в формате JSON без дополнительных комментариев.
+
+Примеры:
+<examples>
+Отзыв: "Через госуслуги записался быстро, но в поликлинике врачи хамят."
+Категории и тональность:
+- МФЦ/Госуслуги: положительно
+- Здравоохранение: отрицательно
+Overall: отрицательно (хамство врачей критичнее удобства записи)
+
+Отзыв: "Автобус пришел вовремя, в салоне чисто."
+Категории и тональность:
+- Транспорт: положительно
+Overall: положительно
+
+Отзыв: "Очень вкусный кофе в кафе рядом с метро."
+Категории и тональность:
+- Прочее: положительно
+Overall: положительно
+</examples>
+
+Верни результат в формате JSON, где ключи объекта "sentiments" — категории отзыва:
+{{
+  "reviews": [
+    {{
+      "review_id": 1,
+      "sentiments": {{
+        "категория1": "сентимент1",
+        "категория2": "сентимент2"
+      }},
+      "overall": "общий сентимент"
+    }}
+  ]
+}}
+"""
+
+CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT = ChatPromptTemplate.from_messages(
+    [("system", CLASSIFY_CATEGORY_AND_SENTIMENT_FEW_SHOT_SYSTEM_PROMPT), ("human", REVIEWS_USER_PROMPT)]
+)
+
+
+# Продолжение общего диалога этапов (STAGE_SESSION): отзывы уже переданы в первом
+# сообщении, следующие этапы добавляют только короткое указание
+
+
+SESSION_SENTIMENT_FOLLOW_UP_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "human",
+            """
+Теперь определи тональность отзывов {review_ids} для каждой категории, которую ты им назначил.
+
+Доступные тональности: положительно, нейтрально, отрицательно.
+Оцени каждый отзыв отдельно и добавь общую тональность (overall): учитывай, чему автор уделил больше
+внимания и что мешает получить услугу, а не количество плюсов и минусов.
+
+Верни результат строго в формате JSON без комментариев:
+{{
+  "reviews": [
+    {{
+      "review_id": 1,
+      "sentiments": {{"категория1": "сентимент1"}},
+      "overall": "общий сентимент по отзыву"
+    }}
+  ]
+}}
+""",
+        )
+    ]
+)
+
+
+SESSION_IDEAS_FOLLOW_UP_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "human",
+            """
+Теперь на основе отзывов {review_ids} с определенными выше категориями и тональностями сформулируй
+конкретные задачи по улучшению сервисов.
+
+Каждая задача должна прямо подтверждаться текстом отзывов и быть сформулирована в повелительном наклонении.
+Одинаковые проблемы из разных отзывов объединяй в одну задачу со всеми ID источников.
+Не создавай задач из положительных отзывов без конструктивных предложений.
+
+Верни результат строго в формате JSON без комментариев:
+{{
+  "ideas_by_category": [
+    {{
+      "category": "Название категории",
+      "items": [
+        {{"description": "Текст задачи по улучшению", "source_ids": [1, 2]}}
+      ]
+    }}
+  ]
+}}
+""",
+        )
+    ]
+)
@@ -0,0 +1,149 @@
+"""Ограничение частоты обращений к LLM на стороне клиента.
+
+Общий для всех экземпляров LLM лимитер держит вызовы, пока не освободится
+бюджет запросов и токенов в минуту (token bucket), и приостанавливает все
+вызовы на время, указанное сервером в Retry-After после ответа 429. Здесь же —
+классификация ошибок: повторяются только временные (сеть, таймаут, 429, 5xx),
+ошибки разбора ответа и 4xx не повторяются.
+"""
+
+import asyncio
+import email.utils
+import logging
+import time
+from typing import Optional
+
+import httpx
+import openai
+
+from src.metrics import metrics
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Бюджет в единицах за минуту, пополняемый равномерно (0 — без ограничения)."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self._updated_at) * self.capacity / 60
+        )
+        self._updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в бюджете появится amount единиц."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Лимитер запросов и токенов в минуту с общей паузой по Retry-After."""
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0) -> None:
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Ожидание свободного бюджета для вызова с оценкой tokens токенов."""
+        waited = 0.0
+        while True:
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens),
+            )
+            if delay <= 0:
+                # Между проверкой и списанием нет await, поэтому списание атомарно
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+                break
+            waited += delay
+            await asyncio.sleep(delay)
+        if waited:
+            metrics.inc("rate_limit_wait_seconds", waited)
+
+    def adjust(self, tokens: int) -> None:
+        """Поправка бюджета токенов на разницу между оценкой и фактическим расходом."""
+        if tokens > 0:
+            self.tokens.consume(tokens)
+        elif tokens < 0:
+            self.tokens.available = min(self.tokens.capacity, self.tokens.available - tokens)
+
+    def pause(self, seconds: float) -> None:
+        """Приостановка всех вызовов на seconds секунд."""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            metrics.inc("rate_limit_pauses")
+            logger.warning(f"LLM calls paused for {seconds:.1f}s by server rate limit")
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Общий лимитер для всех экземпляров LLM."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(settings.LLM_REQUESTS_PER_MINUTE, settings.LLM_TOKENS_PER_MINUTE)
+    return _rate_limiter
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Задержка из заголовков ответа 429 (Retry-After, retry-after-ms, X-RateLimit-Reset)."""
+    response = getattr(error, "response", None)
+    if not isinstance(response, httpx.Response) or response.status_code != 429:
+        return None
+    headers = response.headers
+
+    if "retry-after-ms" in headers:
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if "x-ratelimit-reset" in headers:
+        # OpenRouter: время сброса лимита в миллисекундах от эпохи
+        try:
+            return max(0.0, float(headers["x-ratelimit-reset"]) / 1000 - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Стоит ли повторять вызов после этой ошибки."""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in _TRANSIENT_STATUS_CODES
+    return False
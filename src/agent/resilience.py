@@ -0,0 +1,99 @@
+"""Политики против медленных и упавших бэкендов LLM.
+
+- CircuitBreaker: после failure_threshold временных ошибок подряд бэкенд
+  считается упавшим, и вызовы к нему сразу завершаются CircuitOpenError
+  (без ретраев). Через reset_seconds пропускается один пробный вызов:
+  успех закрывает цепь, ошибка снова открывает ее.
+- LatencyTracker: скользящее окно длительностей успешных вызовов, по
+  перцентилю которого LLM решает, когда отправить дублирующий (hedged) вызов.
+"""
+
+import math
+import time
+from collections import deque
+from typing import Optional
+
+from src.metrics import metrics
+from src.settings import settings
+
+
+class CircuitOpenError(RuntimeError):
+    """Все доступные бэкенды LLM временно отключены автоматом."""
+
+
+class CircuitBreaker:
+    """Автомат отключения бэкенда (0 в failure_threshold — выключен)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        reset_seconds: Optional[float] = None,
+    ) -> None:
+        self.failure_threshold = (
+            settings.LLM_BREAKER_FAILURES if failure_threshold is None else failure_threshold
+        )
+        self.reset_seconds = (
+            settings.LLM_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        )
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def is_available(self) -> bool:
+        """Можно ли отправить вызов на бэкенд."""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._trial_in_flight)
+
+    def on_dispatch(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_in_flight:
+                metrics.inc("llm_circuit_opened")
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release(self) -> None:
+        """Вызов отменен без результата (например, проигравший hedged-вызов)."""
+        self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей вызовов."""
+
+    def __init__(self, window: int = 200, min_samples: Optional[int] = None) -> None:
+        self._samples: deque = deque(maxlen=window)
+        self.min_samples = settings.LLM_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Перцентиль p (0-100) или None, пока данных недостаточно."""
+        if not self._samples or len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
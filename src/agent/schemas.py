@@ -0,0 +1,125 @@
+"""JSON-схемы ответов модели для ограниченного декодирования.
+
+Схема передается бэкенду в параметре response_format (json_schema). llama.cpp
+превращает ее в грамматику и не дает модели выйти за ее пределы, поэтому ответ
+всегда разбирается парсерами из utils.py: категории берутся только из списка
+доступных, тональности — из SENTIMENTS, review_id и source_ids — из id отзывов батча.
+"""
+
+from typing import Any
+
+SENTIMENTS = ["положительно", "нейтрально", "отрицательно"]
+
+
+def _review_id_schema(reviews: list[dict[str, Any]]) -> dict[str, Any]:
+    ids = [review.get("id", i) for i, review in enumerate(reviews, 1)]
+    if ids and all(isinstance(review_id, int) for review_id in ids):
+        return {"type": "integer", "enum": ids}
+    return {"type": "integer"}
+
+
+def _reviews_array(reviews: list[dict[str, Any]], item: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "reviews": {
+                "type": "array",
+                "items": item,
+                "minItems": len(reviews),
+                "maxItems": len(reviews),
+            }
+        },
+        "required": ["reviews"],
+        "additionalProperties": False,
+    }
+
+
+def _sentiments_object(categories: list[str]) -> dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {category: {"type": "string", "enum": SENTIMENTS} for category in categories},
+        "minProperties": 1,
+        "additionalProperties": False,
+    }
+
+
+def categories_schema(reviews: list[dict[str, Any]], available_categories: list[str]) -> dict[str, Any]:
+    """Схема ответа этапа классификации категорий."""
+    return _reviews_array(
+        reviews,
+        {
+            "type": "object",
+            "properties": {
+                "review_id": _review_id_schema(reviews),
+                "categories": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": list(available_categories)},
+                    "minItems": 1,
+                },
+            },
+            "required": ["review_id", "categories"],
+            "additionalProperties": False,
+        },
+    )
+
+
+def sentiments_schema(reviews: list[dict[str, Any]], categories: list[str]) -> dict[str, Any]:
+    """Схема ответа этапа тональностей (и объединенного этапа).
+
+    Args:
+        reviews: Отзывы батча
+        categories: Допустимые ключи объекта sentiments
+    """
+    return _reviews_array(
+        reviews,
+        {
+            "type": "object",
+            "properties": {
+                "review_id": _review_id_schema(reviews),
+                "sentiments": _sentiments_object(categories),
+                "overall": {"type": "string", "enum": SENTIMENTS},
+            },
+            "required": ["review_id", "sentiments", "overall"],
+            "additionalProperties": False,
+        },
+    )
+
+
+def ideas_schema(reviews: list[dict[str, Any]], available_categories: list[str]) -> dict[str, Any]:
+    """Схема ответа этапа идей."""
+    source_id = _review_id_schema(reviews)
+    return {
+        "type": "object",
+        "properties": {
+            "ideas_by_category": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "category": {"type": "string", "enum": list(available_categories)},
+                        "items": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "description": {"type": "string"},
+                                    "source_ids": {"type": "array", "items": source_id, "minItems": 1},
+                                },
+                                "required": ["description", "source_ids"],
+                                "additionalProperties": False,
+                            },
+                        },
+                    },
+                    "required": ["category", "items"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["ideas_by_category"],
+        "additionalProperties": False,
+    }
+
+
+def response_format(name: str, schema: dict[str, Any]) -> dict[str, Any]:
+    """Параметр response_format OpenAI-совместимого API для схемы."""
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
@@ -1,5 +1,7 @@
 from typing import TypedDict, Any
 
+from langchain_core.messages import BaseMessage
+
 
 class ClassificationState(TypedDict):
     """Состояние агента для классификации отзывов"""
@@ -8,4 +10,12 @@ class ClassificationState(TypedDict):
     categories: list[list[str]]
     sentiments: list[dict[str, str]]
     ideas: list[dict[str, Any]]
-    use_few_shot: bool
\ No newline at end of file
+    use_few_shot: bool
+    use_fused_stage: bool
+    # Уровень модели для вызовов LLM (см. utils.get_llm_client), по умолчанию "default"
+    llm_tier: str
+    # Не выполнять этап идей (проверочный прогон каскада)
+    skip_ideas: bool
+    # Этапы продолжают один диалог с моделью: отзывы передаются только в первом сообщении
+    use_session: bool
+    messages: list[BaseMessage]
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""Потоковая генерация с остановкой сразу после закрытия JSON-ответа.
+
+Модели вроде Qwen3 пишут перед ответом рассуждения в блоке <think>...</think>
+и нередко продолжают генерацию после закрывающей скобки JSON. При потоковом
+чтении ответ разбирается по мере поступления (JsonStreamScanner), и как только
+закрыт JSON-объект верхнего уровня, поток закрывается: сервер (llama.cpp)
+видит разрыв соединения и прекращает генерацию, поэтому лишние токены не
+декодируются.
+"""
+
+import logging
+from typing import Any
+
+from langchain_core.messages import AIMessage
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+class JsonStreamScanner:
+    """Инкрементальный поиск конца JSON-объекта верхнего уровня в потоке текста.
+
+    Блоки <think>...</think> и текст перед первой "{" в результат не попадают.
+    Скобки внутри строк JSON (с учетом экранирования) не учитываются.
+    """
+
+    def __init__(self) -> None:
+        self.done = False
+        self._buffer = ""
+        self._parts: list[str] = []
+        self._preamble: list[str] = []
+        self._in_think = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def text(self) -> str:
+        """JSON-объект (или его начало, если поток оборвался), иначе текст вне блоков <think>."""
+        if self._started:
+            return "".join(self._parts)
+        return "".join(self._preamble) + self._buffer
+
+    def feed(self, chunk: str) -> bool:
+        """Добавление фрагмента ответа; True, когда JSON-объект закрыт."""
+        if self.done:
+            return True
+        self._buffer += chunk
+        while True:
+            if self._in_think:
+                end = self._buffer.find(_THINK_CLOSE)
+                if end == -1:
+                    # Хвост может оказаться началом закрывающего тега
+                    self._buffer = self._buffer[-(len(_THINK_CLOSE) - 1):]
+                    return False
+                self._buffer = self._buffer[end + len(_THINK_CLOSE):]
+                self._in_think = False
+                continue
+            if not self._started:
+                think = self._buffer.find(_THINK_OPEN)
+                brace = self._buffer.find("{")
+                if think != -1 and (brace == -1 or think < brace):
+                    self._preamble.append(self._buffer[:think])
+                    self._buffer = self._buffer[think + len(_THINK_OPEN):]
+                    self._in_think = True
+                    continue
+                if brace == -1:
+                    tag_start = self._buffer.rfind("<")
+                    if tag_start != -1 and _THINK_OPEN.startswith(self._buffer[tag_start:]):
+                        self._preamble.append(self._buffer[:tag_start])
+                        self._buffer = self._buffer[tag_start:]
+                    else:
+                        self._preamble.append(self._buffer)
+                        self._buffer = ""
+                    return False
+                self._buffer = self._buffer[brace:]
+                self._started = True
+            return self._scan()
+
+    def _scan(self) -> bool:
+        for i, char in enumerate(self._buffer):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(self._buffer[: i + 1])
+                    self._buffer = ""
+                    self.done = True
+                    return True
+        self._parts.append(self._buffer)
+        self._buffer = ""
+        return False
+
+
+def _chunk_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    # Содержимое из частей: [{"type": "text", "text": ...}]
+    return "".join(
+        part.get("text", "") if isinstance(part, dict) else str(part) for part in content or []
+    )
+
+
+async def stream_until_json(client: Any, *args: Any, **kwargs: Any) -> AIMessage:
+    """Потоковый вызов модели, прерываемый сразу после закрытия JSON-ответа.
+
+    usage сервер присылает последним чанком, уже после текста. Поэтому после
+    закрытия JSON поток читается дальше, пока приходят пустые чанки (конец
+    генерации и usage), и закрывается на первом же тексте после JSON.
+    """
+    scanner = JsonStreamScanner()
+    usage = None
+    chunks = client.astream(*args, **kwargs)
+    try:
+        async for chunk in chunks:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            text = _chunk_text(chunk.content)
+            if scanner.done:
+                if text.strip():
+                    # Модель продолжает писать после JSON: генерация прерывается
+                    metrics.inc("llm_stream_early_stops")
+                    break
+                continue
+            scanner.feed(text)
+    finally:
+        # Закрытие генератора закрывает HTTP-ответ, и сервер прекращает генерацию
+        await chunks.aclose()
+    return AIMessage(content=scanner.text, usage_metadata=usage)
@@ -0,0 +1,80 @@
+"""Учет токенов промптов и ответов по этапам графа.
+
+Число токенов берется из usage ответа сервера (llama.cpp и OpenRouter его
+возвращают), а если его нет — считается токенизатором tiktoken
+(settings.TOKENIZER_ENCODING). Токенизатор модели может отличаться, поэтому
+подсчет приближенный, но одинаковый для сравнения вариантов промпта.
+Кодировка загружается один раз при старте приложения (load_tokenizer, вне
+event loop: при первом обращении tiktoken скачивает файл кодировки). Пока
+она не загружена или недоступна, используется оценка по числу символов
+(estimate_tokens).
+
+Метрики (только при settings.LLM_TOKEN_METRICS): llm_prompt_tokens_<этап>,
+llm_completion_tokens_<этап>, llm_calls_<этап>.
+"""
+
+import asyncio
+import logging
+from typing import Any, Optional
+
+from src.metrics import metrics
+from src.settings import settings
+
+from .utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+_encoding: Optional[Any] = None
+
+
+def _load_encoding(name: str) -> Optional[Any]:
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, token counts are estimated by length")
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # Файл кодировки загружается из сети при первом обращении
+        logger.warning(f"Failed to load tokenizer {name}, token counts are estimated by length: {e}")
+        return None
+
+
+async def load_tokenizer() -> bool:
+    """Загрузка кодировки settings.TOKENIZER_ENCODING вне event loop; False — будет оценка."""
+    global _encoding
+    _encoding = await asyncio.to_thread(_load_encoding, settings.TOKENIZER_ENCODING)
+    return _encoding is not None
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов в тексте."""
+    if not text:
+        return 0
+    if _encoding is None:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def count_prompt_tokens(prompt: Any) -> int:
+    """Число токенов промпта: строки или списка сообщений (без служебных токенов шаблона)."""
+    if isinstance(prompt, str):
+        return count_tokens(prompt)
+    if isinstance(prompt, list):
+        return sum(count_tokens(str(getattr(message, "content", message))) for message in prompt)
+    return 0
+
+
+def record_usage(stage: str, prompt: Any, response: Any) -> tuple[int, int]:
+    """Учет токенов одного вызова LLM этапа; возвращает (промпт, ответ)."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens") or count_prompt_tokens(prompt)
+    completion_tokens = usage.get("output_tokens") or count_tokens(
+        str(getattr(response, "content", ""))
+    )
+    metrics.inc(f"llm_calls_{stage}")
+    metrics.inc(f"llm_prompt_tokens_{stage}", prompt_tokens)
+    metrics.inc(f"llm_completion_tokens_{stage}", completion_tokens)
+    return prompt_tokens, completion_tokens
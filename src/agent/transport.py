@@ -0,0 +1,60 @@
+"""Общий HTTP-клиент для обращений к LLM.
+
+Все экземпляры LLM используют один httpx.AsyncClient с пулом соединений,
+поэтому TCP/TLS-соединения с бэкендом переиспользуются между вызовами
+(keep-alive). Размер пула и таймауты задаются в Settings. Клиент создается
+при первом обращении и закрывается при остановке приложения (lifespan в app.py);
+экземпляры LLM, созданные раньше, при следующем вызове переходят на новый клиент.
+"""
+
+import logging
+from typing import Optional
+
+import httpx
+
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def llm_timeout() -> httpx.Timeout:
+    """Таймауты HTTP-запроса к LLM из настроек."""
+    return httpx.Timeout(
+        settings.LLM_READ_TIMEOUT,
+        connect=settings.LLM_CONNECT_TIMEOUT,
+        pool=settings.LLM_POOL_TIMEOUT,
+    )
+
+
+def _make_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+    http2 = settings.LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("LLM_HTTP2 requires the h2 package (pip install httpx[http2]), using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(limits=limits, timeout=llm_timeout(), http2=http2)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий асинхронный HTTP-клиент для всех экземпляров LLM."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _make_http_client()
+    return _http_client
+
+
+async def aclose_http_client() -> None:
+    """Закрытие общего HTTP-клиента и всех его соединений."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
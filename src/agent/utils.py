@@ -1,45 +1,153 @@
+import asyncio
 import json
 import re
 import logging
-from typing import Any
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage
 from tenacity import (
+    RetryCallState,
     retry,
+    retry_if_exception,
     stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
+    wait_random_exponential,
 )
 
+from src.metrics import metrics
 from src.settings import settings
 
+from .backends import Backend, BackendPool, parse_backends
+from .concurrency import AdaptiveConcurrencyLimiter
+from .rate_limit import get_rate_limiter, is_transient_error, retry_after_seconds
+from .resilience import LatencyTracker
+from .streaming import stream_until_json
+from .transport import get_http_client, llm_timeout
+
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
 
+_backoff = wait_random_exponential(multiplier=1, min=2, max=20)
+
+
+def _retry_wait(retry_state: RetryCallState) -> float:
+    """Пауза перед повтором; после 429 с Retry-After вызов придержит лимитер."""
+    if retry_after_seconds(retry_state.outcome.exception()) is not None:
+        return 0.0
+    return _backoff(retry_state)
+
+
 class LLM:
     """
     Обертка над OpenRouter (через интерфейс OpenAI)
+
+    Может работать с несколькими одинаковыми бэкендами (например, серверами
+    llama.cpp): каждый вызов направляется на наименее загруженный исправный
+    бэкенд (см. backends.BackendPool). При LLM_ADAPTIVE_CONCURRENCY число
+    одновременных вызовов ограничивается лимитом, подбираемым по задержке
+    бэкенда (см. concurrency.AdaptiveConcurrencyLimiter).
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        model: str | None = None,
+        base_url: str | None = None,
+        cache_prompt: bool | None = None,
+        backends: list[str] | None = None,
+        temperature: float = 0.0,
+        max_tokens: int | None = None,
+        reasoning: bool | None = None,
+    ) -> None:
         """
         Инициализация клиента.
+
+        Args:
+            model: Имя модели (по умолчанию settings.LLM_NAME).
+            base_url: Адрес OpenAI-совместимого API (по умолчанию settings.BASE_URL).
+            cache_prompt: Просить сервер llama.cpp переиспользовать KV-кэш общего
+                префикса промпта (по умолчанию settings.LLM_CACHE_PROMPT).
+            backends: Адреса нескольких бэкендов с одной моделью, вес указывается
+                через "|" (по умолчанию settings.LLM_BACKENDS, если не задан base_url).
+            temperature: Температура выборки (0 — детерминированный ответ).
+            max_tokens: Предел длины ответа в токенах (None — без ограничения).
+            reasoning: Включить или выключить рассуждения модели (None — как по
+                умолчанию у модели).
         """
+        if cache_prompt is None:
+            cache_prompt = settings.LLM_CACHE_PROMPT
+        if backends is None:
+            backends = [] if base_url else [settings.LLM_BACKENDS]
+        backend_urls = parse_backends(",".join(backends)) or [(base_url or settings.BASE_URL, 1)]
+
+        extra_body: dict[str, Any] = {}
+        if cache_prompt:
+            extra_body["cache_prompt"] = True
+        if reasoning is not None:
+            # OpenRouter понимает параметр reasoning, llama.cpp — флаг шаблона чата (Qwen3 и др.)
+            extra_body["reasoning"] = {"enabled": reasoning}
+            extra_body["chat_template_kwargs"] = {"enable_thinking": reasoning}
+
+        self._chat_kwargs: dict[str, Any] = dict(
+            model=model or settings.LLM_NAME,
+            api_key=settings.OPENROUTER_API_KEY,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            max_retries=0, # We handle retries manually
+            extra_body=extra_body or None,
+            # usage в потоковом ответе (stream_options.include_usage)
+            stream_usage=True,
+        )
+        self._http_client = get_http_client()
+        self.pool = BackendPool(
+            [
+                Backend(url=url, weight=weight, client=self._make_chat_client(url))
+                for url, weight in backend_urls
+            ]
+        )
+        self._llm = self.pool.backends[0].client
+        self.latency = LatencyTracker()
+        self.concurrency = (
+            AdaptiveConcurrencyLimiter(capacity_probe=self.pool.capacity)
+            if settings.LLM_ADAPTIVE_CONCURRENCY
+            else None
+        )
+
+    def _make_chat_client(self, url: str) -> ChatOpenAI:
         try:
-            self._llm = ChatOpenAI(
-                model=settings.LLM_NAME,
-                api_key=settings.OPENROUTER_API_KEY,
-                base_url=settings.BASE_URL,
-                temperature=0.0,
-                max_retries=0, # We handle retries manually
+            return ChatOpenAI(
+                base_url=url,
+                timeout=llm_timeout(),
+                http_async_client=self._http_client,
+                **self._chat_kwargs,
             )
         except Exception as e:
             raise RuntimeError(f"Ошибка конфигурации OpenRouter: {e}") from e
 
+    def _ensure_http_client(self) -> None:
+        """
+        Пересоздание клиентов бэкендов, если общий HTTP-клиент закрыт.
+
+        ChatOpenAI хранит ссылку на httpx-клиент, переданный при создании;
+        после остановки приложения (aclose_http_client в lifespan) он закрыт,
+        и следующий lifespan работает уже с новым клиентом.
+        """
+        if not self._http_client.is_closed:
+            return
+        self._http_client = get_http_client()
+        for backend in self.pool.backends:
+            backend.client = self._make_chat_client(backend.url)
+        self._llm = self.pool.backends[0].client
+
+    async def aclose(self) -> None:
+        """Остановка фоновых проверок бэкендов."""
+        await self.pool.aclose()
+
     async def check_connection(self) -> bool:
         """Проверка соединения с OpenRouter."""
+        self._ensure_http_client()
         try:
             await self._llm.ainvoke("Hi")
             return True
@@ -47,23 +155,35 @@ class LLM:
             logger.error(f"OpenRouter connection failed: {e}")
             return False
 
-    # Retry логика: ждет 2с, 4с, 8с... при ошибках сети или перегрузке API
+    # Retry логика: при временных ошибках ждет 2с, 4с, 8с... со случайным разбросом,
+    # после 429 с Retry-After ожидание берет на себя общий лимитер
     @retry(
         stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=20),
-        retry=retry_if_exception_type(Exception),
+        wait=_retry_wait,
+        retry=retry_if_exception(is_transient_error),
         reraise=True
     )
     async def _execute_runnable(self, method: Any, *args: Any, **kwargs: Any) -> Any:
         """Выполнение методов LangChain с автоматическим ретраем."""
+        limiter = get_rate_limiter()
+        estimated_tokens = estimate_prompt_tokens(args[0]) if args else 0
+        await limiter.acquire(estimated_tokens)
         try:
-            return await method(*args, **kwargs)
+            result = await method(*args, **kwargs)
         except Exception as e:
+            delay = retry_after_seconds(e)
+            if delay is not None:
+                limiter.pause(delay)
             error_msg = str(e).lower()
             if "429" in error_msg or "rate limit" in error_msg or "insufficient_quota" in error_msg:
                 logger.warning(f"Rate limit exceeded (OpenRouter), retrying... Error: {e}")
             raise e
 
+        usage = getattr(result, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            limiter.adjust(usage["total_tokens"] - estimated_tokens)
+        return result
+
     def bind_tools(self, *args: Any, **kwargs: Any) -> Any:
         """Привязка инструментов (function calling)."""
         return self._llm.bind_tools(*args, **kwargs)
@@ -74,16 +194,116 @@ class LLM:
         """
         return self._llm.with_structured_output(*args, **kwargs)
 
+    async def _call_backend(
+        self, exclude: Backend | None, chosen: list[Backend], *args: Any, **kwargs: Any
+    ) -> Any:
+        if self.concurrency is None:
+            return await self._call_pool(exclude, chosen, *args, **kwargs)
+        async with self.concurrency.slot():
+            return await self._call_pool(exclude, chosen, *args, **kwargs)
+
+    async def _call_pool(
+        self,
+        exclude: Backend | None,
+        chosen: list[Backend],
+        *args: Any,
+        stream_json: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        # Таймаут вызова действует внутри acquire: зависший бэкенд получает
+        # TimeoutError как временную ошибку и отключается автоматом
+        timeout = settings.LLM_CALL_TIMEOUT or None
+        self._ensure_http_client()
+        async with self.pool.acquire(exclude=exclude) as backend:
+            chosen.append(backend)
+            started = time.monotonic()
+            if stream_json:
+                call = stream_until_json(backend.client, *args, **kwargs)
+            else:
+                call = backend.client.ainvoke(*args, **kwargs)
+            result = await asyncio.wait_for(call, timeout=timeout)
+        self.latency.record(time.monotonic() - started)
+        return result
+
+    async def _routed_ainvoke(self, *args: Any, **kwargs: Any) -> Any:
+        hedge_delay = None
+        if settings.LLM_HEDGING:
+            hedge_delay = self.latency.percentile(settings.LLM_HEDGE_PERCENTILE)
+        if hedge_delay is None:
+            return await self._call_backend(None, [], *args, **kwargs)
+
+        # Hedged-вызов: если основной вызов дольше перцентиля, отправляется дубликат
+        # на другой бэкенд (или в другой слот), берется первый успешный ответ
+        primary_backend: list[Backend] = []
+        primary = asyncio.create_task(self._call_backend(None, primary_backend, *args, **kwargs))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if primary in done:
+                return primary.result()
+
+            metrics.inc("llm_hedged_calls")
+            await get_rate_limiter().acquire(estimate_prompt_tokens(args[0]) if args else 0)
+            exclude = primary_backend[0] if primary_backend else None
+            hedge = asyncio.create_task(self._call_backend(exclude, [], *args, **kwargs))
+
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.inc("llm_hedge_wins")
+                        return task.result()
+            return primary.result()
+        finally:
+            unfinished = [task for task in (primary, hedge) if task is not None and not task.done()]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
     async def ainvoke(self, *args: Any, **kwargs: Any) -> Any:
         """Asynchronous invocation of the LLM."""
-        return await self._execute_runnable(self._llm.ainvoke, *args, **kwargs)
+        # Бэкенд выбирается заново при каждой попытке ретрая
+        return await self._execute_runnable(self._routed_ainvoke, *args, **kwargs)
+
+    async def astream(self, *args: Any, **kwargs: Any) -> AIMessage:
+        """
+        Потоковый вызов LLM, прерываемый сразу после закрытия JSON-ответа.
+
+        Рассуждения в блоках <think> в ответ не попадают (см. streaming.py).
+        Маршрутизация, ретраи и лимиты — как у ainvoke.
+        """
+        return await self._execute_runnable(self._routed_ainvoke, *args, stream_json=True, **kwargs)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов в тексте по количеству символов."""
+    if not text:
+        return 0
+    return int(len(text) / settings.CHARS_PER_TOKEN) + 1
+
 
-    async def astream(self, *args: Any, **kwargs: Any) -> Any:
-        """Asynchronous streaming of the LLM response."""
-        return await self._execute_runnable(self._llm.astream, *args, **kwargs)
+def estimate_prompt_tokens(prompt: Any) -> int:
+    """Оценка числа токенов промпта: строки или списка сообщений."""
+    if isinstance(prompt, str):
+        return estimate_tokens(prompt)
+    if isinstance(prompt, list):
+        return sum(estimate_tokens(str(getattr(message, "content", message))) for message in prompt)
+    return 0
+
+
+def _one_line(text: str) -> str:
+    """Текст отзыва в одну строку: в компактной записи перевод строки разделяет отзывы."""
+    return " ".join(text.split())
 
 
 def format_reviews(reviews: list[dict[str, Any]]) -> str:
+    if settings.PROMPT_COMPACT:
+        return "".join(
+            f"ID={review.get('id', i)}: {_one_line(review.get('text', ''))}\n"
+            for i, review in enumerate(reviews, 1)
+        )
     output_parts = []
     separator = "-" * 100
     for i, review in enumerate(reviews, 1):
@@ -94,6 +314,11 @@ def format_reviews(reviews: list[dict[str, Any]]) -> str:
 
 
 def format_reviews_with_categories(reviews: list[dict[str, Any]], categories: list[list[str]]) -> str:
+    if settings.PROMPT_COMPACT:
+        return "".join(
+            f"ID={review.get('id', i)} [{', '.join(cats)}]: {_one_line(review.get('text', ''))}\n"
+            for i, (review, cats) in enumerate(zip(reviews, categories, strict=True), 1)
+        )
     output_parts = []
     separator = "-" * 100
     for i, (review, cats) in enumerate(zip(reviews, categories, strict=True), 1):
@@ -115,6 +340,13 @@ def format_reviews_with_categories_and_sentiments(
     categories: list[list[str]],
     sentiments: list[dict[str, str]]
 ) -> str:
+    if settings.PROMPT_COMPACT:
+        # Тональность по каждой категории: "ID=3 [Транспорт: отрицательно; overall: отрицательно]: текст"
+        return "".join(
+            f"ID={review.get('id', i)} [{'; '.join(f'{k}: {v}' for k, v in sents.items())}]: "
+            f"{_one_line(review.get('text', ''))}\n"
+            for i, (review, sents) in enumerate(zip(reviews, sentiments, strict=True), 1)
+        )
     output_parts = []
     separator = "-" * 100
     for i, (review, cats, sents) in enumerate(zip(reviews, categories, sentiments, strict=True), 1):
@@ -135,6 +367,12 @@ def format_reviews_with_categories_and_sentiments(
 
 def _extract_json_data(response: AIMessage) -> dict:
     content = response.content.strip()
+    # При ограниченном декодировании (response_format) ответ — чистый JSON
+    if content.startswith("{"):
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            pass
     # Пытаемся найти JSON блок
     json_match = re.search(r"\{.*\}", content, re.DOTALL)
     if json_match:
@@ -150,50 +388,176 @@ def _extract_json_data(response: AIMessage) -> dict:
         raise ValueError(f"JSON Decode Error. Content: {content[:50]}...") from e
 
 
-def parse_review_categories(response: AIMessage) -> list[list[str]]:
+def _salvage_review_items(content: str) -> list[dict[str, Any]]:
+    """Восстановление полных объектов отзывов из обрезанного или испорченного JSON.
+
+    Ищет массив "reviews" и разбирает из него по одному объекту; объекты,
+    которые не удалось разобрать (например, обрезанный последний), пропускаются.
+    """
+    start = content.find('"reviews"')
+    if start == -1:
+        return []
+    pos = content.find("[", start)
+    if pos == -1:
+        return []
+
+    decoder = json.JSONDecoder()
+    items = []
+    while True:
+        pos = content.find("{", pos + 1)
+        if pos == -1:
+            break
+        try:
+            item, end = decoder.raw_decode(content, pos)
+        except json.JSONDecodeError:
+            continue
+        # Вложенные объекты (sentiments) без review_id не являются отзывами
+        if isinstance(item, dict) and "review_id" in item:
+            items.append(item)
+            pos = end - 1
+    return items
+
+
+def _extract_review_items(response: AIMessage) -> list[dict[str, Any]]:
+    """Объекты массива "reviews" из ответа модели, в том числе из частично испорченного."""
     try:
         data = _extract_json_data(response)
-        reviews = sorted(data.get("reviews", []), key=lambda x: x.get("review_id", 0))
+        return [item for item in data.get("reviews", []) if isinstance(item, dict)]
+    except ValueError:
+        items = _salvage_review_items(response.content)
+        if not items:
+            raise
+        logger.warning(f"Recovered {len(items)} review objects from malformed JSON")
+        return items
+
+
+def _review_id(item: dict[str, Any]) -> Any:
+    """review_id элемента ответа; id, записанный моделью строкой ("3"), приводится к числу."""
+    review_id = item.get("review_id")
+    if isinstance(review_id, str) and review_id.strip().isdigit():
+        return int(review_id)
+    return review_id
+
+
+def _by_review_id(items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Элементы по возрастанию review_id; элементы без числового id — в конце в исходном порядке."""
+    def key(item: dict[str, Any]) -> tuple[int, int]:
+        review_id = _review_id(item)
+        return (0, review_id) if isinstance(review_id, int) else (1, 0)
+
+    return sorted(items, key=key)
+
+
+def _category_normalizer(available_categories: list[str] | None) -> Callable[[str], str | None]:
+    """Приведение названия категории из ответа модели к виду из списка.
+
+    Со списком категорий название сопоставляется без учета регистра и
+    заменяется каноническим ("мфц/госуслуги" -> "МФЦ/Госуслуги"), а
+    отсутствующее в списке отбрасывается (None). Без списка — title().
+    """
+    if available_categories is None:
+        return lambda name: str(name).strip().title()
+    canonical = {cat.strip().casefold(): cat for cat in available_categories}
+    return lambda name: canonical.get(str(name).strip().casefold())
+
+
+def parse_review_category_items(
+    response: AIMessage, available_categories: list[str] | None = None
+) -> list[tuple[Any, list[str]]]:
+    """Категории отзывов вместе с review_id, отсортированные по review_id.
+
+    Если передан available_categories, названия приводятся к виду из него,
+    а неизвестные категории отбрасываются.
+    """
+    normalize = _category_normalizer(available_categories)
+    try:
+        reviews = _by_review_id(_extract_review_items(response))
 
         result = []
         for review in reviews:
-            cats = [c.strip().title() for c in review.get("categories", [])]
-            result.append(cats)
+            cats = [normalize(c) for c in review.get("categories", [])]
+            cats = list(dict.fromkeys(c for c in cats if c))
+            result.append((_review_id(review), cats))
         return result
     except Exception as e:
         raise ValueError(f"Category parsing error: {e}") from e
 
 
+def parse_review_categories(
+    response: AIMessage, available_categories: list[str] | None = None
+) -> list[list[str]]:
+    return [cats for _, cats in parse_review_category_items(response, available_categories)]
+
+
 def parse_review_sentiments(response: AIMessage) -> list[dict[str, Any]]:
+    """Тональности отзывов {id, sentiments}; недопустимые значения заменяются на
+    "нейтрально", а элемент помечается repaired=True."""
     valid_sentiments = {"положительно", "нейтрально", "отрицательно"}
     try:
-        data = _extract_json_data(response)
-        reviews = sorted(data.get("reviews", []), key=lambda x: x.get("review_id", 0))
+        reviews = _by_review_id(_extract_review_items(response))
 
         result = []
         for review in reviews:
-            review_id = review.get("review_id")
+            if not isinstance(review.get("sentiments", {}), dict):
+                continue
+            review_id = _review_id(review)
             raw_sentiments = review.get("sentiments", {})
             normalized = {}
+            # Модель вернула недопустимую тональность (заменена на нейтральную)
+            repaired = False
             for cat, sent in raw_sentiments.items():
-                s_norm = sent.lower().strip()
+                s_norm = str(sent).lower().strip()
                 if s_norm not in valid_sentiments:
                     s_norm = "нейтрально"
+                    repaired = True
                 normalized[cat] = s_norm
             
             # Extract overall sentiment
-            overall = review.get("overall", "нейтрально").lower().strip()
+            overall = str(review.get("overall", "")).lower().strip()
             if overall not in valid_sentiments:
                 overall = "нейтрально"
+                repaired = True
             normalized["overall"] = overall
             
             # Return dict with id and sentiments
-            result.append({"id": review_id, "sentiments": normalized})
+            item = {"id": review_id, "sentiments": normalized}
+            if repaired:
+                item["repaired"] = True
+            result.append(item)
         return result
     except Exception as e:
         raise ValueError(f"Sentiment parsing error: {e}") from e
 
 
+def parse_review_categories_and_sentiments(
+    response: AIMessage, available_categories: list[str] | None = None
+) -> tuple[list[list[str]], list[dict[str, Any]]]:
+    """Разбор ответа объединенного этапа: категории и тональности за один вызов.
+
+    Возвращает те же структуры, что parse_review_categories и
+    parse_review_sentiments для раздельных этапов.
+    """
+    normalize = _category_normalizer(available_categories)
+    sentiments = parse_review_sentiments(response)
+
+    categories = []
+    for item in sentiments:
+        raw = item["sentiments"]
+        overall = raw.pop("overall")
+        normalized = {}
+        for cat, sent in raw.items():
+            name = normalize(cat)
+            if name:
+                normalized[name] = sent
+        if not normalized:
+            normalized = {"Прочее": overall}
+        normalized["overall"] = overall
+        item["sentiments"] = normalized
+        categories.append([cat for cat in normalized if cat != "overall"])
+
+    return categories, sentiments
+
+
 def parse_ideas(response: AIMessage) -> list[dict[str, Any]]:
     try:
         data = _extract_json_data(response)
@@ -220,3 +584,95 @@ def parse_ideas(response: AIMessage) -> list[dict[str, Any]]:
 
 
 llm_client = LLM()
+
+LLM_TIERS = ("default", "small", "small_sample")
+STAGES = ("category", "sentiment", "ideas")
+_clients: dict[tuple[str | None, str], LLM] = {}
+
+
+@dataclass(frozen=True)
+class StageConfig:
+    """Модель и параметры генерации этапа графа (пустые значения — общие настройки)."""
+    model: str = ""
+    base_url: str = ""
+    max_tokens: int = 0
+    reasoning: bool | None = None
+
+    @property
+    def is_default(self) -> bool:
+        return self == StageConfig()
+
+
+def stage_config(stage: str | None) -> StageConfig:
+    """Настройки этапа из settings.LLM_<STAGE>_* (None — общие настройки)."""
+    if stage is None:
+        return StageConfig()
+    if stage not in STAGES:
+        raise ValueError(f"Unknown graph stage: {stage}")
+    prefix = f"LLM_{stage.upper()}_"
+    return StageConfig(
+        model=getattr(settings, f"{prefix}NAME"),
+        base_url=getattr(settings, f"{prefix}BASE_URL"),
+        max_tokens=getattr(settings, f"{prefix}MAX_TOKENS"),
+        reasoning=getattr(settings, f"{prefix}REASONING"),
+    )
+
+
+def llm_signature() -> str:
+    """Модели, от которых зависит результат классификации (для ключей кэша и чекпоинтов).
+
+    Кроме имени модели этапа учитываются его адрес и режим рассуждений:
+    одно имя на разных серверах или с рассуждениями и без дает разные ответы.
+    """
+    configs = {stage: stage_config(stage) for stage in ("category", "sentiment")}
+    if not any(config.model or config.base_url or config.reasoning is not None for config in configs.values()):
+        return settings.LLM_NAME
+
+    def describe(config: StageConfig) -> str:
+        text = config.model or settings.LLM_NAME
+        if config.base_url:
+            text += f"@{config.base_url}"
+        if config.reasoning is not None:
+            text += f",reasoning={'on' if config.reasoning else 'off'}"
+        return text
+
+    return ";".join(f"{stage}={describe(config)}" for stage, config in configs.items())
+
+
+def get_llm_client(stage: str | None = None, tier: str = "default") -> LLM:
+    """
+    Клиент LLM для этапа графа и уровня каскада моделей.
+
+    Этап ("category", "sentiment", "ideas") задает модель, адрес, предел
+    длины ответа и режим рассуждений (см. stage_config). Уровень "default" —
+    модель этапа или основная (llm_client, если у этапа нет своих настроек),
+    "small" — быстрая модель settings.LLM_SMALL_NAME, "small_sample" — та же
+    быстрая модель с температурой settings.CASCADE_SAMPLE_TEMPERATURE для
+    проверки согласия двух прогонов. Клиенты создаются при первом обращении.
+    """
+    if tier not in LLM_TIERS:
+        raise ValueError(f"Unknown LLM tier: {tier}")
+    config = stage_config(stage)
+    if tier == "default" and config.is_default:
+        return llm_client
+    key = (stage, tier)
+    if key not in _clients:
+        if tier == "default":
+            model, base_url = config.model or None, config.base_url or None
+        else:
+            model, base_url = settings.LLM_SMALL_NAME, settings.LLM_SMALL_BASE_URL or settings.BASE_URL
+        _clients[key] = LLM(
+            model=model,
+            base_url=base_url,
+            temperature=settings.CASCADE_SAMPLE_TEMPERATURE if tier == "small_sample" else 0.0,
+            max_tokens=config.max_tokens or None,
+            reasoning=config.reasoning,
+        )
+    return _clients[key]
+
+
+async def aclose_llm_clients() -> None:
+    """Остановка фоновых проверок бэкендов у всех клиентов LLM."""
+    await llm_client.aclose()
+    for client in _clients.values():
+        await client.aclose()
@@ -1,9 +1,13 @@
-from typing import List, Dict, Any
+import json
+from typing import AsyncIterator, List, Dict, Any, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from src.services.prediction_service import prediction_service
+from src.metrics import metrics
+from src.services.jobs import Job, job_manager
+from src.services.prediction_service import PredictionReport, prediction_service
 
 router = APIRouter()
 
@@ -24,6 +28,8 @@ class ReviewResponse(BaseModel):
     id: int
     categories: List[CategorySentiment]
     overall: int
+    # Путь обработки: "llm", "cache", "rules" (правила без LLM) или "classifier" (локальный классификатор)
+    path: Optional[str] = None
 
 
 class IdeaResponse(BaseModel):
@@ -35,11 +41,56 @@ class IdeaResponse(BaseModel):
 class PredictionRequest(BaseModel):
     reviews: List[ReviewItem]
     use_few_shot: bool = False
+    # Категории и тональности одним вызовом LLM; None — значение из настроек сервиса
+    use_fused_stage: Optional[bool] = None
+
+
+class FailedBatchResponse(BaseModel):
+    """Batch that could not be processed; its reviews are missing from the response."""
+    batch_index: int
+    review_ids: List[int]
+    error: str
 
 
 class PredictionResponse(BaseModel):
     reviews: List[ReviewResponse]
     ideas: List[IdeaResponse]
+    failed_batches: List[FailedBatchResponse] = []
+
+
+class JobCreatedResponse(BaseModel):
+    job_id: str
+    status: str
+
+
+class JobStatusResponse(BaseModel):
+    """Progress of a background prediction job."""
+    job_id: str
+    status: str
+    batches_done: int
+    batches_total: int
+    reviews_total: int
+    reviews_done: int
+    failed_batches: List[FailedBatchResponse] = []
+    error: Optional[str] = None
+    reviews: Optional[List[ReviewResponse]] = None
+    ideas: Optional[List[IdeaResponse]] = None
+
+
+class JobResultsPage(BaseModel):
+    """Page of processed reviews of a background job."""
+    job_id: str
+    status: str
+    total: int
+    offset: int
+    limit: int
+    reviews: List[ReviewResponse]
+
+
+class JobIdeasResponse(BaseModel):
+    job_id: str
+    status: str
+    ideas: List[IdeaResponse]
 
 
 def map_sentiment_to_int(sentiment: str) -> int:
@@ -52,6 +103,65 @@ def map_sentiment_to_int(sentiment: str) -> int:
         return 0
 
 
+def to_review_responses(
+    reviews_map: Dict[int, Dict[str, str]],
+    paths: Optional[Dict[Any, str]] = None,
+) -> List[ReviewResponse]:
+    """Преобразование {review_id: {category: sentiment, overall: sentiment}} в ответ API."""
+    paths = paths or {}
+    transformed_reviews = []
+    for review_id, sentiments_data in reviews_map.items():
+        sentiments_data = dict(sentiments_data)
+        # Extract overall sentiment
+        overall_str = sentiments_data.pop("overall", "нейтрально")
+        overall_val = map_sentiment_to_int(overall_str)
+
+        categories_list = []
+        for cat_name, sent_str in sentiments_data.items():
+            categories_list.append(
+                CategorySentiment(
+                    name=cat_name,
+                    sentiment=map_sentiment_to_int(sent_str)
+                )
+            )
+
+        transformed_reviews.append(
+            ReviewResponse(
+                id=review_id,
+                categories=categories_list,
+                overall=overall_val,
+                path=paths.get(review_id),
+            )
+        )
+    return transformed_reviews
+
+
+def to_idea_responses(ideas_map: Dict[str, List[Dict[str, Any]]]) -> List[IdeaResponse]:
+    """Преобразование {category: [{description, source_ids}]} в плоский список идей."""
+    transformed_ideas = []
+    for category, ideas_list in ideas_map.items():
+        for idea in ideas_list:
+            transformed_ideas.append(
+                IdeaResponse(
+                    category=category,
+                    description=idea.get("description", ""),
+                    source_ids=idea.get("source_ids", [])
+                )
+            )
+    return transformed_ideas
+
+
+def to_failed_batch_responses(report: PredictionReport) -> List[FailedBatchResponse]:
+    return [
+        FailedBatchResponse(
+            batch_index=failure.batch_index,
+            review_ids=failure.review_ids,
+            error=failure.error,
+        )
+        for failure in report.failures
+    ]
+
+
 @router.post("/predict", response_model=PredictionResponse)
 async def predict_reviews(request: PredictionRequest):
     """
@@ -62,6 +172,7 @@ async def predict_reviews(request: PredictionRequest):
     - Классификацию по категориям с тональностью.
     - Общую тональность отзыва.
     - Идеи улучшения (aggregated by category).
+    - Список батчей, которые не удалось обработать (если такие были).
     """
     if not request.reviews:
         raise HTTPException(status_code=400, detail="List of reviews cannot be empty")
@@ -69,48 +180,226 @@ async def predict_reviews(request: PredictionRequest):
     # Convert Pydantic models to list of dicts for the service
     reviews_dicts = [r.model_dump() for r in request.reviews]
 
+    report = PredictionReport()
+
     try:
         reviews_map, ideas_map = await prediction_service.predict(
             reviews=reviews_dicts,
-            use_few_shot=request.use_few_shot
+            use_few_shot=request.use_few_shot,
+            report=report,
+            use_fused_stage=request.use_fused_stage,
         )
 
-        # Transform reviews
-        transformed_reviews = []
-        for review_id, sentiments_data in reviews_map.items():
-            # Extract overall sentiment
-            overall_str = sentiments_data.pop("overall", "нейтрально")
-            overall_val = map_sentiment_to_int(overall_str)
-
-            categories_list = []
-            for cat_name, sent_str in sentiments_data.items():
-                categories_list.append(
-                    CategorySentiment(
-                        name=cat_name,
-                        sentiment=map_sentiment_to_int(sent_str)
-                    )
-                )
+        return PredictionResponse(
+            reviews=to_review_responses(reviews_map, report.paths),
+            ideas=to_idea_responses(ideas_map),
+            failed_batches=to_failed_batch_responses(report),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
-            transformed_reviews.append(
-                ReviewResponse(
-                    id=review_id,
-                    categories=categories_list,
-                    overall=overall_val
-                )
-            )
 
-        # Transform ideas
-        transformed_ideas = []
-        for category, ideas_list in ideas_map.items():
-            for idea in ideas_list:
-                transformed_ideas.append(
-                    IdeaResponse(
-                        category=category,
-                        description=idea.get("description", ""),
-                        source_ids=idea.get("source_ids", [])
-                    )
-                )
+def _encode_stream_record(record: Dict[str, Any], stream_format: str) -> str:
+    payload = json.dumps(record, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {record['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+async def _stream_predictions(
+    reviews: List[Dict[str, Any]],
+    use_few_shot: bool,
+    use_fused_stage: Optional[bool],
+    stream_format: str,
+    ideas_mode: str,
+) -> AsyncIterator[str]:
+    report = PredictionReport()
+    reviews_sent = 0
+    ideas_sent = 0
+    pending_ideas: Dict[str, List[Dict[str, Any]]] = {}
+
+    def encode(record: Dict[str, Any]) -> str:
+        return _encode_stream_record(record, stream_format)
+
+    try:
+        async for result in prediction_service.predict_iter(
+            reviews, use_few_shot, report, use_fused_stage=use_fused_stage
+        ):
+            if result.error is not None:
+                yield encode({
+                    "type": "error",
+                    "batch_index": result.index,
+                    "review_ids": result.review_ids,
+                    "error": str(result.error),
+                })
+                continue
+
+            batch_reviews = {
+                item["id"]: item.get("sentiments") or {}
+                for item in result.sentiments
+                if item.get("id") is not None
+            }
+            for review in to_review_responses(batch_reviews, report.paths):
+                reviews_sent += 1
+                yield encode({"type": "review", "batch_index": result.index, **review.model_dump()})
+            if result.failed_review_ids:
+                yield encode({
+                    "type": "error",
+                    "batch_index": result.index,
+                    "review_ids": result.failed_review_ids,
+                    "error": str(result.partial_error),
+                })
+
+            batch_ideas: Dict[str, List[Dict[str, Any]]] = {}
+            for idea_block in result.ideas:
+                category = idea_block.get("category")
+                if category and idea_block.get("ideas"):
+                    batch_ideas.setdefault(category, []).extend(idea_block["ideas"])
 
-        return PredictionResponse(reviews=transformed_reviews, ideas=transformed_ideas)
+            if ideas_mode == "batch":
+                for idea in to_idea_responses(batch_ideas):
+                    ideas_sent += 1
+                    yield encode({"type": "idea", "batch_index": result.index, **idea.model_dump()})
+            else:
+                for category, ideas_list in batch_ideas.items():
+                    pending_ideas.setdefault(category, []).extend(ideas_list)
+
+        for idea in to_idea_responses(pending_ideas):
+            ideas_sent += 1
+            yield encode({"type": "idea", **idea.model_dump()})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        yield encode({"type": "error", "error": f"Prediction failed: {str(e)}"})
+
+    yield encode({
+        "type": "summary",
+        "reviews": reviews_sent,
+        "ideas": ideas_sent,
+        "batches_total": report.batches_total,
+        "cache_hits": report.cache_hits,
+        "rule_hits": report.rule_hits,
+        "distilled_hits": report.distilled_hits,
+        "duplicates_collapsed": report.duplicates_collapsed,
+        "failed_batches": [f.model_dump() for f in to_failed_batch_responses(report)],
+    })
+
+
+@router.post("/predict/stream")
+async def predict_reviews_stream(
+    request: PredictionRequest,
+    format: Literal["ndjson", "sse"] = "ndjson",
+    ideas: Literal["batch", "end"] = "batch",
+):
+    """
+    Потоковая классификация отзывов.
+
+    Результаты каждого батча отправляются сразу после его обработки,
+    по одной записи на строку (NDJSON) или событие (SSE):
+    - {"type": "review", ...} — обработанный отзыв (формат ReviewResponse);
+    - {"type": "idea", ...} — идея улучшения; при ideas=batch отправляется
+      вместе с батчем, при ideas=end — в конце потока;
+    - {"type": "error", ...} — батч, который не удалось обработать;
+    - {"type": "summary", ...} — итоговая запись.
+    """
+    if not request.reviews:
+        raise HTTPException(status_code=400, detail="List of reviews cannot be empty")
+
+    reviews_dicts = [r.model_dump() for r in request.reviews]
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+
+    return StreamingResponse(
+        _stream_predictions(
+            reviews_dicts, request.use_few_shot, request.use_fused_stage, format, ideas
+        ),
+        media_type=media_type,
+    )
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.post("/jobs", response_model=JobCreatedResponse, status_code=202)
+async def create_job(request: PredictionRequest):
+    """
+    Постановка большого набора отзывов в фоновую обработку.
+
+    Возвращает id задачи сразу; прогресс доступен через GET /jobs/{job_id},
+    результаты — через GET /jobs/{job_id}/results и GET /jobs/{job_id}/ideas.
+    """
+    if not request.reviews:
+        raise HTTPException(status_code=400, detail="List of reviews cannot be empty")
+
+    reviews_dicts = [r.model_dump() for r in request.reviews]
+    job = await job_manager.submit(
+        reviews_dicts,
+        use_few_shot=request.use_few_shot,
+        use_fused_stage=request.use_fused_stage,
+    )
+    return JobCreatedResponse(job_id=job.id, status=job.status)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str, include_results: bool = False):
+    """
+    Статус фоновой задачи: прогресс по батчам и, при include_results=true,
+    частичные результаты, полученные на текущий момент.
+    """
+    job = _get_job(job_id)
+    reviews_map, ideas_map = job.merged_results()
+
+    response = JobStatusResponse(
+        job_id=job.id,
+        status=job.status,
+        batches_done=job.batches_done,
+        batches_total=job.report.batches_total,
+        reviews_total=len(job.reviews),
+        reviews_done=len(reviews_map),
+        failed_batches=to_failed_batch_responses(job.report),
+        error=job.error,
+    )
+    if include_results:
+        response.reviews = to_review_responses(reviews_map, job.report.paths)
+        response.ideas = to_idea_responses(ideas_map)
+    return response
+
+
+@router.get("/jobs/{job_id}/results", response_model=JobResultsPage)
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Постраничная выдача обработанных отзывов задачи (в порядке входных отзывов)."""
+    job = _get_job(job_id)
+    reviews_map, _ = job.merged_results()
+    page = dict(list(reviews_map.items())[offset : offset + limit])
+
+    return JobResultsPage(
+        job_id=job.id,
+        status=job.status,
+        total=len(reviews_map),
+        offset=offset,
+        limit=limit,
+        reviews=to_review_responses(page, job.report.paths),
+    )
+
+
+@router.get("/jobs/{job_id}/ideas", response_model=JobIdeasResponse)
+async def get_job_ideas(job_id: str):
+    """Идеи улучшения, извлеченные задачей на текущий момент."""
+    job = _get_job(job_id)
+    _, ideas_map = job.merged_results()
+    return JobIdeasResponse(job_id=job.id, status=job.status, ideas=to_idea_responses(ideas_map))
+
+
+@router.get("/metrics")
+async def get_metrics() -> Dict[str, float]:
+    """Счетчики сервиса: пропущенные вызовы LLM, попадания в кэш и т.д."""
+    snapshot = metrics.snapshot()
+    if prediction_service.cache is not None:
+        for name, value in prediction_service.cache.stats().items():
+            snapshot[f"cache_{name}"] = value
+    return snapshot
@@ -0,0 +1,172 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from src.agent.prompts import (
+    CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_PROMPT,
+    CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT,
+    CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT,
+    MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT,
+    CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT,
+    SESSION_IDEAS_FOLLOW_UP_PROMPT,
+    SESSION_SENTIMENT_FOLLOW_UP_PROMPT,
+)
+from src.agent.utils import estimate_tokens, format_reviews_with_categories_and_sentiments
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_overhead_tokens(
+    use_few_shot: bool,
+    available_categories: List[str],
+    use_fused_stage: bool = False,
+    use_session: bool = False,
+) -> int:
+    """
+    Стоимость самого длинного шаблона промпта без отзывов.
+
+    В общем диалоге этапов (use_session) промпт последнего этапа содержит
+    весь диалог: шаблон первого этапа и указания всех следующих.
+    """
+    if use_few_shot:
+        category_prompt = CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        sentiment_prompt = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        fused_prompt = CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+        ideas_prompt = MAKE_IDEAS_MULTIPLE_REVIEWS_FEW_SHOT_PROMPT
+    else:
+        category_prompt = CLASSIFY_CATEGORY_MULTIPLE_REVIEWS_PROMPT
+        sentiment_prompt = CLASSIFY_SENTIMENT_MULTIPLE_REVIEWS_PROMPT
+        fused_prompt = CLASSIFY_CATEGORY_AND_SENTIMENT_MULTIPLE_REVIEWS_PROMPT
+        ideas_prompt = MAKE_IDEAS_MULTIPLE_REVIEWS_PROMPT
+
+    formatted_categories = ", ".join(available_categories)
+    if use_session:
+        first_prompt = fused_prompt if use_fused_stage else category_prompt
+        prompts = [first_prompt.format(reviews="", available_categories=formatted_categories)]
+        if not use_fused_stage:
+            prompts.append(SESSION_SENTIMENT_FOLLOW_UP_PROMPT.format(review_ids=""))
+        prompts.append(SESSION_IDEAS_FOLLOW_UP_PROMPT.format(review_ids=""))
+        return sum(estimate_tokens(prompt) for prompt in prompts)
+
+    prompts = [ideas_prompt.format(reviews_with_categories_and_sentiments="")]
+    if use_fused_stage:
+        prompts.append(fused_prompt.format(reviews="", available_categories=formatted_categories))
+    else:
+        prompts.append(category_prompt.format(reviews="", available_categories=formatted_categories))
+        prompts.append(sentiment_prompt.format(reviews_with_categories=""))
+    return max(estimate_tokens(prompt) for prompt in prompts)
+
+
+def review_overhead_tokens() -> int:
+    """Стоимость разметки одного отзыва в самом подробном формате (этап идей)."""
+    block = format_reviews_with_categories_and_sentiments(
+        [{"id": 1_000_000_000, "text": ""}],
+        [["Социальная поддержка", "МФЦ/Госуслуги"]],
+        [{"Социальная поддержка": "отрицательно", "МФЦ/Госуслуги": "отрицательно", "overall": "отрицательно"}],
+    )
+    return estimate_tokens(block)
+
+
+def per_review_tokens(use_session: bool = False, use_fused_stage: bool = False) -> int:
+    """
+    Стоимость отзыва сверх его текста: разметка и ожидаемый ответ модели.
+
+    В общем диалоге этапов в контексте остаются ответы всех предыдущих
+    этапов, поэтому ответ учитывается для каждого этапа.
+    """
+    answers = (2 if use_fused_stage else 3) if use_session else 1
+    return review_overhead_tokens() + settings.OUTPUT_TOKENS_PER_REVIEW * answers
+
+
+def reviews_cost(
+    reviews: List[Dict[str, Any]], use_session: bool = False, use_fused_stage: bool = False
+) -> int:
+    """Оценка токенов, которые отзывы занимают в батче (см. pack_batches)."""
+    per_review = per_review_tokens(use_session, use_fused_stage)
+    return sum(estimate_tokens(review.get("text", "")) + per_review for review in reviews)
+
+
+def batch_budget(
+    use_few_shot: bool,
+    available_categories: List[str],
+    context_tokens: Optional[int] = None,
+    use_fused_stage: bool = False,
+    use_session: bool = False,
+) -> int:
+    """Токены контекста, остающиеся на отзывы батча после шаблона промпта."""
+    budget = context_tokens or settings.LLM_CONTEXT_TOKENS
+    return budget - prompt_overhead_tokens(
+        use_few_shot, available_categories, use_fused_stage, use_session
+    )
+
+
+def pack_batches(
+    reviews: List[Dict[str, Any]],
+    use_few_shot: bool,
+    available_categories: List[str],
+    context_tokens: Optional[int] = None,
+    use_fused_stage: bool = False,
+    use_session: bool = False,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Разбивает отзывы на минимальное число батчей, укладывающихся в контекст модели.
+
+    Стоимость батча оценивается как шаблон промпта + отзывы с разметкой +
+    ожидаемый ответ модели (OUTPUT_TOKENS_PER_REVIEW на отзыв; в общем
+    диалоге этапов — весь диалог с ответами всех этапов). Батчи
+    заполняются методом first-fit decreasing; внутри батча сохраняется
+    исходный порядок отзывов.
+
+    Отзыв, который не помещается в контекст даже один, обрезается до
+    допустимой длины и отправляется отдельным батчем.
+
+    Args:
+        reviews: Список словарей отзывов [{'id': 1, 'text': '...'}].
+        use_few_shot: Используются ли few-shot промпты.
+        available_categories: Список доступных категорий.
+        context_tokens: Бюджет контекста (по умолчанию settings.LLM_CONTEXT_TOKENS).
+        use_fused_stage: Используется ли объединенный этап категорий и тональностей.
+        use_session: Продолжают ли этапы общий диалог (STAGE_SESSION).
+
+    Returns:
+        Список батчей отзывов.
+    """
+    free_budget = batch_budget(
+        use_few_shot, available_categories, context_tokens, use_fused_stage, use_session
+    )
+    per_review = per_review_tokens(use_session, use_fused_stage)
+
+    if free_budget <= per_review:
+        raise ValueError(
+            f"Context budget of {context_tokens or settings.LLM_CONTEXT_TOKENS} tokens "
+            "is too small for the prompt template"
+        )
+
+    items = []
+    for index, review in enumerate(reviews):
+        cost = estimate_tokens(review.get("text", "")) + per_review
+        if cost > free_budget:
+            max_chars = int((free_budget - per_review) * settings.CHARS_PER_TOKEN)
+            logger.warning(
+                f"Review {review.get('id')} exceeds the context budget, truncating to {max_chars} chars"
+            )
+            review = {**review, "text": review.get("text", "")[:max_chars]}
+            cost = free_budget
+        items.append((cost, index, review))
+
+    bins: List[List[Any]] = []  # [свободный бюджет, [(index, review), ...]]
+    for cost, index, review in sorted(items, key=lambda item: (-item[0], item[1])):
+        for bin_ in bins:
+            if bin_[0] >= cost:
+                bin_[0] -= cost
+                bin_[1].append((index, review))
+                break
+        else:
+            bins.append([free_budget - cost, [(index, review)]])
+
+    # Батчи упорядочены по первому отзыву, чтобы порядок результатов был стабильным
+    ordered_bins = sorted((sorted(bin_[1], key=lambda x: x[0]) for bin_ in bins), key=lambda b: b[0][0])
+    return [[review for _, review in bin_] for bin_ in ordered_bins]
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from src.services.batch_packer import batch_budget, per_review_tokens, reviews_cost
+from src.services.ideas import remap_ideas
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Поля состояния, которые относятся к конкретному батчу и не участвуют в группировке
+_PER_BATCH_KEYS = {"reviews", "categories", "sentiments", "ideas", "messages"}
+
+
+@dataclass
+class _Ticket:
+    """Отзывы одного вызывающего, ожидающие общего батча."""
+    reviews: List[Dict[str, Any]]
+    future: asyncio.Future
+    # internal_id -> исходный id отзыва
+    id_map: Dict[int, Any] = field(default_factory=dict)
+
+
+@dataclass
+class _PendingGroup:
+    """Набирающийся батч для одного набора параметров (few-shot, категории...)."""
+    template: Dict[str, Any]
+    tickets: List[_Ticket] = field(default_factory=list)
+    size: int = 0
+    # Оценка токенов отзывов батча (BATCH_PACKING=tokens)
+    tokens: int = 0
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+def _group_key(state: Dict[str, Any]) -> str:
+    params = {k: v for k, v in state.items() if k not in _PER_BATCH_KEYS}
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class MicroBatchingAgent:
+    """
+    Обертка над агентом, объединяющая отзывы из параллельных запросов в общие батчи.
+
+    Каждый вызов ainvoke ставит свои отзывы в очередь. Батч отправляется агенту,
+    как только в нем набирается batch_size отзывов (при BATCH_PACKING=tokens —
+    как только следующий отзыв не поместится в LLM_CONTEXT_TOKENS по оценке
+    batch_packer) или истекает max_delay секунд с момента появления первого отзыва. Отзывы одного вызова никогда не делятся
+    между батчами. Перед запуском агента id отзывов заменяются на внутренние,
+    чтобы одинаковые id разных запросов не смешивались; каждый вызывающий
+    получает только свои отзывы и идеи, ссылающиеся на них.
+    """
+
+    def __init__(
+        self,
+        agent: Any,
+        batch_size: Optional[int] = None,
+        max_delay: Optional[float] = None,
+    ) -> None:
+        self.agent = agent
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._groups: Dict[str, _PendingGroup] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _batch_size(self) -> int:
+        return self.batch_size or settings.BATCH_SIZE
+
+    def _token_budget(self, state: Dict[str, Any]) -> Optional[int]:
+        # Явно заданный batch_size ограничивает батч числом отзывов в любом режиме
+        if settings.BATCH_PACKING != "tokens" or self.batch_size:
+            return None
+        return batch_budget(
+            state.get("use_few_shot", False),
+            state.get("available_categories", []),
+            use_fused_stage=state.get("use_fused_stage", False),
+            use_session=state.get("use_session", False),
+        )
+
+    def _max_delay(self) -> float:
+        if self.max_delay is not None:
+            return self.max_delay
+        return settings.MICRO_BATCH_MAX_DELAY_MS / 1000
+
+    async def ainvoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Ставит отзывы состояния в общий батч и ожидает результат для них."""
+        reviews = state.get("reviews", [])
+        if not reviews:
+            return {**state, "sentiments": [], "ideas": []}
+
+        loop = asyncio.get_running_loop()
+        key = _group_key(state)
+        batch_size = self._batch_size()
+        # В режиме tokens батч ограничен контекстом модели, а не числом отзывов
+        budget = self._token_budget(state)
+        use_session = state.get("use_session", False)
+        use_fused_stage = state.get("use_fused_stage", False)
+        tokens = reviews_cost(reviews, use_session, use_fused_stage) if budget is not None else 0
+
+        group = self._groups.get(key)
+        if group is not None and (
+            group.tokens + tokens > budget if budget is not None else group.size + len(reviews) > batch_size
+        ):
+            self._flush(key)
+            group = None
+        if group is None:
+            group = _PendingGroup(template=state)
+            self._groups[key] = group
+
+        ticket = _Ticket(reviews=reviews, future=loop.create_future())
+        group.tickets.append(ticket)
+        group.size += len(reviews)
+        group.tokens += tokens
+
+        if budget is not None and budget - group.tokens < per_review_tokens(use_session, use_fused_stage):
+            self._flush(key)
+        elif budget is None and group.size >= batch_size:
+            self._flush(key)
+        elif group.timer is None:
+            group.timer = loop.call_later(self._max_delay(), self._flush, key)
+
+        return await ticket.future
+
+    def _flush(self, key: str) -> None:
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        task = asyncio.create_task(self._run(group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: _PendingGroup) -> None:
+        combined: List[Dict[str, Any]] = []
+        for ticket in group.tickets:
+            for review in ticket.reviews:
+                internal_id = len(combined) + 1
+                ticket.id_map[internal_id] = review.get("id")
+                combined.append({**review, "id": internal_id})
+
+        state = {
+            **group.template,
+            "reviews": combined,
+            "categories": [],
+            "sentiments": [],
+            "ideas": [],
+        }
+
+        logger.info(
+            f"Micro-batch: {len(combined)} reviews from {len(group.tickets)} requests"
+        )
+
+        try:
+            final_state = await self.agent.ainvoke(state)
+        except Exception as e:
+            for ticket in group.tickets:
+                if not ticket.future.done():
+                    ticket.future.set_exception(e)
+            return
+
+        sentiments = final_state.get("sentiments", [])
+        ideas = final_state.get("ideas", [])
+        for ticket in group.tickets:
+            if ticket.future.done():
+                continue
+            ticket.future.set_result(
+                {
+                    **final_state,
+                    "reviews": ticket.reviews,
+                    "sentiments": _select_sentiments(sentiments, ticket.id_map),
+                    # Идеи, ссылающиеся на отзывы вызывающего, с его исходными id
+                    "ideas": remap_ideas(ideas, _original_ids(ticket.id_map)),
+                }
+            )
+
+
+def _original_ids(id_map: Dict[int, Any]) -> Callable[[Any], List[Any]]:
+    return lambda internal_id: [id_map[internal_id]] if internal_id in id_map else []
+
+
+def _select_sentiments(
+    sentiments: List[Dict[str, Any]], id_map: Dict[int, Any]
+) -> List[Dict[str, Any]]:
+    result = []
+    for item in sentiments:
+        internal_id = item.get("id")
+        if internal_id in id_map:
+            result.append({**item, "id": id_map[internal_id]})
+    return result
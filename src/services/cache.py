@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста отзыва для построения ключа кэша."""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class ResultCache:
+    """
+    Кэш результатов классификации отзывов, адресуемый по содержимому.
+
+    Ключ — хэш нормализованного текста отзыва вместе с именем модели,
+    вариантом промпта, режимами графа и списком категорий. Значение — словарь
+    тональностей отзыва {category: sentiment, overall: sentiment}.
+
+    Первый уровень — LRU в памяти, второй (необязательный) — SQLite на диске.
+    Записи старше ttl_seconds считаются устаревшими (0 — без ограничения).
+    Лишние и устаревшие записи SQLite удаляются не при каждой вставке, а после
+    каждых EVICT_EVERY вставок. Методы синхронные; из асинхронного кода их
+    вызывают через asyncio.to_thread (get_many, set_many).
+    """
+
+    EVICT_EVERY = 1000
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl_seconds: float = 0,
+        sqlite_path: Optional[str] = None,
+        sqlite_max_size: int = 0,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_max_size = sqlite_max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._inserts_since_eviction = 0
+
+        if sqlite_path:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS review_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    text TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS review_cache_created_at ON review_cache (created_at)"
+            )
+            self._db.commit()
+            self._evict_sqlite()
+
+    @classmethod
+    def from_settings(cls) -> "ResultCache":
+        return cls(
+            max_size=settings.CACHE_MAX_SIZE,
+            ttl_seconds=settings.CACHE_TTL_SECONDS,
+            sqlite_path=settings.CACHE_SQLITE_PATH,
+            sqlite_max_size=settings.CACHE_SQLITE_MAX_SIZE,
+        )
+
+    @staticmethod
+    def make_key(
+        text: str,
+        model_name: str,
+        use_few_shot: bool,
+        categories: List[str],
+        use_fused_stage: bool = False,
+        prompt_compact: bool = False,
+        stage_session: bool = False,
+        cascade: str = "",
+    ) -> str:
+        """
+        Построение ключа кэша для отзыва.
+
+        cascade — описание каскада моделей (пусто, если каскад выключен): ответы
+        быстрой модели не должны попадать под ключ основной.
+        """
+        payload = json.dumps(
+            {
+                "text": normalize_text(text),
+                "model": model_name,
+                "few_shot": use_few_shot,
+                "fused": use_fused_stage,
+                "compact": prompt_compact,
+                "session": stage_session,
+                "cascade": cascade,
+                "categories": list(categories),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        """Возвращает копию закэшированного значения или None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return dict(value)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM review_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    raw_value, created_at = row
+                    if not self._is_expired(created_at):
+                        value = json.loads(raw_value)
+                        self._set_memory(key, value, created_at)
+                        self.hits += 1
+                        return dict(value)
+                    self._db.execute("DELETE FROM review_cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def get_many(self, keys: List[str]) -> List[Optional[Dict[str, str]]]:
+        """Значения для списка ключей (None для промахов)."""
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: Dict[str, str], text: Optional[str] = None) -> None:
+        """Сохраняет значение в оба уровня кэша."""
+        self.set_many([(key, value, text)])
+
+    def set_many(self, entries: List[Tuple[str, Dict[str, str], Optional[str]]]) -> None:
+        """Сохраняет (ключ, значение, текст отзыва) в оба уровня кэша одной транзакцией."""
+        if not entries:
+            return
+        created_at = time.time()
+        with self._lock:
+            for key, value, _ in entries:
+                self._set_memory(key, dict(value), created_at)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO review_cache (key, value, text, created_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, json.dumps(value, ensure_ascii=False), text, created_at)
+                        for key, value, text in entries
+                    ],
+                )
+                self._db.commit()
+                self._inserts_since_eviction += len(entries)
+                if self._inserts_since_eviction >= self.EVICT_EVERY:
+                    self._evict_sqlite()
+
+    def _set_memory(self, key: str, value: Dict[str, str], created_at: float) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _evict_sqlite(self) -> None:
+        if self._db is None:
+            return
+        self._inserts_since_eviction = 0
+        if self.ttl_seconds > 0:
+            self._db.execute(
+                "DELETE FROM review_cache WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+        if self.sqlite_max_size > 0:
+            (size,) = self._db.execute("SELECT COUNT(*) FROM review_cache").fetchone()
+            if size > self.sqlite_max_size:
+                # Самые старые записи находятся по индексу created_at
+                self._db.execute(
+                    """
+                    DELETE FROM review_cache WHERE key IN (
+                        SELECT key FROM review_cache ORDER BY created_at LIMIT ?
+                    )
+                    """,
+                    (size - self.sqlite_max_size,),
+                )
+        self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_size": len(self._memory),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM review_cache")
+                self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
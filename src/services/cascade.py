@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from src.metrics import metrics
+from src.services.ideas import remap_ideas
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(category: str) -> str:
+    return category.strip().casefold()
+
+
+def _answers(state: Dict[str, Any]) -> Dict[Any, Dict[str, Any]]:
+    return {item.get("id"): item for item in state.get("sentiments", [])}
+
+
+class CascadeAgent:
+    """
+    Каскад моделей: батч сначала обрабатывает быстрая модель, основная —
+    только отзывы, в ответе на которые быстрая модель не уверена.
+
+    Отзыв передается основной модели (эскалируется), если быстрая модель:
+    - не вернула для него результат или вернула неизвестную категорию
+      или недопустимую тональность (в сыром ответе, до замены на нейтральную);
+    - дала другой ответ во втором, случайном прогоне (settings.CASCADE_AGREEMENT):
+      расхождение двух прогонов заменяет самооценку уверенности, которую
+      модель не сообщает.
+
+    Проверочный прогон идет параллельно основному и не выполняет этап идей.
+    Идеи из ответа быстрой модели, опирающиеся только на эскалированные
+    отзывы, отбрасываются; для них идеи берутся из ответа основной модели.
+    Доля эскалированных отзывов — метрика cascade_escalated_ratio.
+
+    Если основная модель упала, возвращаются ответы быстрой модели на
+    неэскалированные отзывы; эскалированные в ответ не попадают и
+    отправляются повторно восстановлением батча в PredictionService.
+    """
+
+    def __init__(self, agent: Any, agreement: Optional[bool] = None) -> None:
+        self.agent = agent
+        self.agreement = settings.CASCADE_AGREEMENT if agreement is None else agreement
+
+    def _needs_escalation(
+        self,
+        item: Optional[Dict[str, Any]],
+        sample_item: Optional[Dict[str, Any]],
+        known_categories: Set[str],
+    ) -> bool:
+        answer = (item or {}).get("sentiments")
+        if not answer or item.get("repaired"):
+            return True
+        categories = [category for category in answer if category != "overall"]
+        if not categories or any(_normalize(category) not in known_categories for category in categories):
+            return True
+        if self.agreement:
+            sample = (sample_item or {}).get("sentiments")
+            if not sample:
+                return True
+            normalized = {_normalize(category): sentiment for category, sentiment in answer.items()}
+            normalized_sample = {_normalize(category): sentiment for category, sentiment in sample.items()}
+            if normalized != normalized_sample:
+                return True
+        return False
+
+    async def ainvoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        reviews = state["reviews"]
+        runs = [self.agent.ainvoke({**state, "llm_tier": "small"})]
+        if self.agreement:
+            runs.append(self.agent.ainvoke({**state, "llm_tier": "small_sample", "skip_ideas": True}))
+        results = await asyncio.gather(*runs, return_exceptions=True)
+
+        small = results[0]
+        if isinstance(small, BaseException):
+            logger.warning(f"Small model failed on a batch of {len(reviews)} reviews: {small}")
+            small = {}
+        sample = results[1] if self.agreement else {}
+        if isinstance(sample, BaseException):
+            sample = {}
+
+        answers = _answers(small)
+        samples = _answers(sample)
+        known_categories = {_normalize(category) for category in state.get("available_categories", [])}
+        escalated = [
+            review
+            for review in reviews
+            if self._needs_escalation(
+                answers.get(review.get("id")), samples.get(review.get("id")), known_categories
+            )
+        ]
+
+        metrics.inc("cascade_reviews_total", len(reviews))
+        metrics.inc("cascade_reviews_escalated", len(escalated))
+        metrics.set_gauge(
+            "cascade_escalated_ratio",
+            metrics.get("cascade_reviews_escalated") / metrics.get("cascade_reviews_total"),
+        )
+
+        if not escalated:
+            return small
+
+        escalated_ids = {review.get("id") for review in escalated}
+        kept_ids = {review.get("id") for review in reviews} - escalated_ids
+        try:
+            large = await self.agent.ainvoke({**state, "reviews": escalated})
+        except Exception as e:
+            if not kept_ids:
+                # Ошибка основной модели на всем батче обрабатывается PredictionService
+                raise
+            logger.warning(
+                f"Large model failed on {len(escalated)} escalated reviews, keeping "
+                f"{len(kept_ids)} small model answers: {e}"
+            )
+            metrics.inc("cascade_large_failures")
+            large = {}
+
+        sentiments_by_id: Dict[Any, Dict[str, Any]] = {}
+        categories_by_id: Dict[Any, List[str]] = {}
+        for result, ids in ((small, kept_ids), (large, escalated_ids)):
+            for review, categories in zip(result.get("reviews", []), result.get("categories", [])):
+                if review.get("id") in ids:
+                    categories_by_id[review.get("id")] = categories
+            for item in result.get("sentiments", []):
+                if item.get("id") in ids:
+                    sentiments_by_id[item.get("id")] = item
+        merged_reviews = [
+            review
+            for review in reviews
+            if review.get("id") in sentiments_by_id and review.get("id") in categories_by_id
+        ]
+
+        return {
+            **state,
+            "reviews": merged_reviews,
+            "categories": [categories_by_id[review.get("id")] for review in merged_reviews],
+            "sentiments": [sentiments_by_id[review.get("id")] for review in merged_reviews],
+            # Идеи быстрой модели — только со ссылками на неэскалированные отзывы
+            "ideas": remap_ideas(
+                small.get("ideas", []),
+                lambda source_id: [source_id] if source_id in kept_ids else [],
+            ) + large.get("ideas", []),
+        }
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph
+from langgraph.graph.state import CompiledStateGraph
+
+from src.agent.graph import workflow
+from src.agent.utils import llm_signature
+from src.metrics import metrics
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointedAgent:
+    """
+    Граф классификации с сохранением состояния после каждого узла.
+
+    Каждому батчу соответствует поток (thread_id), детерминированно
+    вычисляемый из отзывов и параметров запроса. Если узел упал, граф
+    продолжается с последнего завершенного узла (до resume_attempts раз)
+    и не повторяет уже выполненные вызовы LLM. После успеха или исчерпания
+    попыток поток удаляется. Остается он только при отмене вызова или
+    остановке процесса: с бэкендом "sqlite" такой батч продолжится при
+    повторной обработке после перезапуска. Одинаковые батчи, пришедшие
+    одновременно, выполняются по очереди, а не продолжают поток друг друга.
+
+    Бэкенды: "memory" (InMemorySaver) и "sqlite" (AsyncSqliteSaver из пакета
+    langgraph-checkpoint-sqlite, переживает перезапуск процесса).
+    """
+
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        sqlite_path: Optional[str] = None,
+        resume_attempts: Optional[int] = None,
+        graph: Optional[StateGraph] = None,
+    ) -> None:
+        self.backend = backend or settings.CHECKPOINT_BACKEND
+        self.sqlite_path = sqlite_path or settings.CHECKPOINT_SQLITE_PATH
+        self.resume_attempts = (
+            settings.CHECKPOINT_RESUME_ATTEMPTS if resume_attempts is None else resume_attempts
+        )
+        self._workflow = graph or workflow
+        self._checkpointer: Optional[BaseCheckpointSaver] = None
+        self._agent: Optional[CompiledStateGraph] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # thread_id -> [блокировка, число ожидающих ее вызовов]
+        self._locks: Dict[str, List[Any]] = {}
+
+    @staticmethod
+    def thread_id(state: Dict[str, Any]) -> str:
+        """Идентификатор потока чекпоинтов для батча."""
+        payload = json.dumps(
+            {
+                "reviews": [[review.get("id"), review.get("text", "")] for review in state["reviews"]],
+                "categories": state.get("available_categories", []),
+                "few_shot": state.get("use_few_shot", False),
+                "fused": state.get("use_fused_stage", False),
+                "model": llm_signature(),
+                "tier": state.get("llm_tier", "default"),
+                "skip_ideas": state.get("skip_ideas", False),
+                "session": state.get("use_session", False),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _make_checkpointer(self) -> BaseCheckpointSaver:
+        if self.backend == "sqlite":
+            try:
+                import aiosqlite
+                from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+            except ImportError as e:
+                raise RuntimeError(
+                    "CHECKPOINT_BACKEND=sqlite requires the langgraph-checkpoint-sqlite package"
+                ) from e
+            Path(self.sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            # Соединение открывается сохранителем при первом обращении
+            return AsyncSqliteSaver(aiosqlite.connect(self.sqlite_path))
+        if self.backend == "memory":
+            return InMemorySaver()
+        raise ValueError(f"Unknown checkpoint backend: {self.backend}")
+
+    def _get_agent(self) -> CompiledStateGraph:
+        # Сохранитель SQLite привязан к event loop, в котором создан
+        loop = asyncio.get_running_loop()
+        if self._agent is None or (self.backend == "sqlite" and self._loop is not loop):
+            self._checkpointer = self._make_checkpointer()
+            self._agent = self._workflow.compile(checkpointer=self._checkpointer)
+            self._loop = loop
+        return self._agent
+
+    async def ainvoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        thread_id = self.thread_id(state)
+        entry = self._locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._run(state, thread_id)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[thread_id]
+
+    async def _run(self, state: Dict[str, Any], thread_id: str) -> Dict[str, Any]:
+        agent = self._get_agent()
+        checkpointer = self._checkpointer
+        config = {"configurable": {"thread_id": thread_id}}
+
+        snapshot = await agent.aget_state(config)
+        graph_input: Optional[Dict[str, Any]] = state
+        if snapshot.next:
+            logger.info(f"Resuming batch {thread_id[:12]} at {list(snapshot.next)}")
+            metrics.inc("checkpoint_resumes")
+            graph_input = None
+
+        attempt = 0
+        cancelled = False
+        try:
+            while True:
+                try:
+                    return await agent.ainvoke(graph_input, config)
+                except Exception as e:
+                    snapshot = await agent.aget_state(config)
+                    if attempt >= self.resume_attempts or not snapshot.next:
+                        raise
+                    attempt += 1
+                    logger.warning(f"Batch {thread_id[:12]} failed at {list(snapshot.next)} ({e}), resuming")
+                    metrics.inc("checkpoint_resumes")
+                    graph_input = None
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await checkpointer.adelete_thread(thread_id)
+
+    async def aclose(self) -> None:
+        """Закрытие соединения с базой чекпоинтов."""
+        conn = getattr(self._checkpointer, "conn", None)
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning(f"Failed to close checkpoint database: {e}")
+        self._checkpointer = None
+        self._agent = None
+        self._loop = None
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from src.services.cache import normalize_text
+from src.services.ideas import remap_ideas
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, size: int) -> Set[str]:
+    """Множество символьных k-грамм нормализованного текста."""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Число полос и строк в полосе LSH: порог LSH с запасом ниже порога сходства."""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        # Пары со сходством выше (1/bands)^(1/rows) почти наверняка окажутся в одной корзине
+        if (1 / bands) ** (1 / rows) <= threshold - 0.1:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """MinHash-сигнатуры множеств шинглов (num_perm универсальных хэш-функций)."""
+
+    def __init__(self, num_perm: int, seed: int = 1) -> None:
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, items: Set[str]) -> np.ndarray:
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=4).digest(), "little")
+                for item in items
+            ),
+            dtype=np.uint64,
+            count=len(items),
+        )
+        # Переполнение uint64 при умножении допустимо: результат все равно перемешан
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+
+def collapse_duplicates(
+    reviews: List[Dict[str, Any]],
+    threshold: Optional[float] = None,
+    shingle_size: Optional[int] = None,
+    num_perm: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[Any, List[Any]]]:
+    """
+    Схлопывание почти одинаковых отзывов (массовые обращения по одному шаблону).
+
+    Кандидаты в дубликаты ищутся по MinHash-сигнатурам символьных шинглов
+    (LSH по полосам сигнатуры), затем проверяется точное сходство Жаккара
+    (не ниже threshold) с представителем группы. Представитель — первый
+    отзыв группы во входном порядке; отзыв сравнивается только с
+    представителями, поэтому цепочки "A похож на B, B похож на C" не
+    объединяют непохожие A и C.
+
+    Returns:
+        Представители в исходном порядке и {id представителя: id остальных отзывов группы}.
+    """
+    threshold = settings.DEDUP_THRESHOLD if threshold is None else threshold
+    shingle_size = settings.DEDUP_SHINGLE_SIZE if shingle_size is None else shingle_size
+    num_perm = settings.DEDUP_NUM_PERM if num_perm is None else num_perm
+
+    hasher = MinHasher(num_perm)
+    bands, rows = _lsh_bands(num_perm, threshold)
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    sets: List[Set[str]] = []
+    representatives: List[Dict[str, Any]] = []
+    members: Dict[Any, List[Any]] = {}
+
+    for review in reviews:
+        items = shingles(review.get("text", ""), shingle_size)
+        signature = hasher.signature(items)
+        keys = [(band, signature[band * rows : (band + 1) * rows].tobytes()) for band in range(bands)]
+
+        candidates = sorted({index for key in keys for index in buckets.get(key, [])})
+        match = next((index for index in candidates if jaccard(items, sets[index]) >= threshold), None)
+        if match is not None:
+            members[representatives[match].get("id")].append(review.get("id"))
+            continue
+
+        index = len(representatives)
+        representatives.append(review)
+        sets.append(items)
+        members[review.get("id")] = []
+        for key in keys:
+            buckets.setdefault(key, []).append(index)
+
+    return representatives, {rep_id: ids for rep_id, ids in members.items() if ids}
+
+
+def expand_sentiments(sentiments: List[Dict[str, Any]], members: Dict[Any, List[Any]]) -> List[Dict[str, Any]]:
+    """Тональности представителей, скопированные всем отзывам их групп."""
+    result = []
+    for item in sentiments:
+        result.append(item)
+        for member_id in members.get(item.get("id"), []):
+            result.append({**item, "id": member_id})
+    return result
+
+
+def expand_ideas(ideas: List[Dict[str, Any]], members: Dict[Any, List[Any]]) -> List[Dict[str, Any]]:
+    """Идеи, в source_ids которых к представителю добавлены все отзывы его группы."""
+    return remap_ideas(
+        ideas, lambda source_id: [source_id, *members.get(source_id, [])], keep_unreferenced=True
+    )
+
+
+def expand_ids(review_ids: List[Any], members: Dict[Any, List[Any]]) -> List[Any]:
+    return [member for review_id in review_ids for member in [review_id, *members.get(review_id, [])]]
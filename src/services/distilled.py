@@ -0,0 +1,229 @@
+import json
+import logging
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.metrics import metrics
+from src.services.cache import normalize_text
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Класс модели категорий для отзывов с несколькими категориями: их классифицирует LLM
+MULTIPLE_CATEGORIES = "__multiple__"
+
+
+def load_training_data(sqlite_path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """Тексты отзывов и ответы агента ({category: sentiment, overall: sentiment}) из кэша SQLite."""
+    db = sqlite3.connect(sqlite_path)
+    try:
+        rows = db.execute("SELECT text, value FROM review_cache WHERE text IS NOT NULL").fetchall()
+    finally:
+        db.close()
+    # Один и тот же текст мог попасть в кэш под разными ключами (модель, промпт)
+    labels: Dict[str, Tuple[str, Dict[str, str]]] = {}
+    for text, value in rows:
+        labels[normalize_text(text)] = (text, json.loads(value))
+    texts = [text for text, _ in labels.values()]
+    return texts, [label for _, label in labels.values()]
+
+
+def _category_label(label: Dict[str, str]) -> Optional[str]:
+    categories = [category for category in label if category != "overall"]
+    if not categories:
+        return None
+    return categories[0] if len(categories) == 1 else MULTIPLE_CATEGORIES
+
+
+@dataclass
+class Agreement:
+    """Сравнение ответов классификатора с ответами LLM на отложенной выборке."""
+    reviews: int
+    # Доля отзывов, на которые классификатор отвечает сам (вероятность не ниже порога)
+    coverage: float
+    # Доля ответов классификатора, совпавших с LLM (категория и общая тональность)
+    agreement: float
+    # Совпадение с LLM без порога, на всех отзывах
+    accuracy: float
+
+
+class DistilledClassifier:
+    """
+    Локальный классификатор (TF-IDF + логистическая регрессия), обученный на
+    ответах агента из кэша результатов.
+
+    Две модели на общих признаках (символьные n-граммы нормализованного
+    текста): категория отзыва и общая тональность. Отзывы, в которых LLM
+    нашла несколько категорий, образуют отдельный класс — их классификатор
+    всегда передает агенту. Ответ дается, только если вероятность и
+    категории, и тональности не ниже threshold; тональность категории
+    совпадает с общей.
+    """
+
+    def __init__(self, vectorizer: Any, category_model: Any, sentiment_model: Any) -> None:
+        self.vectorizer = vectorizer
+        self.category_model = category_model
+        self.sentiment_model = sentiment_model
+
+    @classmethod
+    def train(cls, texts: List[str], labels: List[Dict[str, str]]) -> "DistilledClassifier":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+
+        samples = [
+            (normalize_text(text), _category_label(label), label.get("overall"))
+            for text, label in zip(texts, labels)
+        ]
+        samples = [sample for sample in samples if sample[1] and sample[2]]
+        if len({category for _, category, _ in samples}) < 2 or len({s for _, _, s in samples}) < 2:
+            raise ValueError(
+                f"Not enough labeled reviews to train: {len(samples)} reviews, "
+                "need at least two categories and two sentiments"
+            )
+
+        vectorizer = TfidfVectorizer(
+            analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True, max_features=200_000
+        )
+        features = vectorizer.fit_transform([text for text, _, _ in samples])
+        category_model = LogisticRegression(max_iter=1000, C=10.0)
+        category_model.fit(features, [category for _, category, _ in samples])
+        sentiment_model = LogisticRegression(max_iter=1000, C=10.0)
+        sentiment_model.fit(features, [sentiment for _, _, sentiment in samples])
+        return cls(vectorizer, category_model, sentiment_model)
+
+    def save(self, path: str) -> None:
+        import joblib
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump(
+            {
+                "vectorizer": self.vectorizer,
+                "category_model": self.category_model,
+                "sentiment_model": self.sentiment_model,
+            },
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "DistilledClassifier":
+        import joblib
+
+        data = joblib.load(path)
+        return cls(data["vectorizer"], data["category_model"], data["sentiment_model"])
+
+    @classmethod
+    def from_settings(cls) -> Optional["DistilledClassifier"]:
+        path = settings.DISTILLED_MODEL_PATH
+        if not Path(path).exists():
+            logger.warning(f"Distilled classifier {path} not found, all reviews go to the LLM")
+            return None
+        logger.info(f"Loaded distilled classifier from {path}")
+        return cls.load(path)
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, float, str, float]]:
+        """(категория, ее вероятность, тональность, ее вероятность) для каждого текста."""
+        if not texts:
+            return []
+        features = self.vectorizer.transform([normalize_text(text) for text in texts])
+        category_proba = self.category_model.predict_proba(features)
+        sentiment_proba = self.sentiment_model.predict_proba(features)
+        result = []
+        for category_row, sentiment_row in zip(category_proba, sentiment_proba):
+            category_index = category_row.argmax()
+            sentiment_index = sentiment_row.argmax()
+            result.append(
+                (
+                    str(self.category_model.classes_[category_index]),
+                    float(category_row[category_index]),
+                    str(self.sentiment_model.classes_[sentiment_index]),
+                    float(sentiment_row[sentiment_index]),
+                )
+            )
+        return result
+
+    def classify(
+        self, texts: List[str], available_categories: List[str], threshold: Optional[float] = None
+    ) -> List[Optional[Dict[str, str]]]:
+        """Тональности {category: sentiment, overall: sentiment} или None, если решает LLM."""
+        threshold = settings.DISTILLED_THRESHOLD if threshold is None else threshold
+        known = {category.casefold() for category in available_categories}
+        answers: List[Optional[Dict[str, str]]] = []
+        for category, category_p, sentiment, sentiment_p in self.predict(texts):
+            if (
+                category == MULTIPLE_CATEGORIES
+                or category.casefold() not in known
+                or min(category_p, sentiment_p) < threshold
+            ):
+                answers.append(None)
+            else:
+                answers.append({category: sentiment, "overall": sentiment})
+        return answers
+
+    def split(
+        self, reviews: List[Dict[str, Any]], available_categories: List[str]
+    ) -> Tuple[Dict[Any, Dict[str, str]], List[Dict[str, Any]]]:
+        """Ответы классификатора {review_id: тональности} и отзывы, которые остаются агенту."""
+        answers = self.classify([review.get("text", "") for review in reviews], available_categories)
+        answered: Dict[Any, Dict[str, str]] = {}
+        remaining = []
+        for review, answer in zip(reviews, answers):
+            if answer is None:
+                remaining.append(review)
+            else:
+                answered[review.get("id")] = answer
+        metrics.inc("distilled_reviews_total", len(reviews))
+        metrics.inc("distilled_hits", len(answered))
+        return answered, remaining
+
+    def agreement(
+        self, texts: List[str], labels: List[Dict[str, str]], threshold: Optional[float] = None
+    ) -> Agreement:
+        """Согласие с ответами LLM: покрытие при пороге, точность ответов и точность без порога."""
+        threshold = settings.DISTILLED_THRESHOLD if threshold is None else threshold
+        answered = agreed = correct = 0
+        for (category, category_p, sentiment, sentiment_p), label in zip(self.predict(texts), labels):
+            matches = category == _category_label(label) and sentiment == label.get("overall")
+            correct += matches
+            if category != MULTIPLE_CATEGORIES and min(category_p, sentiment_p) >= threshold:
+                answered += 1
+                agreed += matches
+        total = len(texts)
+        return Agreement(
+            reviews=total,
+            coverage=answered / total if total else 0.0,
+            agreement=agreed / answered if answered else 0.0,
+            accuracy=correct / total if total else 0.0,
+        )
+
+
+def train_from_cache(
+    sqlite_path: str, output_path: str, test_size: float = 0.2, seed: int = 0
+) -> Tuple[DistilledClassifier, Agreement, float]:
+    """
+    Обучение на ответах агента из кэша: оценка согласия с LLM на отложенной
+    части, затем обучение на всех данных и сохранение в output_path.
+
+    Returns:
+        Классификатор, согласие на отложенной части и скорость (отзывов в секунду).
+    """
+    texts, labels = load_training_data(sqlite_path)
+    indices = list(range(len(texts)))
+    random.Random(seed).shuffle(indices)
+    held_out = set(indices[: int(len(indices) * test_size)])
+    train_idx = [i for i in indices if i not in held_out]
+    test_idx = [i for i in indices if i in held_out]
+
+    model = DistilledClassifier.train([texts[i] for i in train_idx], [labels[i] for i in train_idx])
+    test_texts = [texts[i] for i in test_idx]
+    agreement = model.agreement(test_texts, [labels[i] for i in test_idx])
+
+    model = DistilledClassifier.train(texts, labels)
+    started = time.perf_counter()
+    model.predict(texts)
+    elapsed = time.perf_counter() - started
+    model.save(output_path)
+    return model, agreement, len(texts) / elapsed if elapsed else 0.0
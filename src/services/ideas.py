@@ -0,0 +1,29 @@
+from typing import Any, Callable, Dict, List
+
+
+def remap_ideas(
+    ideas: List[Dict[str, Any]],
+    map_id: Callable[[Any], List[Any]],
+    keep_unreferenced: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Идеи, в которых каждая ссылка source_ids заменена на список map_id(ссылка).
+
+    Пустой список отбрасывает ссылку, несколько id — размножают ее. Идеи без
+    оставшихся ссылок и пустые блоки категорий отбрасываются, если не задан
+    keep_unreferenced.
+    """
+    result = []
+    for idea_block in ideas:
+        remapped = []
+        for idea in idea_block.get("ideas", []):
+            if not isinstance(idea, dict):
+                continue
+            source_ids = [
+                new_id for source_id in idea.get("source_ids", []) for new_id in map_id(source_id)
+            ]
+            if source_ids or keep_unreferenced:
+                remapped.append({**idea, "source_ids": source_ids})
+        if remapped or keep_unreferenced:
+            result.append({**idea_block, "ideas": remapped})
+    return result
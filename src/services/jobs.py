@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.services.prediction_service import (
+    BatchResult,
+    PredictionReport,
+    PredictionService,
+    merge_batch_results,
+    prediction_service,
+)
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """Фоновая задача классификации большого набора отзывов."""
+    id: str
+    reviews: List[Dict[str, Any]]
+    use_few_shot: bool = False
+    use_fused_stage: Optional[bool] = None
+    status: str = JobStatus.PENDING
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    report: PredictionReport = field(default_factory=PredictionReport)
+    results: List[BatchResult] = field(default_factory=list)
+
+    @property
+    def batches_done(self) -> int:
+        return sum(1 for result in self.results if result.index >= 0)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def merged_results(
+        self,
+    ) -> Tuple[Dict[int, Dict[str, str]], Dict[str, List[Dict[str, Any]]]]:
+        """Текущие (возможно, частичные) результаты задачи."""
+        return merge_batch_results(self.reviews, self.results)
+
+
+class JobManager:
+    """
+    Очередь фоновых задач и пул воркеров, обрабатывающих их через PredictionService.
+
+    Воркеры запускаются при старте приложения (или лениво при первой задаче)
+    и работают в текущем event loop. Завершенные задачи хранятся
+    settings.JOB_RETENTION_SECONDS секунд.
+    """
+
+    def __init__(
+        self,
+        service: Optional[PredictionService] = None,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.service = service or prediction_service
+        self.workers = workers or settings.JOB_WORKERS
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        """Запуск пула воркеров в текущем event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker_tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        # Задачи, поставленные до перезапуска, возвращаются в очередь
+        for job in self._jobs.values():
+            if not job.is_finished:
+                job.status = JobStatus.PENDING
+                job.results = []
+                job.report = PredictionReport()
+                self._queue.put_nowait(job.id)
+
+    async def stop(self) -> None:
+        """Остановка пула воркеров."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        self._loop = None
+
+    async def submit(
+        self,
+        reviews: List[Dict[str, Any]],
+        use_few_shot: bool = False,
+        use_fused_stage: Optional[bool] = None,
+    ) -> Job:
+        """Создает задачу и ставит ее в очередь."""
+        await self.start()
+        self._cleanup()
+
+        job = Job(
+            id=uuid.uuid4().hex,
+            reviews=reviews,
+            use_few_shot=use_few_shot,
+            use_fused_stage=use_fused_stage,
+        )
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job.id)
+        logger.info(f"Job {job.id} queued with {len(reviews)} reviews")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _cleanup(self) -> None:
+        threshold = time.time() - settings.JOB_RETENTION_SECONDS
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.is_finished and job.finished_at is not None and job.finished_at < threshold
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    await self._run_job(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: Job) -> None:
+        job.status = JobStatus.RUNNING
+        try:
+            async for result in self.service.predict_iter(
+                job.reviews,
+                use_few_shot=job.use_few_shot,
+                report=job.report,
+                use_fused_stage=job.use_fused_stage,
+            ):
+                job.results.append(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+        else:
+            if job.results and all(result.error is not None for result in job.results):
+                job.status = JobStatus.FAILED
+                job.error = str(job.results[0].error)
+            else:
+                job.status = JobStatus.COMPLETED
+        job.finished_at = time.time()
+
+
+job_manager = JobManager()
@@ -0,0 +1,64 @@
+import logging
+from typing import Any, Dict, List
+
+from src.services.ideas import remap_ideas
+
+logger = logging.getLogger(__name__)
+
+
+def _local_id(value: Any) -> Any:
+    # Модель может записать id строкой: "3" вместо 3
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+class LocalIdAgent:
+    """
+    Обертка над агентом, заменяющая id отзывов из базы на локальные номера 1..n.
+
+    Длинные id из базы занимают токены промпта, а модель повторяет их в ответе
+    (review_id, source_ids) — это токены генерации и источник ошибок: модель
+    путает или искажает многозначные числа. Агент видит только номера отзывов
+    в батче; в результате тональности, отзывы и ссылки идей (source_ids)
+    возвращаются к исходным id. Ссылки на номера, которых нет в батче,
+    отбрасываются.
+    """
+
+    def __init__(self, agent: Any) -> None:
+        self.agent = agent
+
+    async def ainvoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        reviews = state.get("reviews", [])
+        id_map = {local_id: review.get("id") for local_id, review in enumerate(reviews, 1)}
+        originals = {local_id: review for local_id, review in enumerate(reviews, 1)}
+        local_reviews = [{**review, "id": local_id} for local_id, review in enumerate(reviews, 1)]
+
+        result = await self.agent.ainvoke({**state, "reviews": local_reviews})
+
+        dropped: List[Any] = []
+
+        def to_original(source_id: Any) -> List[Any]:
+            local_id = _local_id(source_id)
+            if local_id in id_map:
+                return [id_map[local_id]]
+            dropped.append(source_id)
+            return []
+
+        ideas = remap_ideas(result.get("ideas", []), to_original, keep_unreferenced=True)
+        if dropped:
+            logger.warning(f"Dropped {len(dropped)} idea references to unknown reviews")
+
+        return {
+            **result,
+            # Порядок и состав отзывов сохраняются: с ними выровнен список categories
+            "reviews": [
+                originals.get(review.get("id"), review) for review in result.get("reviews", [])
+            ],
+            "sentiments": [
+                {**item, "id": id_map[_local_id(item.get("id"))]}
+                for item in result.get("sentiments", [])
+                if _local_id(item.get("id")) in id_map
+            ],
+            "ideas": ideas,
+        }
@@ -1,15 +1,105 @@
 import asyncio
-from typing import Any, Dict, List, Tuple
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from src.agent import agent as classification_agent
+from src.agent.rate_limit import is_transient_error
+from src.agent.resilience import CircuitOpenError
+from src.agent.utils import llm_signature
+from src.metrics import metrics
+from src.services.batch_packer import pack_batches
+from src.services.batcher import MicroBatchingAgent
+from src.services.cache import ResultCache
+from src.services.cascade import CascadeAgent
+from src.services.checkpointing import CheckpointedAgent
+from src.services.dedup import collapse_duplicates, expand_ids, expand_ideas, expand_sentiments
+from src.services.distilled import DistilledClassifier
+from src.services.local_ids import LocalIdAgent
+from src.services.rules import RuleClassifier
 from src.settings import settings
 
+logger = logging.getLogger(__name__)
+
+# Номер псевдо-батча с отзывами, найденными в кэше
+CACHED_BATCH_INDEX = -1
+# Номер псевдо-батча с отзывами, классифицированными правилами
+RULES_BATCH_INDEX = -2
+# Номер псевдо-батча с отзывами, классифицированными локальным классификатором
+DISTILLED_BATCH_INDEX = -3
+
+# Путь обработки отзыва (PredictionReport.paths)
+PATH_CACHE = "cache"
+PATH_RULES = "rules"
+PATH_DISTILLED = "classifier"
+PATH_LLM = "llm"
+
+
+@dataclass
+class BatchFailure:
+    """Информация о батче, который не удалось обработать."""
+    batch_index: int
+    review_ids: List[int]
+    error: str
+
+
+@dataclass
+class PredictionReport:
+    """Служебная информация о выполнении предсказания."""
+    batches_total: int = 0
+    cache_hits: int = 0
+    rule_hits: int = 0
+    distilled_hits: int = 0
+    # Отзывы, схлопнутые с почти одинаковыми (settings.DEDUP_ENABLED)
+    duplicates_collapsed: int = 0
+    failures: List[BatchFailure] = field(default_factory=list)
+    # review_id -> путь обработки: PATH_CACHE, PATH_RULES, PATH_DISTILLED или PATH_LLM
+    paths: Dict[Any, str] = field(default_factory=dict)
+
+
+@dataclass
+class BatchResult:
+    """Результат обработки одного батча агентом."""
+    index: int
+    review_ids: List[int]
+    sentiments: List[Dict[str, Any]] = field(default_factory=list)
+    ideas: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    # Отзывы, которые не удалось обработать даже по одному, при частичном успехе батча
+    failed_review_ids: List[int] = field(default_factory=list)
+    partial_error: Optional[BaseException] = None
+
+
+def _is_backend_failure(error: BaseException) -> bool:
+    """Ошибка бэкенда, а не ответа модели: деление батча ее не исправит."""
+    return isinstance(error, (CircuitOpenError, asyncio.TimeoutError)) or is_transient_error(error)
+
 
 class PredictionService:
     """Сервис для классификации отзывов с использованием агента."""
 
-    def __init__(self, agent: Any = None):
-        self.agent = agent or classification_agent
+    def __init__(
+        self,
+        agent: Any = None,
+        cache: Optional[ResultCache] = None,
+        rules: Optional[RuleClassifier] = None,
+        distilled: Optional[DistilledClassifier] = None,
+    ):
+        self.checkpointed_agent: Optional[CheckpointedAgent] = None
+        if agent is None:
+            agent = classification_agent
+            if settings.CHECKPOINT_BACKEND != "none":
+                agent = self.checkpointed_agent = CheckpointedAgent()
+            if settings.PROMPT_COMPACT:
+                agent = LocalIdAgent(agent)
+            if settings.CASCADE_ENABLED:
+                agent = CascadeAgent(agent)
+            if settings.MICRO_BATCH_ENABLED:
+                agent = MicroBatchingAgent(agent)
+        self.agent = agent
+        if cache is None and settings.CACHE_ENABLED:
+            cache = ResultCache.from_settings()
+        self.cache = cache
         self.available_categories = [
             "Благоустройство",
             "ЖКХ",
@@ -22,64 +112,392 @@ class PredictionService:
             "МФЦ/Госуслуги",
             "Прочее"
         ]
+        if rules is None and settings.RULES_ENABLED:
+            rules = RuleClassifier.from_settings(self.available_categories)
+        self.rules = rules
+        if distilled is None and settings.DISTILLED_ENABLED:
+            distilled = DistilledClassifier.from_settings()
+        self.distilled = distilled
+
+    def _cache_key(
+        self, review: Dict[str, Any], use_few_shot: bool, use_fused_stage: bool
+    ) -> str:
+        cascade = ""
+        if settings.CASCADE_ENABLED:
+            cascade = f"small={settings.LLM_SMALL_NAME};agreement={settings.CASCADE_AGREEMENT}"
+        return ResultCache.make_key(
+            review.get("text", ""),
+            llm_signature(),
+            use_few_shot,
+            self.available_categories,
+            use_fused_stage=use_fused_stage,
+            prompt_compact=settings.PROMPT_COMPACT,
+            stage_session=settings.STAGE_SESSION,
+            cascade=cascade,
+        )
+
+    def _split_batches(
+        self,
+        reviews: List[Dict[str, Any]],
+        use_few_shot: bool = False,
+        use_fused_stage: bool = False,
+    ) -> List[List[Dict[str, Any]]]:
+        if settings.BATCH_PACKING == "tokens":
+            return pack_batches(
+                reviews,
+                use_few_shot,
+                self.available_categories,
+                use_fused_stage=use_fused_stage,
+                use_session=settings.STAGE_SESSION,
+            )
+
+        batch_size = settings.BATCH_SIZE
+        return [reviews[i : i + batch_size] for i in range(0, len(reviews), batch_size)]
+
+    async def _process_batch(
+        self,
+        index: int,
+        batch_reviews: List[Dict[str, Any]],
+        use_few_shot: bool,
+        use_fused_stage: bool,
+        semaphore: asyncio.Semaphore,
+    ) -> BatchResult:
+        """Запускает агента на одном батче, перехватывая ошибку батча."""
+        result = BatchResult(index=index, review_ids=[r.get("id") for r in batch_reviews])
+        failures: List[Tuple[List[Any], BaseException]] = []
+
+        async with semaphore:
+            await self._run_with_recovery(batch_reviews, use_few_shot, use_fused_stage, result, failures)
+
+        if failures:
+            if not result.sentiments:
+                logger.error(f"Batch {index} failed: {failures[0][1]}")
+                result.error = failures[0][1]
+                result.ideas = []
+            else:
+                result.failed_review_ids = [r_id for ids, _ in failures for r_id in ids]
+                result.partial_error = failures[0][1]
+                logger.error(
+                    f"Batch {index}: reviews {result.failed_review_ids} failed: {result.partial_error}"
+                )
+        return result
+
+    async def _run_with_recovery(
+        self,
+        batch_reviews: List[Dict[str, Any]],
+        use_few_shot: bool,
+        use_fused_stage: bool,
+        result: BatchResult,
+        failures: List[Tuple[List[Any], BaseException]],
+    ) -> None:
+        """
+        Запускает агента и добирает отзывы, для которых не получен результат.
+
+        Отзывы, пропавшие из частично разобранного ответа, отправляются
+        повторно отдельным вызовом. Если агент упал или не вернул ни одного
+        отзыва, батч делится пополам вплоть до одиночных отзывов
+        (settings.BATCH_RECOVERY). Делится только батч, на который модель
+        дала негодный ответ: при временной ошибке (429, 5xx, таймаут, сеть)
+        или открытом автомате бэкенда батч целиком записывается в failures,
+        чтобы не умножать вызовы к перегруженному бэкенду. Результаты
+        накапливаются в result, необработанные отзывы — в failures.
+        """
+        initial_state = {
+            "reviews": batch_reviews,
+            "available_categories": self.available_categories,
+            "categories": [],
+            "sentiments": [],
+            "ideas": [],
+            "use_few_shot": use_few_shot,
+            "use_fused_stage": use_fused_stage,
+            "use_session": settings.STAGE_SESSION,
+            "messages": [],
+        }
+
+        try:
+            final_state = await self.agent.ainvoke(initial_state)
+        except Exception as e:
+            error: BaseException = e
+            missing = batch_reviews
+        else:
+            sentiments = final_state.get("sentiments", [])
+            result.sentiments.extend(sentiments)
+            result.ideas.extend(final_state.get("ideas", []))
+            if not settings.BATCH_RECOVERY:
+                return
+
+            recovered = {item.get("id") for item in sentiments}
+            missing = [review for review in batch_reviews if review.get("id") not in recovered]
+            if not missing:
+                return
+            error = ValueError(f"No result for reviews {[r.get('id') for r in missing]}")
+            if len(missing) < len(batch_reviews):
+                logger.warning(f"Resubmitting {len(missing)} of {len(batch_reviews)} reviews")
+                metrics.inc("reviews_resubmitted", len(missing))
+                await self._run_with_recovery(missing, use_few_shot, use_fused_stage, result, failures)
+                return
+
+        if not settings.BATCH_RECOVERY or len(missing) == 1 or _is_backend_failure(error):
+            failures.append(([r.get("id") for r in missing], error))
+            return
+
+        logger.warning(f"Batch of {len(missing)} reviews failed ({error}), splitting in half")
+        metrics.inc("batch_bisections")
+        middle = len(missing) // 2
+        for half in (missing[:middle], missing[middle:]):
+            await self._run_with_recovery(half, use_few_shot, use_fused_stage, result, failures)
+
+    async def aclose(self) -> None:
+        """Освобождение ресурсов сервиса (соединение с базой чекпоинтов)."""
+        if self.checkpointed_agent is not None:
+            await self.checkpointed_agent.aclose()
+
+    async def predict_iter(
+        self,
+        reviews: List[Dict[str, Any]],
+        use_few_shot: bool = False,
+        report: Optional[PredictionReport] = None,
+        use_fused_stage: Optional[bool] = None,
+    ) -> AsyncIterator[BatchResult]:
+        """
+        Обрабатывает список отзывов и отдает результаты батчей по мере готовности.
+
+        Отзыв проходит уровни по порядку, пока один из них не даст ответ:
+        1. Дедупликация (DEDUP_ENABLED): из группы почти одинаковых отзывов
+           дальше идет только первый, его результат копируется остальным.
+        2. Кэш результатов — результат с index=CACHED_BATCH_INDEX.
+        3. Правила (RULES_ENABLED) — index=RULES_BATCH_INDEX.
+        4. Локальный классификатор (DISTILLED_ENABLED) — index=DISTILLED_BATCH_INDEX.
+        5. Агент: батчи выполняются параллельно (не более MAX_CONCURRENT_BATCHES)
+           и отдаются в порядке завершения; потерянные отзывы отправляются
+           повторно, упавший батч делится пополам (см. _run_with_recovery).
+
+        Уровень, ответивший на отзыв, записывается в report.paths. Ошибка батча
+        записывается в report и отдается как BatchResult с заполненным error,
+        отзывы, не обработанные при частичном успехе, — в failed_review_ids.
+
+        Args:
+            reviews: Список словарей отзывов [{'id': 1, 'text': '...'}].
+            use_few_shot: Использовать ли few-shot промпты.
+            report: Необязательный объект для сбора информации о выполнении.
+            use_fused_stage: Определять категории и тональности одним вызовом LLM
+                (None — значение settings.FUSED_CLASSIFICATION).
+
+        Yields:
+            BatchResult для каждого обработанного батча.
+        """
+        if report is None:
+            report = PredictionReport()
+        if use_fused_stage is None:
+            use_fused_stage = settings.FUSED_CLASSIFICATION
+
+        # Почти одинаковые отзывы обрабатываются один раз, результат копируется всей группе
+        members: Dict[Any, List[Any]] = {}
+        if settings.DEDUP_ENABLED and len(reviews) > 1:
+            reviews, members = collapse_duplicates(reviews)
+            collapsed = sum(len(ids) for ids in members.values())
+            report.duplicates_collapsed = collapsed
+            metrics.inc("dedup_reviews_total", len(reviews) + collapsed)
+            metrics.inc("dedup_reviews_collapsed", collapsed)
+            metrics.set_gauge(
+                "dedup_collapse_ratio",
+                metrics.get("dedup_reviews_collapsed") / metrics.get("dedup_reviews_total"),
+            )
+            if collapsed:
+                logger.info(f"Collapsed {collapsed} near-duplicate reviews into {len(members)} groups")
+
+        # Поиск в кэше: агенту уходят только промахи
+        cached: Dict[int, Dict[str, str]] = {}
+        cache_keys: Dict[int, str] = {}
+        pending_reviews = reviews
+        if self.cache is not None:
+            pending_reviews = []
+            keys = [self._cache_key(review, use_few_shot, use_fused_stage) for review in reviews]
+            # SQLite-уровень кэша синхронный, поэтому обращения к нему — вне event loop
+            values = await asyncio.to_thread(self.cache.get_many, keys)
+            for review, key, value in zip(reviews, keys, values):
+                if value is None:
+                    cache_keys[review.get("id")] = key
+                    pending_reviews.append(review)
+                else:
+                    cached[review.get("id")] = value
+        report.cache_hits = len(cached)
+
+        # Тривиальные отзывы классифицируются правилами без вызова агента
+        ruled: Dict[int, Dict[str, str]] = {}
+        if self.rules is not None:
+            ruled, pending_reviews = self.rules.split(pending_reviews)
+        report.rule_hits = len(ruled)
+        # Затем локальный классификатор: агенту уходят отзывы, в ответе на которые он не уверен
+        distilled: Dict[int, Dict[str, str]] = {}
+        if self.distilled is not None:
+            distilled, pending_reviews = self.distilled.split(pending_reviews, self.available_categories)
+        report.distilled_hits = len(distilled)
+        report.paths.update({r_id: PATH_CACHE for r_id in cached})
+        report.paths.update({r_id: PATH_RULES for r_id in ruled})
+        report.paths.update({r_id: PATH_DISTILLED for r_id in distilled})
+        for r_id, member_ids in members.items():
+            if r_id in report.paths:
+                report.paths.update({member_id: report.paths[r_id] for member_id in member_ids})
+
+        batches = self._split_batches(pending_reviews, use_few_shot, use_fused_stage)
+        report.batches_total = len(batches)
+
+        for index, answers in (
+            (CACHED_BATCH_INDEX, cached),
+            (RULES_BATCH_INDEX, ruled),
+            (DISTILLED_BATCH_INDEX, distilled),
+        ):
+            if answers:
+                yield _expand_duplicates(
+                    BatchResult(
+                        index=index,
+                        review_ids=list(answers),
+                        sentiments=[{"id": r_id, "sentiments": sents} for r_id, sents in answers.items()],
+                    ),
+                    members,
+                )
+
+        texts = {review.get("id"): review.get("text", "") for review in pending_reviews}
+        semaphore = asyncio.Semaphore(max(1, settings.MAX_CONCURRENT_BATCHES))
+        tasks = [
+            asyncio.create_task(self._process_batch(index, batch, use_few_shot, use_fused_stage, semaphore))
+            for index, batch in enumerate(batches)
+        ]
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = _expand_duplicates(await next_done, members)
+
+                if result.error is not None:
+                    report.failures.append(
+                        BatchFailure(
+                            batch_index=result.index,
+                            review_ids=result.review_ids,
+                            error=str(result.error),
+                        )
+                    )
+                elif result.failed_review_ids:
+                    report.failures.append(
+                        BatchFailure(
+                            batch_index=result.index,
+                            review_ids=result.failed_review_ids,
+                            error=str(result.partial_error),
+                        )
+                    )
+
+                for item in result.sentiments:
+                    report.paths.setdefault(item.get("id"), PATH_LLM)
+
+                if result.error is None and self.cache is not None:
+                    entries = [
+                        (cache_keys[item.get("id")], item.get("sentiments"), texts.get(item.get("id")))
+                        for item in result.sentiments
+                        if item.get("id") in cache_keys and item.get("sentiments")
+                    ]
+                    await asyncio.to_thread(self.cache.set_many, entries)
+
+                yield result
+        finally:
+            # Если потребитель прекратил чтение, незавершенные батчи отменяются
+            for task in tasks:
+                task.cancel()
 
     async def predict(
-        self, reviews: List[Dict[str, Any]], use_few_shot: bool = False
+        self,
+        reviews: List[Dict[str, Any]],
+        use_few_shot: bool = False,
+        report: Optional[PredictionReport] = None,
+        use_fused_stage: Optional[bool] = None,
     ) -> Tuple[Dict[int, Dict[str, str]], Dict[str, List[Dict[str, Any]]]]:
         """
         Обрабатывает список отзывов, разбивая их на батчи и запуская агент.
 
+        Батчи выполняются параллельно (см. predict_iter), результаты
+        объединяются детерминированно: тональности — в порядке входных
+        отзывов, идеи — в порядке следования батчей. Ошибка отдельного батча
+        не отменяет результаты остальных: она записывается в report,
+        а исключение пробрасывается только если не удалось получить
+        ни одного результата.
+
         Args:
             reviews: Список словарей отзывов [{'id': 1, 'text': '...'}].
             use_few_shot: Использовать ли few-shot промпты.
+            report: Необязательный объект для сбора информации о выполнении.
+            use_fused_stage: Определять категории и тональности одним вызовом LLM
+                (None — значение settings.FUSED_CLASSIFICATION).
 
         Returns:
             Tuple из двух словарей:
             1. reviews_with_sentiments_and_categories: {review_id: {category: sentiment, overall: sentiment}}
             2. ideas: {category_name: [{description: str, source_ids: list[int]}]}
         """
-        all_sentiments_and_categories: Dict[int, Dict[str, str]] = {}
-        all_ideas: Dict[str, List[Dict[str, Any]]] = {}
+        results = [
+            result async for result in self.predict_iter(
+                reviews, use_few_shot, report, use_fused_stage=use_fused_stage
+            )
+        ]
+
+        if results and all(result.error is not None for result in results):
+            raise min(results, key=lambda result: result.index).error
+
+        return merge_batch_results(reviews, results)
+
+
+def _expand_duplicates(result: BatchResult, members: Dict[Any, List[Any]]) -> BatchResult:
+    """Результат батча для всех отзывов групп почти одинаковых отзывов, а не только представителей."""
+    if not members:
+        return result
+    result.review_ids = expand_ids(result.review_ids, members)
+    result.failed_review_ids = expand_ids(result.failed_review_ids, members)
+    result.sentiments = expand_sentiments(result.sentiments, members)
+    result.ideas = expand_ideas(result.ideas, members)
+    return result
+
+
+def merge_batch_results(
+    reviews: List[Dict[str, Any]],
+    results: List[BatchResult],
+) -> Tuple[Dict[int, Dict[str, str]], Dict[str, List[Dict[str, Any]]]]:
+    """
+    Объединяет результаты батчей в формат ответа PredictionService.predict.
+
+    Тональности упорядочиваются по входным отзывам, идеи — по номеру батча.
+    Батчи с ошибкой пропускаются.
+    """
+    all_sentiments_and_categories: Dict[int, Dict[str, str]] = {}
+    all_ideas: Dict[str, List[Dict[str, Any]]] = {}
+    sentiments_by_id: Dict[int, Dict[str, str]] = {}
+
+    for result in sorted(results, key=lambda result: result.index):
+        if result.error is not None:
+            continue
+
+        # 1. Сбор результатов классификации и тональности
+        for item in result.sentiments:
+            r_id = item.get("id")
+            sents = item.get("sentiments")
+            if r_id is not None:
+                sentiments_by_id[r_id] = sents
+
+        # 2. Сбор идей
+        for idea_block in result.ideas:
+            category = idea_block.get("category")
+            ideas_list = idea_block.get("ideas", [])
+
+            if category and ideas_list:
+                if category not in all_ideas:
+                    all_ideas[category] = []
+                all_ideas[category].extend(ideas_list)
+
+    # Порядок ответа совпадает с порядком входных отзывов
+    for review in reviews:
+        r_id = review.get("id")
+        if r_id in sentiments_by_id:
+            all_sentiments_and_categories[r_id] = sentiments_by_id.pop(r_id)
+    all_sentiments_and_categories.update(sentiments_by_id)
+
+    return all_sentiments_and_categories, all_ideas
 
-        batch_size = settings.BATCH_SIZE
-        
-        # Обработка по батчам
-        for i in range(0, len(reviews), batch_size):
-            batch_reviews = reviews[i : i + batch_size]
-            
-            initial_state = {
-                "reviews": batch_reviews,
-                "available_categories": self.available_categories,
-                "categories": [],
-                "sentiments": [],
-                "ideas": [],
-                "use_few_shot": use_few_shot
-            }
-            
-            # Запуск агента (синхронно для каждого батча)
-            final_state = await self.agent.ainvoke(initial_state)
-            
-            # 1. Сбор результатов классификации и тональности
-            batch_sentiments = final_state.get("sentiments", [])
-            
-            for item in batch_sentiments:
-                r_id = item.get("id")
-                sents = item.get("sentiments")
-                if r_id is not None:
-                     all_sentiments_and_categories[r_id] = sents
-
-            # 2. Сбор идей
-            batch_ideas = final_state.get("ideas", [])
-            
-            for idea_block in batch_ideas:
-                category = idea_block.get("category")
-                ideas_list = idea_block.get("ideas", [])
-                
-                if category and ideas_list:
-                    if category not in all_ideas:
-                        all_ideas[category] = []
-                    all_ideas[category].extend(ideas_list)
-
-        return all_sentiments_and_categories, all_ideas
 
 prediction_service = PredictionService()
@@ -0,0 +1,241 @@
+import json
+import logging
+import re
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.metrics import metrics
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+POSITIVE = "положительно"
+NEGATIVE = "отрицательно"
+NEUTRAL = "нейтрально"
+
+# Категория для отзывов без содержания (пустых, благодарностей, эмодзи)
+FALLBACK_CATEGORY = "Прочее"
+
+# Основы слов (совпадение по началу слова) для категорий сервиса
+DEFAULT_KEYWORDS: Dict[str, List[str]] = {
+    "Благоустройство": [
+        "парк", "сквер", "двор", "площадк", "скамейк", "лавочк", "освещени", "фонар",
+        "газон", "клумб", "тротуар", "благоустр", "озеленени",
+    ],
+    "ЖКХ": [
+        "жкх", "мусор", "отоплени", "батаре", "канализац", "подъезд", "лифт", "управляющ",
+        "капремонт", "коммунал", "водопровод", "квартплат", "протечк",
+    ],
+    "Транспорт": [
+        "автобус", "трамва", "троллейбус", "маршрутк", "метро", "электричк", "остановк",
+        "транспорт", "валидатор",
+    ],
+    "Здравоохранение": [
+        "поликлиник", "больниц", "врач", "медицин", "терапевт", "стоматолог", "педиатр",
+        "регистратур", "фельдшер",
+    ],
+    "Образование": [
+        "школ", "детсад", "садик", "учител", "педагог", "образовани", "колледж", "университет",
+    ],
+    "Социальная поддержка": [
+        "пенси", "пособи", "льгот", "соцзащит", "субсиди", "многодетн", "инвалидност",
+    ],
+    "Безопасность": [
+        "полици", "полицей", "преступ", "краж", "хулиган", "видеонаблюдени", "участков",
+    ],
+    "Связь и интернет": [
+        "интернет", "провайдер", "wifi", "роутер", "сотов", "связь", "связи",
+    ],
+    "МФЦ/Госуслуги": [
+        "мфц", "госуслуг", "справк", "паспорт",
+    ],
+}
+
+DEFAULT_POSITIVE = [
+    "спасиб", "благодар", "отличн", "хорош", "молодц", "доволен", "довольн", "нравит",
+    "понравил", "удобн", "вежлив", "прекрасн", "замечательн", "чист", "быстр", "красив",
+    "уютн", "супер",
+]
+
+DEFAULT_NEGATIVE = [
+    "ужасн", "плох", "отвратит", "хам", "груб", "опазд", "слома", "грязн", "воня", "вонь",
+    "невозможн", "безобраз", "кошмар", "жалоб", "проблем", "очеред", "пропада", "протека",
+    "никогда", "игнорир",
+]
+
+# Отрицание меняет тональность следующего слова, без него означает жалобу ("нет воды")
+NEGATIONS = {"не", "нет", "ни", "нельзя"}
+# Противопоставление — признак смешанной тональности, такие отзывы остаются модели
+CONTRASTS = {"но", "однако", "хотя", "зато", "правда"}
+# Слова, из которых может состоять благодарность без предмета: "Спасибо вам большое!"
+THANKS_FILLERS = {
+    "вам", "всем", "тебе", "вас", "большое", "огромное", "очень", "за", "работу", "помощь",
+    "все", "и", "от", "души", "сердечное", "заранее",
+}
+
+POSITIVE_EMOJI = set("👍❤♥😊🙂😀😃😄😁🥰😍👏🙏💐🌹✨☺")
+NEGATIVE_EMOJI = set("👎😡😠🤬😞😢😭💩😤😒🙁☹")
+
+# Слова на любом алфавите: текст без кириллицы тоже не считается пустым
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def _tokens(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("ё", "е")
+    return _WORD_RE.findall(text)
+
+
+def _stem_pattern(stems: Iterable[str]) -> "re.Pattern[str]":
+    """Регулярное выражение, совпадающее с началом слова на любую из основ."""
+    stems = sorted({stem.lower().replace("ё", "е") for stem in stems}, key=len, reverse=True)
+    # Пустой список не совпадает ни с чем
+    return re.compile("|".join(map(re.escape, stems)) or r"(?!)")
+
+
+class RuleClassifier:
+    """
+    Классификация тривиальных отзывов правилами, без вызова LLM.
+
+    Ответ дается только в однозначных случаях:
+    - "empty" — пустой отзыв или только знаки препинания;
+    - "emoji" — только эмодзи одной тональности;
+    - "thanks" — благодарность без предмета ("Спасибо большое!");
+    - "keywords" — короткий отзыв (не длиннее max_words слов), в котором
+      встречаются ключевые слова ровно одной категории и слова одной
+      тональности, без противопоставления ("но", "хотя").
+    Пустые, эмодзи и благодарности относятся к категории "Прочее", если она
+    есть в списке категорий. Остальные отзывы передаются агенту.
+
+    Ключевые слова и словари тональности — основы слов (совпадение по началу
+    слова); их можно заменить JSON-файлом settings.RULES_PATH вида
+    {"keywords": {"Транспорт": ["автобус", ...]}, "positive": [...], "negative": [...]}.
+    """
+
+    def __init__(
+        self,
+        available_categories: List[str],
+        keywords: Optional[Dict[str, List[str]]] = None,
+        positive: Optional[List[str]] = None,
+        negative: Optional[List[str]] = None,
+        max_words: Optional[int] = None,
+    ) -> None:
+        keywords = DEFAULT_KEYWORDS if keywords is None else keywords
+        known = {category.casefold(): category for category in available_categories}
+        # Ключевые слова только для категорий запроса; имя — в том виде, в каком его отдает граф
+        self.keywords = {
+            known[category.casefold()].strip().title(): _stem_pattern(stems)
+            for category, stems in keywords.items()
+            if category.casefold() in known
+        }
+        self.fallback = (
+            known[FALLBACK_CATEGORY.casefold()].strip().title()
+            if FALLBACK_CATEGORY.casefold() in known
+            else None
+        )
+        self.positive = _stem_pattern(DEFAULT_POSITIVE if positive is None else positive)
+        self.negative = _stem_pattern(DEFAULT_NEGATIVE if negative is None else negative)
+        self.thanks = _stem_pattern(("спасиб", "благодар"))
+        self.max_words = settings.RULES_MAX_WORDS if max_words is None else max_words
+
+    @classmethod
+    def from_settings(cls, available_categories: List[str]) -> "RuleClassifier":
+        if not settings.RULES_PATH:
+            return cls(available_categories)
+        data = json.loads(Path(settings.RULES_PATH).read_text(encoding="utf-8"))
+        logger.info(f"Loaded review rules from {settings.RULES_PATH}")
+        return cls(
+            available_categories,
+            keywords=data.get("keywords"),
+            positive=data.get("positive"),
+            negative=data.get("negative"),
+        )
+
+    def _answer(self, category: Optional[str], sentiment: str) -> Optional[Dict[str, str]]:
+        if category is None:
+            return None
+        return {category: sentiment, "overall": sentiment}
+
+    def _emoji(self, text: str) -> Optional[Dict[str, str]]:
+        chars = set(text)
+        positive, negative = bool(chars & POSITIVE_EMOJI), bool(chars & NEGATIVE_EMOJI)
+        if positive and negative:
+            return None
+        if not positive and not negative:
+            return self._answer(self.fallback, NEUTRAL)
+        return self._answer(self.fallback, POSITIVE if positive else NEGATIVE)
+
+    def _sentiment(self, tokens: List[str]) -> Optional[str]:
+        positive = negative = 0
+        negated = False
+        for token in tokens:
+            if token in CONTRASTS:
+                return None
+            if token in NEGATIONS:
+                if negated:
+                    negative += 1
+                negated = True
+                continue
+            is_positive = bool(self.positive.match(token))
+            is_negative = not is_positive and bool(self.negative.match(token))
+            if is_positive or is_negative:
+                if negated:
+                    is_positive, is_negative = is_negative, is_positive
+                positive += is_positive
+                negative += is_negative
+            elif negated:
+                negative += 1
+            negated = False
+        if negated:
+            negative += 1
+        if positive and not negative:
+            return POSITIVE
+        if negative and not positive:
+            return NEGATIVE
+        return None
+
+    def classify(self, text: str) -> Optional[Tuple[Dict[str, str], str]]:
+        """Тональности отзыва {category: sentiment, overall: sentiment} и имя правила или None."""
+        tokens = _tokens(text)
+        if not tokens:
+            if all(c.isspace() or unicodedata.category(c)[0] in "PZ" for c in text or ""):
+                answer = self._answer(self.fallback, NEUTRAL)
+                return (answer, "empty") if answer else None
+            answer = self._emoji(text)
+            return (answer, "emoji") if answer else None
+
+        categories = [
+            category for category, pattern in self.keywords.items()
+            if any(pattern.match(token) for token in tokens)
+        ]
+        if not categories:
+            thanks = [token for token in tokens if token not in THANKS_FILLERS]
+            if thanks and all(self.thanks.match(token) for token in thanks):
+                answer = self._answer(self.fallback, POSITIVE)
+                return (answer, "thanks") if answer else None
+            return None
+
+        if len(categories) != 1 or len(tokens) > self.max_words:
+            return None
+        sentiment = self._sentiment(tokens)
+        if sentiment is None:
+            return None
+        return self._answer(categories[0], sentiment), "keywords"
+
+    def split(
+        self, reviews: List[Dict[str, Any]]
+    ) -> Tuple[Dict[Any, Dict[str, str]], List[Dict[str, Any]]]:
+        """Ответы правил {review_id: тональности} и отзывы, которые остаются агенту."""
+        answered: Dict[Any, Dict[str, str]] = {}
+        remaining = []
+        for review in reviews:
+            result = self.classify(review.get("text", ""))
+            if result is None:
+                remaining.append(review)
+                continue
+            answer, rule = result
+            answered[review.get("id")] = answer
+            metrics.inc(f"rules_hits_{rule}")
+        metrics.inc("rules_reviews_total", len(reviews))
+        metrics.inc("rules_hits", len(answered))
+        return answered, remaining
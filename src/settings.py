@@ -1,4 +1,6 @@
 
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,8 +13,130 @@ class Settings(BaseSettings):
     LLM_NAME: str = "qwen/qwen3-235b-a22b:free"
     OPENROUTER_API_KEY: str
     BASE_URL: str = "https://openrouter.ai/api/v1"
+    # Несколько бэкендов с одной моделью через запятую, вес через "|": "http://a:8080/v1|2, http://b:8080/v1"
+    LLM_BACKENDS: str = ""
+    LLM_ROUTING: str = "least_loaded"  # "least_loaded" или "round_robin"
+    LLM_HEALTH_CHECK_INTERVAL: float = 10.0  # Секунды, 0 — без фоновых проверок
+    # Дублирующий вызов, если ответ дольше перцентиля LLM_HEDGE_PERCENTILE недавних вызовов
+    LLM_HEDGING: bool = False
+    LLM_HEDGE_PERCENTILE: float = 95.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    # Автомат отключения бэкенда после N временных ошибок подряд (0 — выключен)
+    LLM_BREAKER_FAILURES: int = 0
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    # Потоковая генерация: ответ читается по частям, генерация прерывается, как только закрыт JSON
+    LLM_STREAMING: bool = False
+    # Предел длины ответа при потоковой генерации: OUTPUT_TOKENS_PER_REVIEW * отзывов * запас (0 — без предела)
+    LLM_OUTPUT_MARGIN: float = 2.0
+    # Модель и параметры генерации по этапам графа: пусто — LLM_NAME и BASE_URL/LLM_BACKENDS,
+    # MAX_TOKENS 0 — без ограничения, REASONING не задан — как по умолчанию у модели.
+    # Объединенный этап категорий и тональностей использует настройки этапа категорий
+    LLM_CATEGORY_NAME: str = ""
+    LLM_CATEGORY_BASE_URL: str = ""
+    LLM_CATEGORY_MAX_TOKENS: int = 0
+    LLM_CATEGORY_REASONING: Optional[bool] = None
+    LLM_SENTIMENT_NAME: str = ""
+    LLM_SENTIMENT_BASE_URL: str = ""
+    LLM_SENTIMENT_MAX_TOKENS: int = 0
+    LLM_SENTIMENT_REASONING: Optional[bool] = None
+    LLM_IDEAS_NAME: str = ""
+    LLM_IDEAS_BASE_URL: str = ""
+    LLM_IDEAS_MAX_TOKENS: int = 0
+    LLM_IDEAS_REASONING: Optional[bool] = None
+    # Адаптивный лимит одновременных вызовов LLM (AIMD по задержке и ошибкам бэкенда)
+    LLM_ADAPTIVE_CONCURRENCY: bool = False
+    LLM_CONCURRENCY_INITIAL: int = 4
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 64  # Также не больше суммы слотов из GET /slots у llama.cpp
+    LLM_CONCURRENCY_TOLERANCE: float = 2.0  # Во сколько раз задержка может превысить базовую
+    LLM_CONCURRENCY_BACKOFF: float = 0.75  # Множитель лимита при перегрузке
+    # Передавать cache_prompt серверу llama.cpp для переиспользования префикса промпта
+    LLM_CACHE_PROMPT: bool = False
+    # Ограничивать ответы модели JSON-схемой (response_format) на каждом этапе графа
+    LLM_JSON_SCHEMA: bool = False
+    # Компактная запись отзывов в промпте: короткие локальные id (1..n) вместо id из базы,
+    # одна строка на отзыв без разделителей и заголовков
+    PROMPT_COMPACT: bool = False
+    # Метрики токенов промптов и ответов по этапам графа (llm_*_tokens_<этап>)
+    LLM_TOKEN_METRICS: bool = False
+    # Кодировка tiktoken для подсчета токенов, если сервер не вернул usage
+    TOKENIZER_ENCODING: str = "o200k_base"
+
+    # HTTP-соединения с LLM: общий пул и таймауты (секунды)
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_HTTP2: bool = False  # Требует пакет h2
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_READ_TIMEOUT: float = 120.0
+    LLM_POOL_TIMEOUT: float = 30.0  # Ожидание свободного соединения из пула
+    LLM_CALL_TIMEOUT: float = 300.0  # Общий предел одного вызова LLM, 0 — без ограничения
+
+    # Клиентский лимит обращений к LLM (0 — без ограничения); бесплатный тариф OpenRouter — 20 запросов в минуту
+    LLM_REQUESTS_PER_MINUTE: int = 0
+    LLM_TOKENS_PER_MINUTE: int = 0
 
     BATCH_SIZE: int = 10
+    # Сколько батчей одного запроса отправлять в LLM одновременно (1 — последовательно)
+    MAX_CONCURRENT_BATCHES: int = 1
+    # Способ разбиения на батчи: "fixed" — по BATCH_SIZE отзывов, "tokens" — по бюджету контекста
+    BATCH_PACKING: str = "fixed"
+    LLM_CONTEXT_TOKENS: int = 4096  # Размер контекста модели (--ctx-size у llama.cpp)
+    CHARS_PER_TOKEN: float = 3.0  # Среднее число символов на токен для оценки длины
+    OUTPUT_TOKENS_PER_REVIEW: int = 80  # Ожидаемый размер ответа модели на один отзыв
+
+    # Этапы графа продолжают один диалог с моделью: текст отзывов передается только в первом сообщении
+    STAGE_SESSION: bool = False
+    # Категории и тональности одним вызовом LLM вместо двух (можно переопределить в запросе)
+    FUSED_CLASSIFICATION: bool = False
+    # Каскад моделей: сначала быстрая модель, основной — только отзывы, не прошедшие проверку
+    CASCADE_ENABLED: bool = False
+    LLM_SMALL_NAME: str = "qwen/qwen3-8b:free"
+    LLM_SMALL_BASE_URL: str = ""  # Пусто — BASE_URL
+    # Второй прогон быстрой модели с температурой; расхождение ответов — повод для эскалации
+    CASCADE_AGREEMENT: bool = True
+    CASCADE_SAMPLE_TEMPERATURE: float = 0.7
+    # Повторная отправка потерянных в ответе отзывов и деление упавшего батча пополам
+    BATCH_RECOVERY: bool = True
+
+    # Чекпоинты графа после каждого узла: "none", "memory" или "sqlite"
+    CHECKPOINT_BACKEND: str = "none"
+    CHECKPOINT_SQLITE_PATH: str = "data/checkpoints.sqlite"
+    # Сколько раз продолжать упавший батч с последнего завершенного узла
+    CHECKPOINT_RESUME_ATTEMPTS: int = 1
+
+    # Объединение отзывов из параллельных запросов в общие батчи
+    MICRO_BATCH_ENABLED: bool = False
+    MICRO_BATCH_MAX_DELAY_MS: int = 50
+
+    # Фоновые задачи (/api/v1/jobs)
+    JOB_WORKERS: int = 2
+    JOB_RETENTION_SECONDS: int = 3600
+
+    # Кэш результатов классификации отзывов
+    CACHE_ENABLED: bool = False
+    CACHE_MAX_SIZE: int = 10000
+    CACHE_TTL_SECONDS: float = 7 * 24 * 3600  # 0 — без ограничения
+    CACHE_SQLITE_PATH: Optional[str] = None  # Путь к SQLite файлу для дискового уровня
+    CACHE_SQLITE_MAX_SIZE: int = 1_000_000  # 0 — без ограничения
+
+    # Правила для тривиальных отзывов (пустые, благодарности, эмодзи, явные ключевые слова) без LLM
+    RULES_ENABLED: bool = False
+    RULES_PATH: Optional[str] = None  # JSON со словарями ключевых слов и тональностей вместо встроенных
+    RULES_MAX_WORDS: int = 15  # Отзывы длиннее по ключевым словам не классифицируются
+
+    # Локальный классификатор (TF-IDF + логистическая регрессия), обученный на ответах LLM из
+    # кэша (python train_classifier.py); LLM получает только отзывы с вероятностью ниже порога
+    DISTILLED_ENABLED: bool = False
+    DISTILLED_MODEL_PATH: str = "data/distilled.joblib"
+    DISTILLED_THRESHOLD: float = 0.9
+
+    # Схлопывание почти одинаковых отзывов запроса: агенту уходит один отзыв группы,
+    # его результат копируется остальным (сходство Жаккара символьных шинглов не ниже порога)
+    DEDUP_ENABLED: bool = False
+    DEDUP_THRESHOLD: float = 0.85
+    DEDUP_SHINGLE_SIZE: int = 5  # Длина шингла в символах
+    DEDUP_NUM_PERM: int = 64  # Длина MinHash-сигнатуры
 
     model_config = SettingsConfigDict(
         env_file=".env",
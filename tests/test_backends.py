@@ -0,0 +1,181 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.agent.backends import Backend, BackendPool, parse_backends
+
+
+class FakeClient:
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise httpx.ConnectError("connection refused")
+        return self.name
+
+
+def _pool(*clients, routing="least_loaded", weights=None):
+    weights = weights or [1] * len(clients)
+    backends = [
+        Backend(url=f"http://{client.name}:8080/v1", client=client, weight=weight)
+        for client, weight in zip(clients, weights)
+    ]
+    return BackendPool(backends, routing=routing, health_check_interval=0)
+
+
+async def _call(pool, prompt="hi"):
+    async with pool.acquire() as backend:
+        return await backend.client.ainvoke(prompt)
+
+
+def test_parse_backends():
+    assert parse_backends("http://a/v1, http://b/v1|3,") == [("http://a/v1", 1), ("http://b/v1", 3)]
+
+
+@pytest.mark.asyncio
+async def test_least_loaded_spreads_concurrent_calls():
+    pool = _pool(FakeClient("a"), FakeClient("b"), FakeClient("c"))
+
+    results = await asyncio.gather(*(_call(pool) for _ in range(6)))
+
+    assert sorted(results) == ["a", "a", "b", "b", "c", "c"]
+    assert all(backend.in_flight == 0 for backend in pool.backends)
+
+
+def test_weighted_round_robin():
+    pool = _pool(FakeClient("a"), FakeClient("b"), routing="round_robin", weights=[2, 1])
+
+    chosen = [pool.select().client.name for _ in range(6)]
+
+    assert chosen.count("a") == 4 and chosen.count("b") == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_backend_taken_out_of_rotation_until_health_check(monkeypatch):
+    pool = _pool(FakeClient("a", fail=True), FakeClient("b"))
+
+    with pytest.raises(httpx.ConnectError):
+        await _call(pool)
+    assert not pool.backends[0].healthy
+    assert [await _call(pool) for _ in range(3)] == ["b", "b", "b"]
+
+    async def healthy(backend):
+        return True
+
+    monkeypatch.setattr(pool, "check", healthy)
+    await pool.check_all()
+    assert pool.backends[0].healthy
+
+
+
+@pytest.mark.asyncio
+async def test_health_and_slots_probes_use_short_timeout(monkeypatch):
+    from src.agent import backends
+
+    timeouts = []
+
+    class ProbeClient:
+        async def get(self, url, timeout=None):
+            timeouts.append((url.rsplit("/", 1)[-1], timeout))
+            return httpx.Response(200, json=[{}, {}])
+
+    monkeypatch.setattr(backends, "get_http_client", lambda: ProbeClient())
+    pool = BackendPool(
+        [Backend(url="http://a:8080/v1", client=FakeClient("a"))], health_check_interval=2
+    )
+
+    assert await pool.check(pool.backends[0])
+    assert await pool.capacity() == 2
+    # Таймаут пробы не длиннее интервала проверок
+    assert timeouts == [("health", 2), ("slots", 2)]
+
+
+class SlowClient(FakeClient):
+    def __init__(self, name, delay):
+        super().__init__(name)
+        self.delay = delay
+        self.cancelled = False
+
+    async def ainvoke(self, prompt):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.name
+
+
+@pytest.mark.asyncio
+async def test_hedged_call_returns_first_answer_and_cancels_slow_one(monkeypatch):
+    from src.agent.utils import LLM
+    from src.metrics import metrics
+    from src.settings import settings
+
+    monkeypatch.setattr(settings, "LLM_HEDGING", True)
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 0)
+    llm = LLM(backends=["http://slow:8080/v1", "http://fast:8080/v1"])
+    slow, fast = SlowClient("slow", delay=1.0), SlowClient("fast", delay=0.01)
+    llm.pool.backends[0].client, llm.pool.backends[1].client = slow, fast
+    for _ in range(20):
+        llm.latency.record(0.02)
+    llm.pool._next_index = 0  # основной вызов уходит на медленный бэкенд
+    hedged_before = metrics.get("llm_hedged_calls")
+
+    assert await llm.ainvoke("hi") == "fast"
+    assert slow.cancelled
+    assert metrics.get("llm_hedged_calls") == hedged_before + 1
+    assert all(backend.in_flight == 0 for backend in llm.pool.backends)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_recovers():
+    from src.agent.resilience import CircuitBreaker, CircuitOpenError
+
+    client = FakeClient("a", fail=True)
+    pool = _pool(client)
+    pool.backends[0].breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            await _call(pool)
+    with pytest.raises(CircuitOpenError):
+        await _call(pool)
+
+    await asyncio.sleep(0.06)
+    client.fail = False
+    assert await _call(pool) == "a"
+    assert pool.backends[0].breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_trial_resolves_on_request_error_and_timeout(monkeypatch):
+    from src.agent.resilience import CircuitBreaker
+    from src.agent.utils import LLM
+    from src.settings import settings
+
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(settings, "LLM_CALL_TIMEOUT", 0.05)
+    llm = LLM(backends=["http://a:8080/v1"])
+    breaker = llm.pool.backends[0].breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+
+    # Зависший бэкенд: таймаут вызова открывает цепь
+    llm.pool.backends[0].client = SlowClient("a", delay=1.0)
+    with pytest.raises(asyncio.TimeoutError):
+        await llm._call_pool(None, [], "hi")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Пробный вызов с ошибкой запроса не оставляет цепь полуоткрытой навсегда
+    await asyncio.sleep(0.02)
+
+    class BadRequestClient(FakeClient):
+        async def ainvoke(self, prompt):
+            raise ValueError("400 bad request")
+
+    llm.pool.backends[0].client = BadRequestClient("a")
+    with pytest.raises(ValueError):
+        await llm._call_pool(None, [], "hi")
+    assert breaker.is_available()
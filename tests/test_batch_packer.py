@@ -0,0 +1,66 @@
+import pytest
+
+from src.services.batch_packer import pack_batches, prompt_overhead_tokens, review_overhead_tokens
+from src.settings import settings
+
+CATEGORIES = ["Благоустройство", "ЖКХ", "Транспорт", "Прочее"]
+
+
+def _free_budget(context_tokens):
+    return context_tokens - prompt_overhead_tokens(False, CATEGORIES)
+
+
+def test_pack_batches_fills_context_with_short_reviews():
+    reviews = [{"id": i, "text": "Спасибо!"} for i in range(40)]
+    per_review = review_overhead_tokens() + settings.OUTPUT_TOKENS_PER_REVIEW + 3
+    context = prompt_overhead_tokens(False, CATEGORIES) + per_review * 15
+
+    batches = pack_batches(reviews, False, CATEGORIES, context_tokens=context)
+
+    assert [len(batch) for batch in batches] == [15, 15, 10]
+    assert [r["id"] for batch in batches for r in batch] == list(range(40))
+
+
+def test_pack_batches_respects_budget_for_long_reviews():
+    context = 4096
+    long_text = "а" * 3000
+    reviews = [{"id": i, "text": long_text} for i in range(6)]
+
+    batches = pack_batches(reviews, False, CATEGORIES, context_tokens=context)
+
+    per_review = review_overhead_tokens() + settings.OUTPUT_TOKENS_PER_REVIEW
+    review_cost = int(len(long_text) / settings.CHARS_PER_TOKEN) + 1 + per_review
+    max_per_batch = _free_budget(context) // review_cost
+    assert all(len(batch) <= max_per_batch for batch in batches)
+    assert sum(len(batch) for batch in batches) == 6
+
+
+def test_pack_batches_truncates_oversized_review_into_own_batch():
+    context = 4096
+    reviews = [
+        {"id": 1, "text": "Короткий отзыв"},
+        {"id": 2, "text": "я" * 50_000},
+        {"id": 3, "text": "Еще один короткий"},
+    ]
+
+    batches = pack_batches(reviews, False, CATEGORIES, context_tokens=context)
+
+    oversized = [batch for batch in batches if any(r["id"] == 2 for r in batch)]
+    assert len(oversized) == 1 and len(oversized[0]) == 1
+    assert len(oversized[0][0]["text"]) < 50_000
+    assert len(reviews[1]["text"]) == 50_000  # исходный отзыв не изменяется
+
+
+def test_pack_batches_rejects_too_small_context():
+    with pytest.raises(ValueError):
+        pack_batches([{"id": 1, "text": "x"}], True, CATEGORIES, context_tokens=100)
+
+
+def test_session_budget_includes_whole_dialogue():
+    reviews = [{"id": i, "text": "Автобус опаздывает каждый день"} for i in range(40)]
+
+    separate = pack_batches(reviews, False, CATEGORIES, context_tokens=4096)
+    session = pack_batches(reviews, False, CATEGORIES, context_tokens=4096, use_session=True)
+
+    assert prompt_overhead_tokens(False, CATEGORIES, use_session=True) > prompt_overhead_tokens(False, CATEGORIES)
+    assert len(session) > len(separate)
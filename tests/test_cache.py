@@ -0,0 +1,107 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.cache import ResultCache
+from src.services.prediction_service import PredictionReport, PredictionService
+
+
+def test_cache_key_normalizes_text():
+    categories = ["ЖКХ", "Транспорт"]
+    key_a = ResultCache.make_key("  Автобус   опаздывает ", "model", False, categories)
+    key_b = ResultCache.make_key("автобус опаздывает", "model", False, categories)
+
+    assert key_a == key_b
+    assert key_a != ResultCache.make_key("автобус опаздывает", "other-model", False, categories)
+    assert key_a != ResultCache.make_key("автобус опаздывает", "model", True, categories)
+    assert key_a != ResultCache.make_key("автобус опаздывает", "model", False, ["ЖКХ"])
+
+
+def test_cache_lru_eviction_and_counters():
+    cache = ResultCache(max_size=2)
+    cache.set("a", {"overall": "нейтрально"})
+    cache.set("b", {"overall": "нейтрально"})
+    assert cache.get("a") is not None  # "a" становится самым свежим
+    cache.set("c", {"overall": "нейтрально"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_ttl(monkeypatch):
+    import src.services.cache as cache_module
+
+    now = 1000.0
+    monkeypatch.setattr(cache_module.time, "time", lambda: now)
+    cache = ResultCache(ttl_seconds=10)
+    cache.set("a", {"overall": "положительно"})
+
+    now = 1005.0
+    assert cache.get("a") == {"overall": "положительно"}
+    now = 1011.0
+    assert cache.get("a") is None
+
+
+def test_cache_sqlite_tier(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = ResultCache(sqlite_path=str(path))
+    cache.set("a", {"Транспорт": "отрицательно", "overall": "отрицательно"}, text="автобус")
+    cache.close()
+
+    reopened = ResultCache(sqlite_path=str(path))
+    assert reopened.get("a") == {"Транспорт": "отрицательно", "overall": "отрицательно"}
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_predict_sends_only_cache_misses_to_agent():
+    async def mock_ainvoke(state):
+        return {
+            "sentiments": [
+                {"id": r["id"], "sentiments": {"Транспорт": "отрицательно", "overall": "отрицательно"}}
+                for r in state["reviews"]
+            ],
+            "ideas": [],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent, cache=ResultCache())
+
+    await service.predict([{"id": 1, "text": "Автобус опаздывает"}])
+
+    report = PredictionReport()
+    reviews_map, _ = await service.predict(
+        [{"id": 7, "text": "автобус  опаздывает"}, {"id": 8, "text": "Нет света"}],
+        report=report,
+    )
+
+    assert report.cache_hits == 1
+    assert list(reviews_map.keys()) == [7, 8]
+    assert reviews_map[7]["Транспорт"] == "отрицательно"
+    second_call_state = mock_agent.ainvoke.call_args_list[1].args[0]
+    assert [r["id"] for r in second_call_state["reviews"]] == [8]
+
+
+def test_cache_key_depends_on_graph_modes():
+    key = ResultCache.make_key("автобус опаздывает", "model", False, ["Транспорт"])
+
+    assert key != ResultCache.make_key("автобус опаздывает", "model", False, ["Транспорт"], prompt_compact=True)
+    assert key != ResultCache.make_key("автобус опаздывает", "model", False, ["Транспорт"], stage_session=True)
+    assert key != ResultCache.make_key("автобус опаздывает", "model", False, ["Транспорт"], cascade="small=m")
+
+
+def test_cache_sqlite_evicts_oldest_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(ResultCache, "EVICT_EVERY", 5)
+    cache = ResultCache(max_size=100, sqlite_path=str(tmp_path / "cache.sqlite"), sqlite_max_size=3)
+    for i in range(4):
+        cache.set(f"k{i}", {"overall": "нейтрально"})
+    # До EVICT_EVERY вставок записи не удаляются
+    assert cache._db.execute("SELECT COUNT(*) FROM review_cache").fetchone() == (4,)
+
+    cache.set_many([(f"k{i}", {"overall": "нейтрально"}, None) for i in range(4, 6)])
+    keys = {key for (key,) in cache._db.execute("SELECT key FROM review_cache")}
+    assert len(keys) == 3
+    cache.close()
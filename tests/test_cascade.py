@@ -0,0 +1,147 @@
+import pytest
+
+from src.metrics import metrics
+from src.services.cascade import CascadeAgent
+
+CATEGORIES = ["Транспорт", "Благоустройство", "Прочее"]
+
+
+class TieredAgent:
+    """Отвечает по-разному в зависимости от уровня модели в состоянии."""
+
+    def __init__(self, answers):
+        # answers: уровень -> {id отзыва: тональности}
+        self.answers = answers
+        self.states = []
+
+    async def ainvoke(self, state):
+        self.states.append(state)
+        tier = state.get("llm_tier", "default")
+        answers = self.answers[tier]
+        reviews = [review for review in state["reviews"] if review["id"] in answers]
+        ideas = [] if state.get("skip_ideas") else [
+            {"category": "Транспорт", "ideas": [
+                {"description": f"{tier} idea", "source_ids": [review["id"] for review in reviews]}
+            ]}
+        ]
+        return {
+            **state,
+            "reviews": reviews,
+            "categories": [[c for c in answers[r["id"]] if c != "overall"] for r in reviews],
+            "sentiments": [{"id": r["id"], "sentiments": answers[r["id"]]} for r in reviews],
+            "ideas": ideas,
+        }
+
+
+def _state():
+    return {
+        "reviews": [{"id": 1, "text": "Автобус опаздывает"}, {"id": 2, "text": "Странный отзыв"},
+                    {"id": 3, "text": "Парк стал чистым"}],
+        "available_categories": CATEGORIES,
+        "categories": [],
+        "sentiments": [],
+        "ideas": [],
+        "use_few_shot": False,
+        "use_fused_stage": False,
+    }
+
+
+@pytest.mark.asyncio
+async def test_only_uncertain_reviews_are_escalated():
+    metrics.reset()
+    small = {
+        1: {"Транспорт": "отрицательно", "overall": "отрицательно"},
+        2: {"Погода": "нейтрально", "overall": "нейтрально"},  # неизвестная категория
+        3: {"Благоустройство": "положительно", "overall": "положительно"},
+    }
+    sample = {**small, 3: {"Благоустройство": "нейтрально", "overall": "нейтрально"}}
+    large = {
+        2: {"Прочее": "нейтрально", "overall": "нейтрально"},
+        3: {"Благоустройство": "положительно", "overall": "положительно"},
+    }
+    agent = TieredAgent({"small": small, "small_sample": sample, "default": large})
+
+    result = await CascadeAgent(agent, agreement=True).ainvoke(_state())
+
+    escalated_call = agent.states[-1]
+    assert escalated_call.get("llm_tier", "default") == "default"
+    assert [review["id"] for review in escalated_call["reviews"]] == [2, 3]
+    assert [item["id"] for item in result["sentiments"]] == [1, 2, 3]
+    assert result["sentiments"][1]["sentiments"] == large[2]
+    assert result["categories"] == [["Транспорт"], ["Прочее"], ["Благоустройство"]]
+    assert [idea["source_ids"] for block in result["ideas"] for idea in block["ideas"]] == [[1], [2, 3]]
+    assert metrics.get("cascade_reviews_escalated") == 2
+    assert metrics.get("cascade_escalated_ratio") == pytest.approx(2 / 3)
+
+
+@pytest.mark.asyncio
+async def test_confident_batch_stays_on_small_model():
+    answers = {
+        1: {"Транспорт": "отрицательно", "overall": "отрицательно"},
+        2: {"Прочее": "нейтрально", "overall": "нейтрально"},
+        3: {"Благоустройство": "положительно", "overall": "положительно"},
+    }
+    agent = TieredAgent({"small": answers, "small_sample": answers, "default": {}})
+
+    result = await CascadeAgent(agent, agreement=True).ainvoke(_state())
+
+    assert [state["llm_tier"] for state in agent.states] == ["small", "small_sample"]
+    assert agent.states[1]["skip_ideas"] is True
+    assert [item["id"] for item in result["sentiments"]] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_small_model_failure_escalates_whole_batch():
+    class FailingSmall(TieredAgent):
+        async def ainvoke(self, state):
+            if state.get("llm_tier") == "small":
+                raise ValueError("JSON Decode Error")
+            return await super().ainvoke(state)
+
+    answers = {i: {"Прочее": "нейтрально", "overall": "нейтрально"} for i in (1, 2, 3)}
+    agent = FailingSmall({"default": answers})
+
+    result = await CascadeAgent(agent, agreement=False).ainvoke(_state())
+
+    assert [review["id"] for review in agent.states[-1]["reviews"]] == [1, 2, 3]
+    assert [item["id"] for item in result["sentiments"]] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_repaired_sentiment_is_escalated():
+    class RepairingAgent(TieredAgent):
+        async def ainvoke(self, state):
+            result = await super().ainvoke(state)
+            if state.get("llm_tier") == "small":
+                # Недопустимая тональность в сыром ответе, замененная парсером на нейтральную
+                result["sentiments"][0]["repaired"] = True
+            return result
+
+    answers = {i: {"Прочее": "нейтрально", "overall": "нейтрально"} for i in (1, 2, 3)}
+    agent = RepairingAgent({"small": answers, "default": answers})
+
+    await CascadeAgent(agent, agreement=False).ainvoke(_state())
+
+    assert [review["id"] for review in agent.states[-1]["reviews"]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_large_model_failure_keeps_small_model_answers():
+    class FailingLarge(TieredAgent):
+        async def ainvoke(self, state):
+            if state.get("llm_tier", "default") == "default":
+                raise ValueError("Service Unavailable")
+            return await super().ainvoke(state)
+
+    small = {
+        1: {"Транспорт": "отрицательно", "overall": "отрицательно"},
+        2: {"Погода": "нейтрально", "overall": "нейтрально"},
+        3: {"Благоустройство": "положительно", "overall": "положительно"},
+    }
+    agent = FailingLarge({"small": small})
+
+    result = await CascadeAgent(agent, agreement=False).ainvoke(_state())
+
+    # Эскалированный отзыв 2 не попадает в ответ: его отправит повторно PredictionService
+    assert [item["id"] for item in result["sentiments"]] == [1, 3]
+    assert [review["id"] for review in result["reviews"]] == [1, 3]
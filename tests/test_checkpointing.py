@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.agent import graph
+from src.services.checkpointing import CheckpointedAgent
+
+
+class FlakyIdeasLLM:
+    """Отвечает заготовленным JSON; первые fail_ideas вызовов этапа идей падают."""
+
+    def __init__(self, fail_ideas=1, hang_ideas=False):
+        self.fail_ideas = fail_ideas
+        self.hang_ideas = hang_ideas
+        self.stages = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        text = "\n".join(m.content for m in prompt)
+        await asyncio.sleep(0)
+        if "ideas_by_category" in text:
+            self.stages.append("ideas")
+            if self.hang_ideas:
+                await asyncio.sleep(10)
+            if self.fail_ideas > 0:
+                self.fail_ideas -= 1
+                raise ValueError("Ideas parsing error")
+            payload = {"ideas_by_category": [
+                {"category": "Транспорт", "items": [{"description": "Больше автобусов", "source_ids": [1]}]}
+            ]}
+        elif "reviews_with_categories" in text:
+            self.stages.append("sentiments")
+            payload = {"reviews": [
+                {"review_id": 1, "sentiments": {"Транспорт": "отрицательно"}, "overall": "отрицательно"}
+            ]}
+        else:
+            self.stages.append("categories")
+            payload = {"reviews": [{"review_id": 1, "categories": ["Транспорт"]}]}
+        return AIMessage(content=json.dumps(payload, ensure_ascii=False))
+
+
+def _state():
+    return {
+        "reviews": [{"id": 1, "text": "Автобус опаздывает"}],
+        "available_categories": ["Транспорт", "Прочее"],
+        "categories": [],
+        "sentiments": [],
+        "ideas": [],
+        "use_few_shot": False,
+        "use_fused_stage": False,
+    }
+
+
+@pytest.mark.asyncio
+async def test_exhausted_batch_checkpoints_are_deleted(monkeypatch):
+    fake = FlakyIdeasLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    agent = CheckpointedAgent(backend="memory", resume_attempts=0)
+
+    with pytest.raises(ValueError):
+        await agent.ainvoke(_state())
+
+    assert not agent._checkpointer.storage
+    final_state = await agent.ainvoke(_state())
+    assert fake.stages == ["categories", "sentiments", "ideas"] * 2
+    assert final_state["ideas"][0]["category"] == "Транспорт"
+    assert not agent._checkpointer.storage
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_batches_do_not_share_thread(monkeypatch):
+    fake = FlakyIdeasLLM(fail_ideas=0)
+    monkeypatch.setattr(graph, "llm_client", fake)
+    agent = CheckpointedAgent(backend="memory")
+
+    results = await asyncio.gather(agent.ainvoke(_state()), agent.ainvoke(_state()))
+
+    assert len(fake.stages) == 6
+    assert all(result["ideas"][0]["category"] == "Транспорт" for result in results)
+    assert not agent._locks
+
+
+@pytest.mark.asyncio
+async def test_resume_attempts_retry_only_failed_node(monkeypatch):
+    fake = FlakyIdeasLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    agent = CheckpointedAgent(backend="memory", resume_attempts=1)
+
+    final_state = await agent.ainvoke(_state())
+
+    assert fake.stages == ["categories", "sentiments", "ideas", "ideas"]
+    assert final_state["sentiments"][0]["id"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sqlite_checkpoints_survive_restart(monkeypatch, tmp_path):
+    fake = FlakyIdeasLLM(fail_ideas=0, hang_ideas=True)
+    monkeypatch.setattr(graph, "llm_client", fake)
+    path = str(tmp_path / "checkpoints.sqlite")
+
+    # Остановка сервиса посреди этапа идей
+    agent = CheckpointedAgent(backend="sqlite", sqlite_path=path, resume_attempts=0)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(agent.ainvoke(_state()), timeout=0.2)
+    await agent.aclose()
+    fake.hang_ideas = False
+
+    restarted = CheckpointedAgent(backend="sqlite", sqlite_path=path, resume_attempts=0)
+    final_state = await restarted.ainvoke(_state())
+    await restarted.aclose()
+
+    assert fake.stages == ["categories", "sentiments", "ideas", "ideas"]
+    assert final_state["ideas"][0]["ideas"][0]["source_ids"] == [1]
@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from src.agent.concurrency import AdaptiveConcurrencyLimiter
+from src.metrics import metrics
+
+
+def _rate_limit_error():
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    response = httpx.Response(429, request=request)
+    return openai.RateLimitError("Rate limit exceeded", response=response, body=None)
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_while_latency_stays_flat():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=8)
+
+    for _ in range(20):
+        # Нагрузка все время упирается в лимит
+        taken = int(limiter.limit)
+        for _ in range(taken):
+            await limiter.acquire()
+        for _ in range(taken):
+            limiter.release(latency=0.1)
+
+    assert limiter.limit >= 4
+    assert metrics.get("llm_concurrency_limit") == int(limiter.limit)
+
+
+@pytest.mark.asyncio
+async def test_limit_backs_off_on_rate_limit_and_latency():
+    limiter = AdaptiveConcurrencyLimiter(initial=8, min_limit=1, max_limit=8)
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, error=_rate_limit_error())
+    assert limiter.limit == 6
+
+    # Повторное снижение в пределах одного вызова не применяется
+    await limiter.acquire()
+    limiter.release(latency=1.0, error=_rate_limit_error())
+    assert limiter.limit == 6
+
+    limiter = AdaptiveConcurrencyLimiter(initial=6, min_limit=1, max_limit=8)
+    await limiter.acquire()
+    limiter.release(latency=0.1)
+    await limiter.acquire()
+    limiter.release(latency=1.0)
+    assert limiter.limit == 4.5
+
+    # Ошибки разбора ответа не говорят о перегрузке бэкенда
+    await limiter.acquire()
+    limiter.release(latency=0.0, error=ValueError("JSON Decode Error"))
+    assert limiter.limit == 4.5
+
+
+@pytest.mark.asyncio
+async def test_calls_wait_for_free_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial=2, min_limit=1, max_limit=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_backend_slots_cap_the_limit():
+    async def probe():
+        return 3
+
+    limiter = AdaptiveConcurrencyLimiter(initial=20, max_limit=64, capacity_probe=probe)
+
+    await limiter.acquire()
+    limiter.release(latency=0.1)
+
+    assert limiter.capacity == 3
+    assert limiter.limit <= 6
+
+
+@pytest.mark.asyncio
+async def test_call_timeout_and_slow_cancellation_back_off():
+    limiter = AdaptiveConcurrencyLimiter(initial=8, min_limit=1, max_limit=8)
+    await limiter.acquire()
+    limiter.release(latency=0.01)
+
+    # Таймаут вызова (LLM_CALL_TIMEOUT) — признак перегрузки
+    with pytest.raises(asyncio.TimeoutError):
+        async with limiter.slot():
+            await asyncio.wait_for(asyncio.sleep(1), timeout=0.05)
+    assert limiter.limit == 6
+
+    # Отмена вызова, который уже шел дольше допустимого, тоже снижает лимит
+    async def slow_call():
+        async with limiter.slot():
+            await asyncio.sleep(1)
+
+    task = asyncio.create_task(slow_call())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert limiter.limit == 4.5
+
+    # Быстрый отмененный вызов (проигравший hedged-вызов) лимит не меняет
+    limiter._latencies.clear()
+    limiter._latencies.append(1.0)
+    task = asyncio.create_task(slow_call())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert limiter.limit == 4.5
+    assert limiter.in_flight == 0
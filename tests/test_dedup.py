@@ -0,0 +1,70 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.services.dedup import collapse_duplicates
+from src.services.prediction_service import PredictionReport, PredictionService
+from src.settings import settings
+
+CAMPAIGN = (
+    "Требуем срочно отремонтировать дорогу на улице Садовой, ямы уже полгода, "
+    "машины ломаются, дети ходят по проезжей части. Житель дома {n}."
+)
+
+
+def test_collapse_near_duplicates():
+    reviews = [
+        {"id": 1, "text": CAMPAIGN.format(n=5)},
+        {"id": 2, "text": "Автобус 55 постоянно опаздывает, приходится ждать по 20 минут."},
+        {"id": 3, "text": CAMPAIGN.format(n=17).upper()},
+        {"id": 4, "text": CAMPAIGN.format(n=23) + " Примите меры!"},
+        {"id": 5, "text": "Автобус 55 постоянно опаздывает."},
+    ]
+
+    representatives, members = collapse_duplicates(reviews, threshold=0.8)
+
+    assert [review["id"] for review in representatives] == [1, 2, 5]
+    assert members == {1: [3, 4]}
+
+
+def test_collapse_keeps_distinct_reviews():
+    reviews = [{"id": i, "text": text} for i, text in enumerate(["Спасибо!", "", "Нет воды", "Нет света"])]
+
+    representatives, members = collapse_duplicates(reviews, threshold=0.85)
+
+    assert len(representatives) == 4
+    assert members == {}
+
+
+@pytest.mark.asyncio
+async def test_predict_copies_results_to_collapsed_reviews(monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "DEDUP_THRESHOLD", 0.8)
+
+    async def mock_ainvoke(state):
+        return {
+            "sentiments": [
+                {"id": r["id"], "sentiments": {"Благоустройство": "отрицательно", "overall": "отрицательно"}}
+                for r in state["reviews"]
+            ],
+            "ideas": [{
+                "category": "Благоустройство",
+                "ideas": [{"description": "Отремонтировать дорогу", "source_ids": [r["id"] for r in state["reviews"]]}],
+            }],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent, cache=None)
+
+    report = PredictionReport()
+    reviews_map, ideas_map = await service.predict(
+        [{"id": 10 + n, "text": CAMPAIGN.format(n=n)} for n in range(5)], report=report
+    )
+
+    assert [r["id"] for r in mock_agent.ainvoke.call_args.args[0]["reviews"]] == [10]
+    assert list(reviews_map) == [10, 11, 12, 13, 14]
+    assert reviews_map[14] == {"Благоустройство": "отрицательно", "overall": "отрицательно"}
+    assert ideas_map["Благоустройство"][0]["source_ids"] == [10, 11, 12, 13, 14]
+    assert report.duplicates_collapsed == 4
+    assert report.paths[13] == "llm"
@@ -0,0 +1,91 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.services.cache import ResultCache
+from src.services.distilled import DistilledClassifier, load_training_data, train_from_cache
+from src.services.prediction_service import PredictionReport, PredictionService
+
+TEMPLATES = [
+    ("Автобус номер {n} опять опоздал на остановку", {"Транспорт": "отрицательно", "overall": "отрицательно"}),
+    ("Маршрутка {n} сломалась, ждали транспорт час", {"Транспорт": "отрицательно", "overall": "отрицательно"}),
+    ("В парке {n} стало чисто и красиво, спасибо", {"Благоустройство": "положительно", "overall": "положительно"}),
+    ("Новый сквер у дома {n} очень уютный", {"Благоустройство": "положительно", "overall": "положительно"}),
+    (
+        "Автобус {n} ходит редко, а парк рядом грязный",
+        {"Транспорт": "отрицательно", "Благоустройство": "отрицательно", "overall": "отрицательно"},
+    ),
+]
+
+
+def _fill_cache(path, count=40):
+    cache = ResultCache(sqlite_path=str(path))
+    for n in range(count):
+        for template, label in TEMPLATES:
+            text = template.format(n=n)
+            cache.set(ResultCache.make_key(text, "model", False, []), label, text=text)
+    cache.close()
+
+
+def test_distilled_classifier_answers_confident_single_category_reviews(tmp_path):
+    _fill_cache(tmp_path / "cache.sqlite")
+    texts, labels = load_training_data(str(tmp_path / "cache.sqlite"))
+    assert len(texts) == 200
+
+    model = DistilledClassifier.train(texts, labels)
+    model.save(str(tmp_path / "model.joblib"))
+    model = DistilledClassifier.load(str(tmp_path / "model.joblib"))
+
+    answers = model.classify(
+        ["Автобус номер 77 опять опоздал на остановку", "Автобус 77 ходит редко, а парк рядом грязный"],
+        ["Транспорт", "Благоустройство", "Прочее"],
+        threshold=0.6,
+    )
+    assert answers[0] == {"Транспорт": "отрицательно", "overall": "отрицательно"}
+    # Несколько категорий классификатор оставляет LLM
+    assert answers[1] is None
+    # Категории, которой нет в запросе, классификатор не отвечает
+    assert model.classify(["Автобус номер 77 опять опоздал"], ["Прочее"], threshold=0.0) == [None]
+
+
+def test_train_from_cache_reports_agreement(tmp_path):
+    _fill_cache(tmp_path / "cache.sqlite")
+
+    _, agreement, speed = train_from_cache(
+        str(tmp_path / "cache.sqlite"), str(tmp_path / "model.joblib"), test_size=0.25
+    )
+
+    assert agreement.reviews == 50
+    assert agreement.accuracy > 0.9
+    assert speed > 0
+    assert (tmp_path / "model.joblib").exists()
+
+
+def test_train_requires_several_classes():
+    with pytest.raises(ValueError, match="Not enough labeled reviews"):
+        DistilledClassifier.train(["Автобус опоздал"], [{"Транспорт": "отрицательно", "overall": "отрицательно"}])
+
+
+@pytest.mark.asyncio
+async def test_predict_sends_uncertain_reviews_to_agent():
+    distilled = MagicMock()
+    distilled.split.side_effect = lambda reviews, categories: (
+        {1: {"Транспорт": "отрицательно", "overall": "отрицательно"}},
+        [review for review in reviews if review["id"] != 1],
+    )
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(return_value={
+        "sentiments": [{"id": 2, "sentiments": {"Прочее": "нейтрально", "overall": "нейтрально"}}],
+        "ideas": [],
+    })
+    service = PredictionService(agent=mock_agent, cache=None, distilled=distilled)
+
+    report = PredictionReport()
+    reviews_map, _ = await service.predict(
+        [{"id": 1, "text": "Автобус опоздал"}, {"id": 2, "text": "Что-то непонятное"}], report=report
+    )
+
+    assert [r["id"] for r in mock_agent.ainvoke.call_args.args[0]["reviews"]] == [2]
+    assert list(reviews_map) == [1, 2]
+    assert report.distilled_hits == 1
+    assert report.paths == {1: "classifier", 2: "llm"}
@@ -95,6 +95,22 @@ async def test_predict_endpoint_format():
         assert i2["description"] == "Photo service"
         assert i2["source_ids"] == [125]
 
+def test_metrics_endpoint(monkeypatch):
+    from src.metrics import metrics
+    from src.services.cache import ResultCache
+    from src.services.prediction_service import prediction_service
+
+    metrics.inc("ideas_calls_skipped", 0)
+    monkeypatch.setattr(prediction_service, "cache", ResultCache())
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert "ideas_calls_skipped" in data
+    assert "cache_hits" in data
+
+
 if __name__ == "__main__":
     # Manually run the test function if executed directly (helper for debugging)
     import asyncio
@@ -0,0 +1,386 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.agent import graph, utils
+
+
+class FakeLLM:
+    """Отвечает на промпты этапов заранее заготовленным JSON."""
+
+    def __init__(self):
+        self.prompts = []
+        self.kwargs = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        self.kwargs.append(kwargs)
+        text = prompt if isinstance(prompt, str) else "\n".join(m.content for m in prompt)
+        if "ideas_by_category" in text:
+            payload = {"ideas_by_category": [
+                {"category": "Транспорт", "items": [{"description": "Пустить больше автобусов", "source_ids": [1]}]}
+            ]}
+        elif "reviews_with_categories" in text or "Доступные тональности" in text:
+            payload = {"reviews": [
+                {"review_id": 1, "sentiments": {"Транспорт": "отрицательно"}, "overall": "отрицательно"},
+                {"review_id": 2, "sentiments": {"Благоустройство": "положительно"}, "overall": "положительно"},
+            ]}
+        else:
+            payload = {"reviews": [
+                {"review_id": 1, "categories": ["Транспорт"]},
+                {"review_id": 2, "categories": ["Благоустройство"]},
+            ]}
+        return AIMessage(content=json.dumps(payload, ensure_ascii=False))
+
+
+def _state(**overrides):
+    state = {
+        "reviews": [
+            {"id": 1, "text": "Автобус опаздывает"},
+            {"id": 2, "text": "Парк стал чистым"},
+        ],
+        "available_categories": ["Транспорт", "Благоустройство", "Прочее"],
+        "categories": [],
+        "sentiments": [],
+        "ideas": [],
+        "use_few_shot": False,
+        "use_fused_stage": False,
+    }
+    state.update(overrides)
+    return state
+
+
+@pytest.mark.asyncio
+async def test_graph_separate_stages(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    final_state = await graph.classification_agent.ainvoke(_state())
+
+    assert len(fake.prompts) == 3
+    # Системное сообщение не зависит от батча, отзывы передаются в пользовательском
+    system_message, user_message = fake.prompts[0]
+    assert system_message.type == "system" and "Автобус" not in system_message.content
+    assert "Автобус опаздывает" in user_message.content
+    assert final_state["categories"] == [["Транспорт"], ["Благоустройство"]]
+    assert final_state["sentiments"][0]["sentiments"]["Транспорт"] == "отрицательно"
+    assert final_state["ideas"][0]["category"] == "Транспорт"
+
+
+@pytest.mark.asyncio
+async def test_graph_fused_stage(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    final_state = await graph.classification_agent.ainvoke(_state(use_fused_stage=True))
+
+    assert len(fake.prompts) == 2
+    assert final_state["categories"] == [["Транспорт"], ["Благоустройство"]]
+    assert final_state["sentiments"][1] == {
+        "id": 2,
+        "sentiments": {"Благоустройство": "положительно", "overall": "положительно"},
+    }
+    assert final_state["ideas"][0]["ideas"][0]["source_ids"] == [1]
+
+
+@pytest.mark.asyncio
+async def test_graph_keeps_canonical_category_names(monkeypatch):
+    class AbbreviationLLM(FakeLLM):
+        async def ainvoke(self, prompt, **kwargs):
+            text = "\n".join(m.content for m in prompt)
+            if "reviews_with_categories" in text or "ideas_by_category" in text:
+                return await super().ainvoke(prompt, **kwargs)
+            self.prompts.append(prompt)
+            self.kwargs.append(kwargs)
+            payload = {"reviews": [
+                {"review_id": 1, "categories": ["мфц/госуслуги", "Космос"]},
+                {"review_id": 2, "categories": ["Связь И Интернет"]},
+            ]}
+            return AIMessage(content=json.dumps(payload, ensure_ascii=False))
+
+    fake = AbbreviationLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    monkeypatch.setattr(graph.settings, "LLM_JSON_SCHEMA", True)
+    categories = ["МФЦ/Госуслуги", "Связь и интернет", "Прочее"]
+
+    final_state = await graph.classification_agent.ainvoke(
+        _state(available_categories=categories, skip_ideas=True)
+    )
+
+    # Названия берутся из списка категорий, неизвестные отбрасываются
+    assert final_state["categories"] == [["МФЦ/Госуслуги"], ["Связь и интернет"]]
+    sentiment_schema = fake.kwargs[1]["response_format"]["json_schema"]["schema"]
+    sentiment_item = sentiment_schema["properties"]["reviews"]["items"]["properties"]
+    assert list(sentiment_item["sentiments"]["properties"]) == ["МФЦ/Госуслуги", "Связь и интернет"]
+
+
+@pytest.mark.asyncio
+async def test_graph_uses_llm_tier_from_state(monkeypatch):
+    default, small = FakeLLM(), FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", default)
+    monkeypatch.setattr(graph, "get_llm_client", lambda stage, tier: small)
+
+    final_state = await graph.classification_agent.ainvoke(_state(llm_tier="small", skip_ideas=True))
+
+    assert len(small.prompts) == 2 and not default.prompts
+    assert final_state["ideas"] == []
+
+
+@pytest.mark.asyncio
+async def test_graph_resolves_client_per_stage(monkeypatch):
+    default, ideas = FakeLLM(), FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", default)
+    monkeypatch.setattr(graph.settings, "LLM_IDEAS_NAME", "hosted/large-model")
+    monkeypatch.setattr(graph, "get_llm_client", lambda stage, tier: ideas)
+
+    await graph.classification_agent.ainvoke(_state())
+
+    assert len(default.prompts) == 2
+    assert len(ideas.prompts) == 1 and "ideas_by_category" in ideas.prompts[0][0].content
+
+
+def test_stage_settings_configure_client(monkeypatch):
+    monkeypatch.setattr(utils, "_clients", {})
+    monkeypatch.setattr(utils.settings, "LLM_IDEAS_NAME", "hosted/large-model")
+    monkeypatch.setattr(utils.settings, "LLM_IDEAS_MAX_TOKENS", 2048)
+    monkeypatch.setattr(utils.settings, "LLM_IDEAS_REASONING", False)
+
+    client = utils.get_llm_client("ideas")
+
+    assert utils.get_llm_client("category") is utils.llm_client
+    assert utils.get_llm_client("ideas") is client
+    assert client._llm.model_name == "hosted/large-model"
+    assert client._llm.max_tokens == 2048
+    assert client._llm.extra_body["chat_template_kwargs"] == {"enable_thinking": False}
+    assert client._llm.stream_usage
+
+
+def test_llm_signature_includes_stage_url_and_reasoning(monkeypatch):
+    monkeypatch.setattr(utils.settings, "LLM_NAME", "main-model")
+    assert utils.llm_signature() == "main-model"
+
+    monkeypatch.setattr(utils.settings, "LLM_SENTIMENT_BASE_URL", "http://gpu2:8080/v1")
+    by_url = utils.llm_signature()
+    monkeypatch.setattr(utils.settings, "LLM_SENTIMENT_REASONING", True)
+    by_reasoning = utils.llm_signature()
+
+    assert by_url == "category=main-model;sentiment=main-model@http://gpu2:8080/v1"
+    assert by_reasoning == "category=main-model;sentiment=main-model@http://gpu2:8080/v1,reasoning=on"
+
+
+@pytest.mark.asyncio
+async def test_graph_streams_with_batch_sized_budget(monkeypatch):
+    class StreamingFake(FakeLLM):
+        streamed = 0
+
+        async def astream(self, prompt, **kwargs):
+            self.streamed += 1
+            return await self.ainvoke(prompt, **kwargs)
+
+    fake = StreamingFake()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    monkeypatch.setattr(graph.settings, "LLM_STREAMING", True)
+    monkeypatch.setattr(graph.settings, "OUTPUT_TOKENS_PER_REVIEW", 80)
+    monkeypatch.setattr(graph.settings, "LLM_OUTPUT_MARGIN", 2.0)
+
+    final_state = await graph.classification_agent.ainvoke(_state())
+
+    assert [kwargs["max_tokens"] for kwargs in fake.kwargs] == [320, 320, 160]
+    assert fake.streamed == len(fake.prompts)
+    assert final_state["ideas"][0]["category"] == "Транспорт"
+
+
+def test_output_budget_skipped_for_reasoning_stage(monkeypatch):
+    monkeypatch.setattr(graph.settings, "OUTPUT_TOKENS_PER_REVIEW", 80)
+    monkeypatch.setattr(graph.settings, "LLM_OUTPUT_MARGIN", 2.0)
+    monkeypatch.setattr(graph.settings, "LLM_CATEGORY_MAX_TOKENS", 0)
+    assert graph.output_token_budget(4, "category") == 640
+
+    monkeypatch.setattr(graph.settings, "LLM_CATEGORY_REASONING", True)
+    assert graph.output_token_budget(4, "category") is None
+    monkeypatch.setattr(graph.settings, "LLM_CATEGORY_MAX_TOKENS", 4096)
+    assert graph.output_token_budget(4, "category") == 4096
+
+
+@pytest.mark.asyncio
+async def test_graph_records_tokens_per_stage(monkeypatch):
+    from src.metrics import metrics
+
+    class UsageFake(FakeLLM):
+        async def ainvoke(self, prompt, **kwargs):
+            response = await super().ainvoke(prompt, **kwargs)
+            if "ideas_by_category" in "\n".join(m.content for m in prompt):
+                return response
+            response.usage_metadata = {"input_tokens": 500, "output_tokens": 40, "total_tokens": 540}
+            return response
+
+    monkeypatch.setattr(graph, "llm_client", UsageFake())
+    metrics.reset()
+
+    # Метрики токенов выключены по умолчанию
+    await graph.classification_agent.ainvoke(_state())
+    assert metrics.get("llm_calls_ideas") == 0
+
+    monkeypatch.setattr(graph.settings, "LLM_TOKEN_METRICS", True)
+    await graph.classification_agent.ainvoke(_state())
+
+    # usage из ответа сервера, а без него — подсчет токенизатором
+    assert metrics.get("llm_prompt_tokens_category") == 500
+    assert metrics.get("llm_completion_tokens_sentiment") == 40
+    assert metrics.get("llm_prompt_tokens_ideas") > 0
+    assert metrics.get("llm_completion_tokens_ideas") > 0
+    assert metrics.get("llm_calls_ideas") == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fused", [False, True])
+async def test_graph_session_sends_review_text_once(monkeypatch, fused):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    final_state = await graph.classification_agent.ainvoke(
+        _state(use_session=True, messages=[], use_fused_stage=fused)
+    )
+
+    first, *follow_ups = fake.prompts
+    assert len(follow_ups) == (1 if fused else 2)
+    for previous, prompt in zip(fake.prompts, follow_ups):
+        # Каждый этап продолжает диалог предыдущего: его сообщения и ответ модели
+        assert prompt[: len(previous)] == previous
+        assert prompt[len(previous)].type == "ai"
+        new_turn = prompt[len(previous) + 1 :]
+        assert len(new_turn) == 1 and "Автобус опаздывает" not in new_turn[0].content
+    assert "ID=1" in follow_ups[-1][-1].content and "ID=2" not in follow_ups[-1][-1].content
+    assert final_state["sentiments"][0]["sentiments"]["Транспорт"] == "отрицательно"
+    assert final_state["ideas"][0]["category"] == "Транспорт"
+
+
+@pytest.mark.asyncio
+async def test_graph_constrains_every_stage_with_json_schema(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    monkeypatch.setattr(graph.settings, "LLM_JSON_SCHEMA", True)
+
+    await graph.classification_agent.ainvoke(_state())
+
+    schemas = [kwargs["response_format"]["json_schema"]["schema"] for kwargs in fake.kwargs]
+    assert len(schemas) == 3
+    category_item = schemas[0]["properties"]["reviews"]["items"]["properties"]
+    assert category_item["categories"]["items"]["enum"] == ["Транспорт", "Благоустройство", "Прочее"]
+    assert category_item["review_id"]["enum"] == [1, 2]
+    sentiment_item = schemas[1]["properties"]["reviews"]["items"]["properties"]
+    assert set(sentiment_item["sentiments"]["properties"]) == {"Транспорт", "Благоустройство"}
+    assert sentiment_item["overall"]["enum"] == ["положительно", "нейтрально", "отрицательно"]
+    idea_item = schemas[2]["properties"]["ideas_by_category"]["items"]["properties"]
+    # В этап идей попадает только отзыв с негативом
+    assert idea_item["items"]["items"]["properties"]["source_ids"]["items"]["enum"] == [1]
+
+
+@pytest.mark.asyncio
+async def test_graph_without_json_schema(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    monkeypatch.setattr(graph.settings, "LLM_JSON_SCHEMA", False)
+
+    await graph.classification_agent.ainvoke(_state(use_fused_stage=True))
+
+    assert fake.kwargs == [{}, {}]
+
+
+@pytest.mark.asyncio
+async def test_graph_falls_back_to_plain_prompt_when_schema_is_rejected(monkeypatch):
+    import httpx
+    import openai
+
+    class NoSchemaLLM(FakeLLM):
+        async def ainvoke(self, prompt, **kwargs):
+            if "response_format" in kwargs:
+                self.kwargs.append(kwargs)
+                response = httpx.Response(400, request=httpx.Request("POST", "http://llm/v1/chat/completions"))
+                raise openai.BadRequestError("response_format is not supported", response=response, body=None)
+            return await super().ainvoke(prompt, **kwargs)
+
+    fake = NoSchemaLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    monkeypatch.setattr(graph.settings, "LLM_JSON_SCHEMA", True)
+
+    final_state = await graph.classification_agent.ainvoke(_state())
+
+    # Схема отклонена один раз, следующие этапы сразу вызываются без нее
+    assert ["response_format" in kwargs for kwargs in fake.kwargs] == [True, False, False, False]
+    assert final_state["ideas"][0]["category"] == "Транспорт"
+
+
+class TruncatedCategoriesLLM(FakeLLM):
+    async def ainvoke(self, prompt, **kwargs):
+        response = await super().ainvoke(prompt, **kwargs)
+        if len(self.prompts) == 1:
+            # Ответ этапа категорий обрезан после первого отзыва
+            response = AIMessage(content=response.content[: response.content.index("}") + 1])
+        return response
+
+
+@pytest.mark.asyncio
+async def test_graph_keeps_reviews_recovered_from_truncated_answer(monkeypatch):
+    fake = TruncatedCategoriesLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    final_state = await graph.classification_agent.ainvoke(_state())
+
+    # Отзыв 2 потерян на этапе категорий и дальше не передается
+    assert "Парк стал чистым" not in fake.prompts[1][1].content
+    assert [review["id"] for review in final_state["reviews"]] == [1]
+    assert [item["id"] for item in final_state["sentiments"]] == [1]
+
+
+class PositiveLLM(FakeLLM):
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        text = prompt if isinstance(prompt, str) else "\n".join(m.content for m in prompt)
+        if "Доступные тональности" in text:
+            payload = {"reviews": [
+                {"review_id": 1, "sentiments": {"Транспорт": "положительно"}, "overall": "положительно"},
+                {"review_id": 2, "sentiments": {"Благоустройство": "положительно"}, "overall": "положительно"},
+            ]}
+            return AIMessage(content=json.dumps(payload, ensure_ascii=False))
+        return await super().ainvoke(prompt, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_graph_skips_ideas_for_positive_only_batch(monkeypatch):
+    from src.metrics import metrics
+
+    fake = PositiveLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+    skipped_before = metrics.get("ideas_calls_skipped")
+
+    final_state = await graph.classification_agent.ainvoke(_state(use_fused_stage=True))
+
+    assert len(fake.prompts) == 1
+    assert final_state["ideas"] == []
+    assert metrics.get("ideas_calls_skipped") == skipped_before + 1
+
+
+@pytest.mark.asyncio
+async def test_extract_ideas_excludes_positive_reviews(monkeypatch):
+    fake = FakeLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    await graph.classification_agent.ainvoke(_state())
+
+    ideas_prompt = "\n".join(message.content for message in fake.prompts[-1])
+    assert "Автобус опаздывает" in ideas_prompt
+    assert "Парк стал чистым" not in ideas_prompt
+
+
+@pytest.mark.asyncio
+async def test_tokenizer_falls_back_to_length_estimate(monkeypatch):
+    from src.agent import tokens
+    from src.agent.utils import estimate_tokens
+
+    monkeypatch.setattr(tokens.settings, "TOKENIZER_ENCODING", "no-such-encoding")
+    monkeypatch.setattr(tokens, "_encoding", None)
+
+    assert not await tokens.load_tokenizer()
+    assert tokens.count_tokens("Автобус опаздывает") == estimate_tokens("Автобус опаздывает")
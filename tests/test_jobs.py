@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock
+
+from src.endpoints.api.v1 import endpoints
+from src.services.cache import ResultCache
+from src.services.jobs import JobManager, JobStatus
+from src.services.prediction_service import PredictionService
+from src.settings import settings
+
+
+async def _mock_ainvoke(state):
+    ids = [r["id"] for r in state["reviews"]]
+    if 4 in ids:
+        raise ValueError("JSON Decode Error")
+    return {
+        "sentiments": [
+            {"id": r_id, "sentiments": {"ЖКХ": "отрицательно", "overall": "отрицательно"}}
+            for r_id in ids
+        ],
+        "ideas": [{"category": "ЖКХ", "ideas": [{"description": f"Идея {ids[0]}", "source_ids": ids}]}],
+    }
+
+
+def _service():
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=_mock_ainvoke)
+    return PredictionService(agent=mock_agent, cache=ResultCache())
+
+
+async def _wait_finished(manager, job_id):
+    for _ in range(100):
+        job = manager.get(job_id)
+        if job.is_finished:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+@pytest.mark.asyncio
+async def test_job_manager_processes_job_with_partial_failure(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SIZE", 2)
+    manager = JobManager(service=_service(), workers=2)
+
+    reviews = [{"id": i, "text": f"Отзыв {i}"} for i in range(1, 6)]
+    job = await manager.submit(reviews)
+    job = await _wait_finished(manager, job.id)
+    await manager.stop()
+
+    assert job.status == JobStatus.COMPLETED
+    assert job.batches_done == 3
+    assert job.report.batches_total == 3
+    assert [f.review_ids for f in job.report.failures] == [[4]]
+
+    reviews_map, ideas_map = job.merged_results()
+    assert list(reviews_map) == [1, 2, 3, 5]
+    assert [idea["description"] for idea in ideas_map["ЖКХ"]] == ["Идея 1", "Идея 3", "Идея 5"]
+
+
+def test_jobs_api(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SIZE", 2)
+    manager = JobManager(service=_service(), workers=1)
+    monkeypatch.setattr(endpoints, "job_manager", manager)
+
+    test_app = FastAPI()
+    test_app.include_router(endpoints.router)
+
+    with TestClient(test_app) as client:
+        response = client.post("/jobs", json={"reviews": [{"id": i, "text": f"Отзыв {i}"} for i in range(1, 4)]})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        for _ in range(100):
+            status = client.get(f"/jobs/{job_id}").json()
+            if status["status"] == JobStatus.COMPLETED:
+                break
+            time.sleep(0.01)
+        assert status["status"] == JobStatus.COMPLETED
+        assert status["batches_done"] == status["batches_total"] == 2
+        assert status["reviews_done"] == 3
+
+        page = client.get(f"/jobs/{job_id}/results", params={"offset": 1, "limit": 1}).json()
+        assert page["total"] == 3
+        assert [r["id"] for r in page["reviews"]] == [2]
+        assert page["reviews"][0]["overall"] == 2
+
+        ideas = client.get(f"/jobs/{job_id}/ideas").json()["ideas"]
+        assert [idea["source_ids"] for idea in ideas] == [[1, 2], [3]]
+
+        assert client.get("/jobs/unknown").status_code == 404
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.agent import graph, utils
+from src.services.local_ids import LocalIdAgent
+
+
+class ReorderingLLM:
+    """Отвечает по локальным номерам отзывов в обратном порядке и с id-строками."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        text = "\n".join(m.content for m in prompt)
+        if "ideas_by_category" in text:
+            payload = {"ideas_by_category": [
+                {"category": "Транспорт", "items": [{"description": "Пустить больше автобусов", "source_ids": [1, 7]}]}
+            ]}
+        elif "Доступные тональности" in text:
+            payload = {"reviews": [
+                {"review_id": "2", "sentiments": {"Благоустройство": "положительно"}, "overall": "положительно"},
+                {"review_id": "1", "sentiments": {"Транспорт": "отрицательно"}, "overall": "отрицательно"},
+            ]}
+        else:
+            payload = {"reviews": [
+                {"review_id": "2", "categories": ["Благоустройство"]},
+                {"review_id": "1", "categories": ["Транспорт"]},
+            ]}
+        return AIMessage(content=json.dumps(payload, ensure_ascii=False))
+
+
+def _state():
+    return {
+        "reviews": [
+            {"id": 9000000123, "text": "Автобус\n\nопаздывает"},
+            {"id": 9000000456, "text": "Парк стал чистым"},
+        ],
+        "available_categories": ["Транспорт", "Благоустройство", "Прочее"],
+        "categories": [],
+        "sentiments": [],
+        "ideas": [],
+        "use_few_shot": False,
+        "use_fused_stage": False,
+    }
+
+
+def test_compact_formatters_use_one_line_per_review(monkeypatch):
+    monkeypatch.setattr(utils.settings, "PROMPT_COMPACT", True)
+    reviews = [{"id": 1, "text": "Автобус\n опаздывает"}, {"id": 2, "text": "Парк"}]
+
+    assert utils.format_reviews(reviews) == "ID=1: Автобус опаздывает\nID=2: Парк\n"
+    assert utils.format_reviews_with_categories(reviews, [["Транспорт"], ["Благоустройство", "Прочее"]]) == (
+        "ID=1 [Транспорт]: Автобус опаздывает\nID=2 [Благоустройство, Прочее]: Парк\n"
+    )
+    assert utils.format_reviews_with_categories_and_sentiments(
+        reviews[:1], [["Транспорт"]], [{"Транспорт": "отрицательно", "overall": "отрицательно"}]
+    ) == "ID=1 [Транспорт: отрицательно; overall: отрицательно]: Автобус опаздывает\n"
+
+
+@pytest.mark.asyncio
+async def test_local_ids_keep_results_aligned_when_model_reorders(monkeypatch):
+    monkeypatch.setattr(utils.settings, "PROMPT_COMPACT", True)
+    fake = ReorderingLLM()
+    monkeypatch.setattr(graph, "llm_client", fake)
+
+    final_state = await LocalIdAgent(graph.classification_agent).ainvoke(_state())
+
+    # Модель видит только номера отзывов в батче
+    user_message = fake.prompts[0][-1].content
+    assert "ID=1: Автобус опаздывает" in user_message and "9000000123" not in user_message
+    assert [review["id"] for review in final_state["reviews"]] == [9000000123, 9000000456]
+    assert final_state["categories"] == [["Транспорт"], ["Благоустройство"]]
+    assert [item["id"] for item in final_state["sentiments"]] == [9000000123, 9000000456]
+    assert final_state["sentiments"][0]["sentiments"]["Транспорт"] == "отрицательно"
+    # Ссылка на номер, которого нет в батче, отбрасывается
+    assert final_state["ideas"][0]["ideas"][0]["source_ids"] == [9000000123]
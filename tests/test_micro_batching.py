@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.services.batcher import MicroBatchingAgent
+
+
+def _state(reviews, use_few_shot=False):
+    return {
+        "reviews": reviews,
+        "available_categories": ["Транспорт", "ЖКХ"],
+        "categories": [],
+        "sentiments": [],
+        "ideas": [],
+        "use_few_shot": use_few_shot,
+    }
+
+
+async def _mock_ainvoke(state):
+    reviews = state["reviews"]
+    return {
+        "sentiments": [
+            {"id": r["id"], "sentiments": {"Транспорт": r["text"], "overall": "отрицательно"}}
+            for r in reviews
+        ],
+        "ideas": [
+            {
+                "category": "Транспорт",
+                "ideas": [
+                    {"description": "Общая идея", "source_ids": [r["id"] for r in reviews]},
+                    {"description": "Идея первого", "source_ids": [reviews[0]["id"]]},
+                ],
+            }
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_micro_batching_merges_concurrent_requests():
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=_mock_ainvoke)
+    batcher = MicroBatchingAgent(mock_agent, batch_size=10, max_delay=0.05)
+
+    # У разных запросов совпадают id — они не должны перепутаться
+    first, second = await asyncio.gather(
+        batcher.ainvoke(_state([{"id": 1, "text": "a"}, {"id": 2, "text": "b"}])),
+        batcher.ainvoke(_state([{"id": 1, "text": "c"}])),
+    )
+
+    assert mock_agent.ainvoke.call_count == 1
+    combined = mock_agent.ainvoke.call_args.args[0]["reviews"]
+    assert len(combined) == 3
+
+    assert [(s["id"], s["sentiments"]["Транспорт"]) for s in first["sentiments"]] == [(1, "a"), (2, "b")]
+    assert [(s["id"], s["sentiments"]["Транспорт"]) for s in second["sentiments"]] == [(1, "c")]
+
+    first_ideas = first["ideas"][0]["ideas"]
+    assert first_ideas[0]["source_ids"] == [1, 2]
+    assert first_ideas[1]["source_ids"] == [1]
+    second_ideas = second["ideas"][0]["ideas"]
+    assert [idea["description"] for idea in second_ideas] == ["Общая идея"]
+    assert second_ideas[0]["source_ids"] == [1]
+
+
+@pytest.mark.asyncio
+async def test_micro_batching_flushes_full_batch_and_separates_prompt_variants():
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=_mock_ainvoke)
+    batcher = MicroBatchingAgent(mock_agent, batch_size=2, max_delay=10)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(
+            batcher.ainvoke(_state([{"id": 1, "text": "a"}])),
+            batcher.ainvoke(_state([{"id": 2, "text": "b"}])),
+            batcher.ainvoke(_state([{"id": 3, "text": "c"}], use_few_shot=True)),
+            batcher.ainvoke(_state([{"id": 4, "text": "d"}], use_few_shot=True)),
+        ),
+        timeout=1,
+    )
+
+    assert mock_agent.ainvoke.call_count == 2
+    assert [r["sentiments"][0]["id"] for r in results] == [1, 2, 3, 4]
+    variants = [call.args[0]["use_few_shot"] for call in mock_agent.ainvoke.call_args_list]
+    assert sorted(variants) == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_micro_batching_propagates_errors():
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=ValueError("bad json"))
+    batcher = MicroBatchingAgent(mock_agent, batch_size=10, max_delay=0.01)
+
+    with pytest.raises(ValueError, match="bad json"):
+        await batcher.ainvoke(_state([{"id": 1, "text": "a"}]))
+
+
+@pytest.mark.asyncio
+async def test_micro_batching_respects_context_budget_with_token_packing(monkeypatch):
+    from src.services.batch_packer import batch_budget, reviews_cost
+    from src.settings import settings
+
+    monkeypatch.setattr(settings, "BATCH_PACKING", "tokens")
+    monkeypatch.setattr(settings, "LLM_CONTEXT_TOKENS", 4096)
+    monkeypatch.setattr(settings, "MICRO_BATCH_MAX_DELAY_MS", 50)
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=_mock_ainvoke)
+    batcher = MicroBatchingAgent(mock_agent)
+
+    # Каждый запрос занимает около 60% бюджета: вместе они не помещаются в контекст
+    budget = batch_budget(False, ["Транспорт", "ЖКХ"])
+    text = "автобус " * int(budget * 0.6 * settings.CHARS_PER_TOKEN / 8)
+    requests = [_state([{"id": 1, "text": text}]) for _ in range(2)]
+    assert reviews_cost(requests[0]["reviews"]) < budget < 2 * reviews_cost(requests[0]["reviews"])
+
+    await asyncio.gather(*(batcher.ainvoke(request) for request in requests))
+
+    assert mock_agent.ainvoke.call_count == 2
+    assert all(len(call.args[0]["reviews"]) == 1 for call in mock_agent.ainvoke.call_args_list)
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from langchain_core.messages import AIMessage
 from src.agent.utils import parse_review_sentiments, parse_ideas
@@ -90,3 +92,78 @@ def test_parse_ideas_fallback():
     assert len(result) == 1
     assert result[0]["category"] == "Транспорт"
     assert result[0]["ideas"] == ["Починить автобус"]
+
+def test_parse_categories_and_sentiments_fused():
+    from src.agent.utils import parse_review_categories_and_sentiments
+
+    json_content = """
+    {
+        "reviews": [
+            {
+                "review_id": 1,
+                "sentiments": {"транспорт": "отрицательно", "ЖКХ": "нейтрально"},
+                "overall": "отрицательно"
+            },
+            {
+                "review_id": 2,
+                "sentiments": {},
+                "overall": "положительно"
+            }
+        ]
+    }
+    """
+    categories, sentiments = parse_review_categories_and_sentiments(AIMessage(content=json_content))
+
+    assert categories == [["Транспорт", "Жкх"], ["Прочее"]]
+    assert sentiments[0] == {
+        "id": 1,
+        "sentiments": {"Транспорт": "отрицательно", "Жкх": "нейтрально", "overall": "отрицательно"},
+    }
+    assert sentiments[1]["sentiments"] == {"Прочее": "положительно", "overall": "положительно"}
+
+
+def test_parse_categories_and_sentiments_uses_available_names():
+    from src.agent.utils import parse_review_categories_and_sentiments
+
+    json_content = json.dumps({"reviews": [{
+        "review_id": 1,
+        "sentiments": {"мфц/госуслуги": "отрицательно", "Связь И Интернет": "нейтрально", "Космос": "нейтрально"},
+        "overall": "отрицательно",
+    }]}, ensure_ascii=False)
+    categories, sentiments = parse_review_categories_and_sentiments(
+        AIMessage(content=json_content), ["МФЦ/Госуслуги", "Связь и интернет", "Прочее"]
+    )
+
+    assert categories == [["МФЦ/Госуслуги", "Связь и интернет"]]
+    assert sentiments[0]["sentiments"] == {
+        "МФЦ/Госуслуги": "отрицательно",
+        "Связь и интернет": "нейтрально",
+        "overall": "отрицательно",
+    }
+
+
+def test_parse_sentiments_salvages_truncated_answer():
+    # Ответ обрезан на середине третьего отзыва, второй отзыв испорчен
+    content = (
+        '{"reviews": ['
+        '{"review_id": 1, "sentiments": {"Транспорт": "отрицательно"}, "overall": "отрицательно"}, '
+        '{"review_id": 2, "sentiments": {"ЖКХ": отрицательно}, "overall": "отрицательно"}, '
+        '{"review_id": 3, "sentiments": {"Благоустройство": "положительно"}, "overall": "положительно"}, '
+        '{"review_id": 4, "sentiments": {"Транс'
+    )
+    result = parse_review_sentiments(AIMessage(content=content))
+
+    assert [item["id"] for item in result] == [1, 3]
+    assert result[1]["sentiments"]["Благоустройство"] == "положительно"
+
+
+def test_parse_sentiments_marks_repaired_items():
+    response = AIMessage(content=json.dumps({"reviews": [
+        {"review_id": 1, "sentiments": {"Транспорт": "плохо"}, "overall": "отрицательно"},
+        {"review_id": 2, "sentiments": {"Транспорт": "положительно"}, "overall": "положительно"},
+    ]}, ensure_ascii=False))
+
+    result = parse_review_sentiments(response)
+
+    assert result[0]["repaired"] is True
+    assert "repaired" not in result[1]
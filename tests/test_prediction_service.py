@@ -1,5 +1,9 @@
+import asyncio
+
+import httpx
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
+from src.agent.resilience import CircuitOpenError
 from src.services.prediction_service import PredictionService
 from src.settings import settings
 
@@ -112,3 +116,124 @@ async def test_predict_empty_reviews():
     assert reviews_map == {}
     assert ideas_map == {}
     mock_agent.ainvoke.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_predict_concurrent_batches_keep_order(monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(settings, "BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_BATCHES", 3)
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def mock_ainvoke(state):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        r_id = state["reviews"][0]["id"]
+        # Первые батчи завершаются последними
+        await asyncio.sleep(0.01 * (6 - r_id))
+        in_flight -= 1
+        return {
+            "sentiments": [{"id": r_id, "sentiments": {"Прочее": "нейтрально", "overall": "нейтрально"}}],
+            "ideas": [{"category": "Прочее", "ideas": [{"description": f"idea {r_id}", "source_ids": [r_id]}]}],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent)
+
+    reviews = [{"id": i, "text": f"review {i}"} for i in range(1, 6)]
+    reviews_map, ideas_map = await service.predict(reviews)
+
+    assert max_in_flight == 3
+    assert list(reviews_map.keys()) == [1, 2, 3, 4, 5]
+    assert [idea["description"] for idea in ideas_map["Прочее"]] == [f"idea {i}" for i in range(1, 6)]
+
+
+@pytest.mark.asyncio
+async def test_predict_reports_failed_batches(monkeypatch):
+    from src.services.prediction_service import PredictionReport
+
+    monkeypatch.setattr(settings, "BATCH_SIZE", 2)
+
+    async def mock_ainvoke(state):
+        ids = [r["id"] for r in state["reviews"]]
+        if 3 in ids:
+            raise ValueError("JSON Decode Error")
+        return {
+            "sentiments": [{"id": r_id, "sentiments": {"overall": "нейтрально"}} for r_id in ids],
+            "ideas": [],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent)
+
+    report = PredictionReport()
+    reviews = [{"id": i, "text": f"review {i}"} for i in range(1, 6)]
+    reviews_map, _ = await service.predict(reviews, report=report)
+
+    # Упавший батч [3, 4] делится пополам: теряется только отзыв 3
+    assert sorted(reviews_map.keys()) == [1, 2, 4, 5]
+    assert report.batches_total == 3
+    assert len(report.failures) == 1
+    assert report.failures[0].batch_index == 1
+    assert report.failures[0].review_ids == [3]
+
+
+@pytest.mark.asyncio
+async def test_predict_resubmits_only_missing_reviews(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SIZE", 4)
+    calls = []
+
+    async def mock_ainvoke(state):
+        ids = [r["id"] for r in state["reviews"]]
+        calls.append(ids)
+        # Первый ответ обрезан: последний отзыв батча потерян
+        returned = ids[:-1] if len(calls) == 1 else ids
+        return {
+            "sentiments": [{"id": r_id, "sentiments": {"overall": "нейтрально"}} for r_id in returned],
+            "ideas": [],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent, cache=None)
+
+    reviews_map, _ = await service.predict([{"id": i, "text": f"review {i}"} for i in range(1, 5)])
+
+    assert calls == [[1, 2, 3, 4], [4]]
+    assert list(reviews_map) == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_predict_raises_when_all_batches_fail():
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=RuntimeError("LLM is down"))
+    service = PredictionService(agent=mock_agent)
+
+    with pytest.raises(RuntimeError, match="LLM is down"):
+        await service.predict([{"id": 1, "text": "review"}])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [
+    CircuitOpenError("all backends open"),
+    httpx.ConnectError("connection refused"),
+    asyncio.TimeoutError(),
+])
+async def test_predict_does_not_split_batch_on_backend_errors(monkeypatch, error):
+    monkeypatch.setattr(settings, "BATCH_SIZE", 10)
+    monkeypatch.setattr(settings, "BATCH_RECOVERY", True)
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=error)
+    service = PredictionService(agent=mock_agent, cache=None)
+
+    with pytest.raises(type(error)):
+        await service.predict([{"id": i, "text": f"review {i}"} for i in range(10)])
+
+    # Ошибка бэкенда не связана с содержимым батча: он не делится пополам
+    assert mock_agent.ainvoke.call_count == 1
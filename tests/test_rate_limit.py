@@ -0,0 +1,80 @@
+import time
+
+import httpx
+import openai
+import pytest
+
+from src.agent import rate_limit
+from src.agent.rate_limit import RateLimiter, is_transient_error, retry_after_seconds
+from src.agent.utils import LLM
+
+
+def _rate_limit_error(headers):
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit exceeded", response=response, body=None)
+
+
+@pytest.mark.asyncio
+async def test_token_budget_holds_calls_until_refilled():
+    limiter = RateLimiter(tokens_per_minute=60_000)  # 1000 токенов в секунду
+
+    await limiter.acquire(60_000)
+    started = time.monotonic()
+    await limiter.acquire(100)
+
+    assert time.monotonic() - started >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_pause_holds_all_calls():
+    limiter = RateLimiter()
+    limiter.pause(0.1)
+
+    started = time.monotonic()
+    await limiter.acquire()
+
+    assert time.monotonic() - started >= 0.09
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(_rate_limit_error({"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(_rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(_rate_limit_error({})) is None
+    assert retry_after_seconds(ValueError("JSON Decode Error")) is None
+
+
+def test_only_transient_errors_are_retried():
+    assert is_transient_error(_rate_limit_error({}))
+    assert is_transient_error(httpx.ConnectError("refused"))
+    assert is_transient_error(TimeoutError())
+    assert not is_transient_error(ValueError("JSON Decode Error"))
+
+
+@pytest.mark.asyncio
+async def test_llm_pauses_pool_on_retry_after(monkeypatch):
+    limiter = RateLimiter()
+    monkeypatch.setattr(rate_limit, "_rate_limiter", limiter)
+    calls = []
+
+    async def flaky(prompt):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise _rate_limit_error({"retry-after": "0.1"})
+        return "ok"
+
+    assert await LLM()._execute_runnable(flaky, "hi") == "ok"
+    assert calls[1] - calls[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_llm_does_not_retry_parse_errors():
+    calls = []
+
+    async def broken(prompt):
+        calls.append(prompt)
+        raise ValueError("JSON Decode Error")
+
+    with pytest.raises(ValueError):
+        await LLM()._execute_runnable(broken, "hi")
+    assert len(calls) == 1
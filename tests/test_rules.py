@@ -0,0 +1,87 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.services.prediction_service import PredictionReport, PredictionService
+from src.services.rules import RuleClassifier
+from src.settings import settings
+
+CATEGORIES = ["Транспорт", "Здравоохранение", "ЖКХ", "Прочее"]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", ({"Прочее": "нейтрально", "overall": "нейтрально"}, "empty")),
+        ("👍👍", ({"Прочее": "положительно", "overall": "положительно"}, "emoji")),
+        ("Спасибо вам большое!", ({"Прочее": "положительно", "overall": "положительно"}, "thanks")),
+        ("Автобус опять опаздывает", ({"Транспорт": "отрицательно", "overall": "отрицательно"}, "keywords")),
+        ("Врач не вежливый", ({"Здравоохранение": "отрицательно", "overall": "отрицательно"}, "keywords")),
+        # Смешанная тональность, две категории, нет оценки, длинный отзыв — решает модель
+        ("Отличные врачи, но в регистратуре хамят", None),
+        ("Автобус до поликлиники ходит плохо", None),
+        ("Автобус 55", None),
+        ("Спасибо за ремонт дороги", None),
+        ("Автобус " + "очень " * 20 + "плохой", None),
+        # Текст не на кириллице не считается пустым и уходит модели
+        ("الحافلة متأخرة دائما", None),
+        ("公交车总是迟到", None),
+        ("ავტობუსი აგვიანებს", None),
+        ("?!...", ({"Прочее": "нейтрально", "overall": "нейтрально"}, "empty")),
+    ],
+)
+def test_rule_classifier(text, expected):
+    assert RuleClassifier(CATEGORIES, max_words=15).classify(text) == expected
+
+
+def test_rule_classifier_uses_only_request_categories_and_custom_rules(tmp_path, monkeypatch):
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text(
+        json.dumps({"keywords": {"Транспорт": ["самокат"]}, "positive": ["удобн"]}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(settings, "RULES_PATH", str(rules_path))
+
+    classifier = RuleClassifier.from_settings(["Транспорт"])
+
+    assert classifier.classify("Самокаты удобные") == (
+        {"Транспорт": "положительно", "overall": "положительно"},
+        "keywords",
+    )
+    # Без категории "Прочее" пустые отзывы и благодарности остаются модели
+    assert classifier.classify("Спасибо!") is None
+    assert classifier.classify("Автобус опаздывает") is None
+
+
+@pytest.mark.asyncio
+async def test_predict_answers_trivial_reviews_without_agent():
+    async def mock_ainvoke(state):
+        return {
+            "sentiments": [
+                {"id": r["id"], "sentiments": {"ЖКХ": "отрицательно", "overall": "отрицательно"}}
+                for r in state["reviews"]
+            ],
+            "ideas": [],
+        }
+
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=mock_ainvoke)
+    service = PredictionService(agent=mock_agent, cache=None)
+    service.rules = RuleClassifier(service.available_categories)
+
+    report = PredictionReport()
+    reviews_map, _ = await service.predict(
+        [
+            {"id": 1, "text": "Спасибо!"},
+            {"id": 2, "text": "Во дворе дома 5 не вывозят мусор, а в подъезде грязно и темно уже месяц"},
+            {"id": 3, "text": "Автобус постоянно опаздывает"},
+        ],
+        report=report,
+    )
+
+    assert [r["id"] for r in mock_agent.ainvoke.call_args.args[0]["reviews"]] == [2]
+    assert list(reviews_map) == [1, 2, 3]
+    assert reviews_map[3] == {"Транспорт": "отрицательно", "overall": "отрицательно"}
+    assert report.rule_hits == 2
+    assert report.paths == {1: "rules", 2: "llm", 3: "rules"}
@@ -0,0 +1,79 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock
+
+from src.endpoints.api.v1 import endpoints
+from src.services.cache import ResultCache
+from src.services.prediction_service import PredictionService
+from src.settings import settings
+
+test_app = FastAPI()
+test_app.include_router(endpoints.router)
+client = TestClient(test_app)
+
+REQUEST = {"reviews": [{"id": i, "text": f"Отзыв {i}"} for i in range(1, 4)]}
+
+
+async def _mock_ainvoke(state):
+    ids = [r["id"] for r in state["reviews"]]
+    if 3 in ids:
+        raise ValueError("JSON Decode Error")
+    return {
+        "sentiments": [
+            {"id": r_id, "sentiments": {"Транспорт": "отрицательно", "overall": "отрицательно"}}
+            for r_id in ids
+        ],
+        "ideas": [{"category": "Транспорт", "ideas": [{"description": f"Идея {ids[0]}", "source_ids": ids}]}],
+    }
+
+
+def _patch_service(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SIZE", 1)
+    mock_agent = MagicMock()
+    mock_agent.ainvoke = AsyncMock(side_effect=_mock_ainvoke)
+    monkeypatch.setattr(
+        endpoints, "prediction_service", PredictionService(agent=mock_agent, cache=ResultCache())
+    )
+
+
+def test_predict_stream_ndjson(monkeypatch):
+    _patch_service(monkeypatch)
+
+    response = client.post("/predict/stream", json=REQUEST)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.text.splitlines()]
+
+    reviews = [r for r in records if r["type"] == "review"]
+    assert sorted(r["id"] for r in reviews) == [1, 2]
+    assert reviews[0]["overall"] == 2
+    assert reviews[0]["categories"][0]["name"] == "Транспорт"
+
+    ideas = [r for r in records if r["type"] == "idea"]
+    assert sorted(i["description"] for i in ideas) == ["Идея 1", "Идея 2"]
+
+    errors = [r for r in records if r["type"] == "error"]
+    assert errors[0]["review_ids"] == [3]
+
+    summary = records[-1]
+    assert summary["type"] == "summary"
+    assert summary["reviews"] == 2
+    assert summary["batches_total"] == 3
+    assert summary["failed_batches"][0]["review_ids"] == [3]
+
+
+def test_predict_stream_sse_with_ideas_at_end(monkeypatch):
+    _patch_service(monkeypatch)
+
+    response = client.post("/predict/stream", params={"format": "sse", "ideas": "end"}, json=REQUEST)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in response.text.split("\n\n") if block]
+    types = [block.split("\n")[0].removeprefix("event: ") for block in events]
+    assert types[-3:] == ["idea", "idea", "summary"]
+    assert "idea" not in types[:-3]
+    payload = json.loads(events[-1].split("\n")[1].removeprefix("data: "))
+    assert payload["ideas"] == 2
@@ -0,0 +1,104 @@
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from src.agent.streaming import JsonStreamScanner, stream_until_json
+
+
+def _feed(chunks):
+    scanner = JsonStreamScanner()
+    for i, chunk in enumerate(chunks):
+        if scanner.feed(chunk):
+            return scanner, i
+    return scanner, None
+
+
+def test_scanner_stops_at_top_level_close():
+    answer = '{"reviews": [{"review_id": 1, "text": "скобка } в строке \\" и {"}]}'
+    scanner, stopped_at = _feed(["Ответ:\n", answer[:20], answer[20:], "\nПояснение: {лишнее}"])
+
+    assert stopped_at == 2
+    assert scanner.text == answer
+
+
+def test_scanner_skips_think_blocks_split_across_chunks():
+    scanner, stopped_at = _feed(["<thi", "nk>рассуждаю: {не json}</th", "ink>\n", '{"a": 1}', " ещё"])
+
+    assert stopped_at == 3
+    assert scanner.text == '{"a": 1}'
+
+
+def test_scanner_keeps_unfinished_json():
+    scanner, stopped_at = _feed(['{"reviews": [{"review_id": 1}, {"rev'])
+
+    assert stopped_at is None
+    assert scanner.text == '{"reviews": [{"review_id": 1}, {"rev'
+
+
+class StreamingClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+        self.closed = False
+        self.kwargs = None
+
+    def astream(self, prompt, **kwargs):
+        self.kwargs = kwargs
+
+        async def generate():
+            try:
+                for chunk in self.chunks:
+                    self.sent += 1
+                    yield AIMessageChunk(content=chunk)
+            finally:
+                self.closed = True
+
+        return generate()
+
+
+@pytest.mark.asyncio
+async def test_stream_is_closed_once_json_is_complete():
+    client = StreamingClient(["<think>x</think>", '{"ideas_by_category": ', "[]}", " и еще", " много", " текста"])
+
+    message = await stream_until_json(client, "prompt", max_tokens=100)
+
+    assert message.content == '{"ideas_by_category": []}'
+    # Поток закрывается на первом тексте после JSON
+    assert client.sent == 4
+    assert client.closed
+    assert client.kwargs == {"max_tokens": 100}
+
+
+@pytest.mark.asyncio
+async def test_stream_keeps_usage_sent_after_json():
+    usage = {"input_tokens": 120, "output_tokens": 9, "total_tokens": 129}
+
+    async def generate():
+        yield AIMessageChunk(content='{"a": 1}')
+        yield AIMessageChunk(content="")
+        yield AIMessageChunk(content="", usage_metadata=usage)
+
+    class UsageClient:
+        def astream(self, prompt, **kwargs):
+            return generate()
+
+    message = await stream_until_json(UsageClient(), "prompt")
+
+    assert message.content == '{"a": 1}'
+    assert message.usage_metadata == usage
+
+
+@pytest.mark.asyncio
+async def test_llm_astream_routes_through_backend_pool(monkeypatch):
+    from src.agent.utils import LLM
+    from src.settings import settings
+
+    monkeypatch.setattr(settings, "LLM_HEALTH_CHECK_INTERVAL", 0)
+    llm = LLM(backends=["http://a:8080/v1"])
+    client = StreamingClient(['{"a": 1}', " хвост"])
+    llm.pool.backends[0].client = client
+
+    message = await llm.astream("prompt", max_tokens=10)
+
+    assert message.content == '{"a": 1}'
+    assert client.sent == 2 and client.closed
+    assert llm.pool.backends[0].in_flight == 0
@@ -0,0 +1,39 @@
+import pytest
+
+from src.agent import transport
+from src.agent.utils import LLM
+from src.settings import settings
+
+
+@pytest.mark.asyncio
+async def test_llm_instances_share_pooled_http_client(monkeypatch):
+    await transport.aclose_http_client()
+    monkeypatch.setattr(settings, "LLM_HTTP_MAX_CONNECTIONS", 7)
+    monkeypatch.setattr(settings, "LLM_CONNECT_TIMEOUT", 2.5)
+
+    first, second = LLM(), LLM(model="other-model")
+
+    client = transport.get_http_client()
+    assert first._llm.http_async_client is client
+    assert second._llm.http_async_client is client
+    assert client._transport._pool._max_connections == 7
+    assert first._llm.request_timeout.connect == 2.5
+
+    await transport.aclose_http_client()
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_llm_moves_to_new_http_client_after_shutdown():
+    llm = LLM()
+    old = llm._llm
+
+    # Остановка приложения закрывает общий клиент; следующий lifespan создает новый
+    await transport.aclose_http_client()
+    llm._ensure_http_client()
+
+    assert llm._llm is not old
+    assert llm._llm.http_async_client is transport.get_http_client()
+    assert not llm._llm.http_async_client.is_closed
+    assert llm.pool.backends[0].client is llm._llm
+    await transport.aclose_http_client()
@@ -0,0 +1,49 @@
+import argparse
+import logging
+import sys
+
+from src.services.distilled import train_from_cache
+from src.settings import settings
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Train the local TF-IDF classifier on LLM answers stored in the result cache"
+    )
+    parser.add_argument(
+        "--cache", default=settings.CACHE_SQLITE_PATH, help="SQLite result cache (CACHE_SQLITE_PATH)"
+    )
+    parser.add_argument(
+        "--output", default=settings.DISTILLED_MODEL_PATH, help="Where to save the model (DISTILLED_MODEL_PATH)"
+    )
+    parser.add_argument("--test-size", type=float, default=0.2, help="Held-out share for the agreement report")
+    parser.add_argument(
+        "--threshold", type=float, default=settings.DISTILLED_THRESHOLD, help="Probability threshold (DISTILLED_THRESHOLD)"
+    )
+    args = parser.parse_args()
+
+    if not args.cache:
+        logger.error("No result cache to train on: set CACHE_SQLITE_PATH or pass --cache")
+        return 1
+
+    settings.DISTILLED_THRESHOLD = args.threshold
+    try:
+        _, agreement, speed = train_from_cache(args.cache, args.output, test_size=args.test_size)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+
+    logger.info(f"Held-out reviews: {agreement.reviews}")
+    logger.info(f"Answered without LLM at threshold {args.threshold}: {agreement.coverage:.1%}")
+    logger.info(f"Agreement with LLM on answered reviews: {agreement.agreement:.1%}")
+    logger.info(f"Agreement with LLM without threshold: {agreement.accuracy:.1%}")
+    logger.info(f"Inference speed: {speed:,.0f} reviews/s")
+    logger.info(f"Model saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())